@@ -51,10 +51,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'patients.middleware.MetricsMiddleware',
+    'patients.middleware.LoadSheddingMiddleware',
+    'patients.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'patients.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +67,8 @@ ROOT_URLCONF = 'medlyst_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing each render for /metrics
+        'BACKEND': 'patients.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -97,6 +102,24 @@ else:
         }
     }
 
+# Opt-in SQLite profile for sites running several workers on one SQLite
+# file (SQLITE_CONCURRENT=true): write transactions use BEGIN IMMEDIATE and
+# every new connection gets SQLITE_PRAGMAS (see patients/sqlite_backend)
+SQLITE_CONCURRENT = os.environ.get('SQLITE_CONCURRENT', 'False').lower() == 'true'
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer, or the writer readers
+    'journal_mode': 'WAL',
+    # Milliseconds a writer waits for the lock before "database is locked"
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    # Durable in WAL mode except for the last commits on power loss
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    'cache_size': -64 * 1024,
+}
+if SQLITE_CONCURRENT and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['ENGINE'] = 'patients.sqlite_backend'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -148,8 +171,135 @@ if 'DATABASE_URL' in os.environ:
     except ImportError:
         pass
 
+# Tasks due within this many hours are flagged "due soon" by the sweeper
+TASK_DUE_SOON_HOURS = int(os.environ.get('TASK_DUE_SOON_HOURS', '2'))
+
+# Consult SLAs: hours from request to first review, and to completion
+CONSULT_ACCEPT_SLA_HOURS = int(os.environ.get('CONSULT_ACCEPT_SLA_HOURS', '4'))
+CONSULT_COMPLETE_SLA_HOURS = int(os.environ.get('CONSULT_COMPLETE_SLA_HOURS', '24'))
+
+# Delta sync: rows changed in the last few seconds are held back until the
+# next poll (a write may stamp updated_at before it commits); tombstones for
+# deleted rows are kept this many days, and older cursors must resync.
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', '5'))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '30'))
+
+# On-demand profiling: a staff user adds ?profile=1 (or sends X-Profile: 1)
+# to run that request under cProfile. The newest PROFILE_KEEP profiles are
+# kept in PROFILE_DIR and listed at /admin/profiles/.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+
+# Prometheus metrics at /metrics. Each worker process writes its counters
+# to its own file in METRICS_DIR and the endpoint sums them, so the
+# directory must be shared by all workers on a host (start.sh clears it on
+# startup). Set METRICS_TOKEN to require "Authorization: Bearer <token>".
+# Business gauges are cached for METRICS_GAUGE_SECONDS.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_GAUGE_SECONDS = int(os.environ.get('METRICS_GAUGE_SECONDS', '15'))
+
+# Single-flight rendering for the kiosk wall-board pages (/kiosk/...):
+# identical concurrent requests share one query and render. Within a worker
+# followers wait for the leader thread; across workers a file lock per page
+# in SINGLE_FLIGHT_DIR (shared by all workers on a host) queues the leaders,
+# which reuse a render that finished after they arrived. No one waits more
+# than SINGLE_FLIGHT_WAIT seconds before rendering for itself.
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', 'True').lower() == 'true'
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', os.path.join(BASE_DIR, 'singleflight'))
+SINGLE_FLIGHT_WAIT = float(os.environ.get('SINGLE_FLIGHT_WAIT', '5'))
+KIOSK_REFRESH_SECONDS = int(os.environ.get('KIOSK_REFRESH_SECONDS', '30'))
+
+# Duplicate-patient detection (detect_duplicate_patients). Patients are only
+# compared within blocks: NHIs one character apart, or surnames with the same
+# Soundex code arriving within DUPLICATE_ARRIVAL_WINDOW_DAYS of each other.
+# Blocks bigger than DUPLICATE_MAX_BLOCK_SIZE are too unspecific to score.
+# Pairs scoring at least DUPLICATE_SCORE_THRESHOLD (0-1) are listed in the
+# admin for review.
+DUPLICATE_ARRIVAL_WINDOW_DAYS = int(os.environ.get('DUPLICATE_ARRIVAL_WINDOW_DAYS', '2'))
+DUPLICATE_MAX_BLOCK_SIZE = int(os.environ.get('DUPLICATE_MAX_BLOCK_SIZE', '200'))
+DUPLICATE_SCORE_THRESHOLD = float(os.environ.get('DUPLICATE_SCORE_THRESHOLD', '0.7'))
+
+# Per-worker concurrency limits by endpoint class (URL names), enforced by
+# LoadSheddingMiddleware. A request over its class's limit waits up to
+# max_wait seconds for a slot, with at most max_queue waiting; the rest get
+# an immediate 503 with Retry-After (seconds). Heavy lists and exports are
+# capped below the worker's thread count (GUNICORN_THREADS in start.sh) so
+# they can never take every thread from the take-list and queue polls.
+# Views not listed here are not limited.
+ENDPOINT_LIMITS = {
+    'poll': {
+        'views': [
+            'take_list', 'kiosk_take_list', 'consult_queues', 'consult_queues_api', 'task_worklist_api', 'sync_api',
+        ],
+        'limit': int(os.environ.get('POLL_CONCURRENCY', '4')),
+        'max_wait': float(os.environ.get('POLL_MAX_WAIT', '2')),
+        'max_queue': 16,
+        'retry_after': 2,
+    },
+    'heavy': {
+        'views': [
+            'patient_list', 'weekend_review_list', 'consults_list', 'task_worklist',
+            'take_flow_report', 'cohort_analytics',
+        ],
+        'limit': int(os.environ.get('HEAVY_CONCURRENCY', '2')),
+        'max_wait': float(os.environ.get('HEAVY_MAX_WAIT', '1')),
+        'max_queue': 4,
+        'retry_after': 10,
+    },
+}
+
+# Cache used by cache-backed sessions. Set REDIS_URL to share it between
+# worker processes (requires the redis package); the default is per-process.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'patients.metrics.MeteredRedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'patients.metrics.MeteredLocMemCache',
+        }
+    }
+
+# Sessions: SESSION_BACKEND is db, cached_db, cache or signed_cookies.
+# cached_db serves session reads from the cache, so it is only the default
+# when the cache is shared; a per-process cache would serve stale sessions
+# (e.g. after logout) from the other workers.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cached_db' if os.environ.get('REDIS_URL') else 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+
+# Flash messages: MESSAGE_BACKEND is fallback, cookie or session. Fallback
+# keeps messages in the cookie (so the redirect after each workflow POST
+# stays off the session table) and only spills ones too large for it to the
+# session; cookie alone drops them.
+MESSAGE_STORAGES = {
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+}
+MESSAGE_STORAGE = MESSAGE_STORAGES[os.environ.get('MESSAGE_BACKEND', 'fallback')]
+
 # Whitenoise static files
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Hashed file names let WhiteNoise serve CSS/JS with far-future cache headers;
+# gzip (and brotli, when installed) copies are built by collectstatic.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Security settings for production
 if not DEBUG:
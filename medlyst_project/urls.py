@@ -17,7 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from patients import views as patient_views
+
 urlpatterns = [
+    # Ahead of the admin's own URLs, which would 404 anything they don't know
+    path('admin/profiles/', patient_views.profile_list, name='profile_list'),
+    path('admin/profiles/<str:profile_id>/', patient_views.profile_detail, name='profile_detail'),
     path('admin/', admin.site.urls),
     path('', include('patients.urls')),
 ]
@@ -1,31 +1,104 @@
+import re
+
 from django.contrib import admin
-from .models import Patient, ConsultRequest, WardRound, Task
+from django.utils import timezone
+from .models import Clinician, Patient, ConsultRequest, WardRound, Task, DuplicateCandidate
+from .pagination import EstimatedCountPaginator
+
+
+# A full NHI (ABC1234) or a prefix of one that includes at least one digit
+NHI_SEARCH_RE = re.compile(r'^[A-Za-z]{3}\d{1,4}$')
+
+
+class PerformanceAdmin(admin.ModelAdmin):
+    """Changelist defaults for large tables.
+    
+    Skips the second unfiltered COUNT(*) on filtered pages, estimates the
+    unfiltered count on PostgreSQL, and answers NHI-shaped searches with an
+    indexed prefix match instead of icontains scans over every search field.
+    """
+    
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    nhi_field = 'patient__nhi_number'
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if NHI_SEARCH_RE.match(term):
+            # NHIs are stored upper case; a case-sensitive prefix match can
+            # use the unique index (the varchar_pattern_ops one on PostgreSQL)
+            return queryset.filter(**{f'{self.nhi_field}__startswith': term.upper()}), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Clinician)
+class ClinicianAdmin(admin.ModelAdmin):
+    list_display = ['name', 'active', 'created_at']
+    list_filter = ['active']
+    search_fields = ['name']
+    readonly_fields = ['normalized_name', 'created_at']
 
 
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(PerformanceAdmin):
     list_display = ['name', 'nhi_number', 'current_responsible_team', 'clerking_status', 'post_take_ward_round_status', 'datetime_of_arrival']
     list_filter = ['current_responsible_team', 'current_parent_specialty', 'clerking_status', 'post_take_ward_round_status', 'referral_source', 'admission_type']
-    search_fields = ['name', 'nhi_number']
+    search_fields = ['name', '=nhi_number']
     readonly_fields = ['created_at', 'updated_at']
+    date_hierarchy = 'datetime_of_arrival'
+    nhi_field = 'nhi_number'
 
 
 @admin.register(ConsultRequest)
-class ConsultRequestAdmin(admin.ModelAdmin):
+class ConsultRequestAdmin(PerformanceAdmin):
     list_display = ['patient', 'specialty', 'status', 'requested_by', 'requested_at']
     list_filter = ['specialty', 'status']
-    search_fields = ['patient__name', 'patient__nhi_number']
+    list_select_related = ['patient', 'requested_by']
+    search_fields = ['patient__name', '=patient__nhi_number']
+    date_hierarchy = 'requested_at'
 
 
 @admin.register(WardRound)
-class WardRoundAdmin(admin.ModelAdmin):
+class WardRoundAdmin(PerformanceAdmin):
     list_display = ['patient', 'ward_round_type', 'doctor', 'timestamp']
     list_filter = ['ward_round_type']
-    search_fields = ['patient__name', 'patient__nhi_number', 'doctor']
+    list_select_related = ['patient', 'doctor']
+    search_fields = ['patient__name', '=patient__nhi_number', 'doctor__name']
+    date_hierarchy = 'timestamp'
 
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(PerformanceAdmin):
     list_display = ['patient', 'description', 'priority', 'status', 'assigned_to', 'created_at']
     list_filter = ['priority', 'status']
-    search_fields = ['patient__name', 'patient__nhi_number', 'description']
+    list_select_related = ['patient', 'assigned_to']
+    search_fields = ['patient__name', '=patient__nhi_number', 'description']
+    date_hierarchy = 'created_at'
+
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(PerformanceAdmin):
+    """Probable duplicate patients found by detect_duplicate_patients, best match first"""
+    
+    list_display = ['patient', 'patient_nhi', 'other', 'other_nhi', 'score', 'reasons', 'status', 'detected_at']
+    list_filter = ['status']
+    list_select_related = ['patient', 'other']
+    search_fields = ['patient__name', 'other__name', '=patient__nhi_number', '=other__nhi_number']
+    readonly_fields = ['patient', 'other', 'score', 'reasons', 'detected_at', 'reviewed_at']
+    actions = ['mark_duplicate', 'mark_not_duplicate']
+    
+    @admin.display(description='NHI', ordering='patient__nhi_number')
+    def patient_nhi(self, candidate):
+        return candidate.patient.nhi_number
+    
+    @admin.display(description='Other NHI', ordering='other__nhi_number')
+    def other_nhi(self, candidate):
+        return candidate.other.nhi_number
+    
+    @admin.action(description='Mark selected pairs as confirmed duplicates')
+    def mark_duplicate(self, request, queryset):
+        queryset.update(status='DUPLICATE', reviewed_at=timezone.now())
+    
+    @admin.action(description='Mark selected pairs as not duplicates')
+    def mark_not_duplicate(self, request, queryset):
+        queryset.update(status='NOT_DUPLICATE', reviewed_at=timezone.now())
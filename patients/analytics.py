@@ -0,0 +1,258 @@
+import csv
+import math
+
+from django.utils import timezone
+
+from .models import Patient, TakeFlowRollup
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; cohort analytics need it
+    np = None
+
+
+# Patient columns each report can be broken down by: name -> (field, choices)
+DIMENSIONS = {
+    'team': ('current_responsible_team', Patient.TEAM_CHOICES),
+    'specialty': ('current_parent_specialty', Patient.SPECIALTY_CHOICES),
+    'referral_source': ('referral_source', Patient.REFERRAL_SOURCE_CHOICES),
+    'admission_type': ('admission_type', Patient.ADMISSION_TYPE_CHOICES),
+}
+
+# Durations reported, as (start, end) Patient timestamps. Patients have no
+# discharge time yet, so length of stay runs from arrival to the report time.
+METRICS = {
+    'length_of_stay': ('datetime_of_arrival', None),
+    'arrival_to_referral': ('datetime_of_arrival', 'referral_to_specialty_datetime'),
+    'referral_to_clerking': TakeFlowRollup.METRIC_FIELDS['REFERRAL_TO_CLERKING'],
+    'clerking_to_ptwr': TakeFlowRollup.METRIC_FIELDS['CLERKING_TO_PTWR'],
+    'ptwr_to_admission': TakeFlowRollup.METRIC_FIELDS['PTWR_TO_ADMISSION'],
+}
+
+TIMESTAMP_FIELDS = list(dict.fromkeys(
+    field for fields in METRICS.values() for field in fields if field
+))
+
+PERCENTILES = [50, 90, 95]
+
+# Coarse histogram bands (hours) included in the report
+HISTOGRAM_BANDS = [1, 2, 4, 8, 12, 24, 48, 168]
+
+# Fine log-spaced bins (hours) used for percentiles: 1 minute to 1 year in
+# 1200 bins keeps every estimate within about 1% of the true value while
+# memory stays fixed however many rows are read.
+FINE_BIN_RANGE = (1 / 60, 24 * 365)
+FINE_BIN_COUNT = 1200
+
+
+class AnalyticsUnavailable(Exception):
+    """Raised when numpy is not installed"""
+
+
+class CohortAccumulator:
+    """Vectorised per-group duration statistics built up one chunk at a time.
+
+    Each (metric, dimension) keeps a groups x bins count matrix plus per-group
+    sums and maxima, so memory depends on the number of groups and bins and
+    not on the number of rows added.
+    """
+
+    def __init__(self, now=None):
+        if np is None:
+            raise AnalyticsUnavailable('numpy is required for cohort analytics')
+        self.now = (now or timezone.now()).timestamp()
+        self.edges = np.geomspace(*FINE_BIN_RANGE, FINE_BIN_COUNT)
+        self.bands = np.array(HISTOGRAM_BANDS, dtype=np.float64)
+        self.rows = 0
+
+        self.groups = {
+            # The final group collects blank or unrecognised codes
+            dimension: [code for code, _ in choices] + ['']
+            for dimension, (_, choices) in DIMENSIONS.items()
+        }
+        bins = len(self.edges) + 1
+        self.counts = {}
+        self.sums = {}
+        self.maxima = {}
+        self.band_counts = {}
+        for metric in METRICS:
+            self.band_counts[metric] = np.zeros(len(self.bands) + 1, dtype=np.int64)
+            for dimension, groups in self.groups.items():
+                key = (metric, dimension)
+                self.counts[key] = np.zeros((len(groups), bins), dtype=np.int64)
+                self.sums[key] = np.zeros(len(groups), dtype=np.float64)
+                self.maxima[key] = np.full(len(groups), -np.inf)
+
+    def add_chunk(self, timestamps, codes):
+        """Add one chunk of rows.
+
+        ``timestamps`` maps each of TIMESTAMP_FIELDS to a float64 array of
+        epoch seconds (NaN for null); ``codes`` maps each dimension to an
+        integer array of group indexes into ``self.groups[dimension]``.
+        """
+        size = len(next(iter(codes.values())))
+        self.rows += size
+        bins = len(self.edges) + 1
+
+        for metric, (start, end) in METRICS.items():
+            end_values = timestamps[end] if end else np.full(size, self.now)
+            hours = (end_values - timestamps[start]) / 3600
+            valid = ~np.isnan(hours)
+            hours = np.maximum(hours[valid], 0)
+            fine = np.searchsorted(self.edges, hours, side='right')
+            self.band_counts[metric] += np.bincount(
+                np.searchsorted(self.bands, hours, side='right'), minlength=len(self.bands) + 1
+            )
+
+            for dimension, groups in self.groups.items():
+                key = (metric, dimension)
+                group = codes[dimension][valid]
+                self.counts[key] += np.bincount(
+                    group * bins + fine, minlength=len(groups) * bins
+                ).reshape(len(groups), bins)
+                self.sums[key] += np.bincount(group, weights=hours, minlength=len(groups))
+                np.maximum.at(self.maxima[key], group, hours)
+
+    def _percentiles(self, counts):
+        """Percentile estimates (hours) for each row of a count matrix"""
+        totals = counts.sum(axis=1)
+        cumulative = counts.cumsum(axis=1)
+        # Representative value of each fine bin: its geometric midpoint
+        lower = np.concatenate([[0.0], self.edges])
+        upper = np.concatenate([self.edges, [self.edges[-1]]])
+        midpoints = np.sqrt(lower * upper)
+        result = {}
+        for p in PERCENTILES:
+            rank = np.ceil(totals * p / 100)
+            index = (cumulative < rank[:, None]).sum(axis=1)
+            result[p] = midpoints[np.minimum(index, len(midpoints) - 1)]
+        return result
+
+    def report(self):
+        """Summary dict with overall and per-group stats for every metric"""
+        def stats(count, total, maximum, percentiles, i):
+            if not count:
+                return {'count': 0, 'mean_hours': None, 'max_hours': None,
+                        **{f'p{p}_hours': None for p in PERCENTILES}}
+            return {
+                'count': int(count),
+                'mean_hours': round(float(total / count), 2),
+                'max_hours': round(float(maximum), 2),
+                **{f'p{p}_hours': round(float(percentiles[p][i]), 2) for p in PERCENTILES},
+            }
+
+        labels = {
+            dimension: dict(choices) for dimension, (_, choices) in DIMENSIONS.items()
+        }
+        metrics = {}
+        first_dimension = next(iter(DIMENSIONS))
+        for metric in METRICS:
+            # Every row falls in exactly one group, so any dimension's
+            # groups sum to the overall distribution
+            key = (metric, first_dimension)
+            overall_counts = self.counts[key].sum(axis=0, keepdims=True)
+            overall_percentiles = self._percentiles(overall_counts)
+            metrics[metric] = {
+                'overall': stats(
+                    overall_counts.sum(), self.sums[key].sum(),
+                    self.maxima[key].max(), overall_percentiles, 0,
+                ),
+                'histogram': [
+                    {'label': label, 'count': int(count)}
+                    for label, count in zip(self.band_labels(), self.band_counts[metric])
+                ],
+                'by': {},
+            }
+            for dimension, groups in self.groups.items():
+                key = (metric, dimension)
+                counts = self.counts[key]
+                percentiles = self._percentiles(counts)
+                totals = counts.sum(axis=1)
+                metrics[metric]['by'][dimension] = [
+                    dict(
+                        stats(totals[i], self.sums[key][i], self.maxima[key][i], percentiles, i),
+                        group=group or '-',
+                        label=labels[dimension].get(group, 'Unspecified'),
+                    )
+                    for i, group in enumerate(groups)
+                    if totals[i]
+                ]
+
+        return {
+            'generated_at': timezone.now().isoformat(),
+            'rows': self.rows,
+            'metrics': metrics,
+        }
+
+    def band_labels(self):
+        bands = [int(band) for band in HISTOGRAM_BANDS]
+        return (
+            [f'<{bands[0]}h']
+            + [f'{low}-{high}h' for low, high in zip(bands, bands[1:])]
+            + [f'{bands[-1]}h+']
+        )
+
+
+def _epoch_seconds(values):
+    return np.fromiter(
+        (math.nan if value is None else value.timestamp() for value in values),
+        dtype=np.float64,
+        count=len(values),
+    )
+
+
+def _group_codes(values, groups):
+    index = {code: i for i, code in enumerate(groups)}
+    other = len(groups) - 1
+    return np.fromiter(
+        (index.get(value, other) for value in values), dtype=np.int64, count=len(values)
+    )
+
+
+def iter_patient_chunks(queryset, groups, chunk_size=50000):
+    """Yield (timestamps, codes) column arrays for ``queryset`` in id order.
+
+    Each chunk is a keyset query (id > last seen id) so only ``chunk_size``
+    rows are held in memory at a time.
+    """
+    dimension_fields = [field for field, _ in DIMENSIONS.values()]
+    fields = ['id'] + TIMESTAMP_FIELDS + dimension_fields
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list(*fields)[:chunk_size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        columns = dict(zip(fields, zip(*rows)))
+        timestamps = {field: _epoch_seconds(columns[field]) for field in TIMESTAMP_FIELDS}
+        codes = {
+            dimension: _group_codes(columns[field], groups[dimension])
+            for dimension, (field, _) in DIMENSIONS.items()
+        }
+        yield timestamps, codes
+
+
+def cohort_report(queryset=None, chunk_size=50000, now=None):
+    """Build the cohort report for ``queryset`` (all patients by default)"""
+    accumulator = CohortAccumulator(now=now)
+    if queryset is None:
+        queryset = Patient.objects.all()
+    for timestamps, codes in iter_patient_chunks(queryset, accumulator.groups, chunk_size):
+        accumulator.add_chunk(timestamps, codes)
+    return accumulator.report()
+
+
+def write_report_csv(report, output):
+    """Write the report as one CSV row per metric and group"""
+    columns = ['count', 'mean_hours'] + [f'p{p}_hours' for p in PERCENTILES] + ['max_hours']
+    writer = csv.writer(output)
+    writer.writerow(['metric', 'dimension', 'group', 'label'] + columns)
+    for metric, data in report['metrics'].items():
+        writer.writerow([metric, 'all', '', 'All patients'] + [data['overall'][c] for c in columns])
+        for dimension, rows in data['by'].items():
+            for row in rows:
+                writer.writerow(
+                    [metric, dimension, row['group'], row['label']] + [row[c] for c in columns]
+                )
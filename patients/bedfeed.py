@@ -0,0 +1,139 @@
+import json
+import os
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Patient
+from .signals import patient_locations_changed
+
+
+LOCATIONS = {code for code, _ in Patient.LOCATION_CHOICES}
+
+# Feed files are read in name order; writers create them under a temporary
+# name (leading dot or .tmp suffix) and rename, so half-written files are skipped
+FEED_SUFFIXES = ('.ndjson', '.jsonl', '.json')
+
+# A feed event after validation; ``received`` is when it was written to the feed
+BedEvent = namedtuple('BedEvent', 'nhi_number location bed_number received')
+
+LocationChange = namedtuple(
+    'LocationChange', 'patient_id nhi_number old_location old_bed_number location bed_number',
+)
+
+
+class FeedError(Exception):
+    """Raised for a feed line that can't be applied"""
+
+
+def feed_files(directory):
+    """Complete feed files waiting in ``directory``, oldest name first"""
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(FEED_SUFFIXES) and not name.startswith('.')
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def parse_event(line, file_time):
+    """Validate one feed line: {"nhi_number", "location", "bed_number", "timestamp"}.
+
+    ``timestamp`` (when the ADT system recorded the move) is optional and
+    defaults to the file's modification time.
+    """
+    try:
+        data = json.loads(line)
+    except ValueError as exc:
+        raise FeedError(f'invalid JSON: {exc}')
+    if not isinstance(data, dict):
+        raise FeedError('line is not a JSON object')
+
+    nhi_number = str(data.get('nhi_number') or '').strip().upper()
+    if not nhi_number:
+        raise FeedError('nhi_number is required')
+    location = str(data.get('location') or '').strip().upper()
+    if location not in LOCATIONS:
+        raise FeedError(f'location {location!r} is not one of {", ".join(sorted(LOCATIONS))}')
+    bed_number = data.get('bed_number')
+    if bed_number in (None, ''):
+        bed_number = None
+    elif not str(bed_number).isdigit() or int(bed_number) < 1:
+        raise FeedError(f'bed_number {bed_number!r} is not a positive whole number')
+    else:
+        bed_number = int(bed_number)
+
+    received = file_time
+    if data.get('timestamp'):
+        try:
+            received = parse_datetime(str(data['timestamp']))
+        except ValueError:
+            received = None
+        if received is None:
+            raise FeedError(f'timestamp {data["timestamp"]!r} is not an ISO 8601 date and time')
+        if timezone.is_naive(received):
+            received = timezone.make_aware(received)
+    return BedEvent(nhi_number, location, bed_number, received)
+
+
+def coalesce(events):
+    """Keep the latest event per NHI (by timestamp, then feed order)"""
+    latest = {}
+    for event in events:
+        current = latest.get(event.nhi_number)
+        if current is None or event.received >= current.received:
+            latest[event.nhi_number] = event
+    return latest
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def apply_moves(latest):
+    """Write the real location/bed changes in ``latest`` ({NHI: BedEvent}).
+
+    Current values are read under select_for_update and only patients whose
+    location or bed actually differs are written, with one UPDATE ... CASE
+    for all of them (split only to stay under SQLite's parameter limit).
+    Written rows get a new version and updated_at, so open forms see the
+    conflict and delta sync picks the move up. Returns (changes, unknown
+    NHIs); patient_locations_changed is sent with the changes on commit.
+    """
+    # Each change costs a handful of parameters in the CASE expressions
+    chunk_size = (connection.features.max_query_params or 6000) // 6
+    changes = []
+    with transaction.atomic():
+        found = set()
+        for nhi_numbers in _chunks(sorted(latest), chunk_size):
+            rows = (
+                Patient.objects.select_for_update()
+                .filter(nhi_number__in=nhi_numbers)
+                .order_by('pk')
+                .values_list('pk', 'nhi_number', 'location', 'bed_number')
+            )
+            for patient_id, nhi_number, location, bed_number in rows:
+                found.add(nhi_number)
+                event = latest[nhi_number]
+                if (event.location, event.bed_number) != (location, bed_number):
+                    changes.append(LocationChange(
+                        patient_id, nhi_number, location, bed_number, event.location, event.bed_number,
+                    ))
+
+        now = timezone.now()
+        for chunk in _chunks(changes, chunk_size):
+            Patient.objects.filter(pk__in=[change.patient_id for change in chunk]).update(
+                location=Case(*[When(pk=change.patient_id, then=Value(change.location)) for change in chunk]),
+                bed_number=Case(
+                    *[When(pk=change.patient_id, then=Value(change.bed_number)) for change in chunk],
+                    output_field=IntegerField(),
+                ),
+                version=F('version') + 1,
+                updated_at=now,
+            )
+        if changes:
+            transaction.on_commit(lambda: patient_locations_changed.send(sender=Patient, changes=changes))
+    return changes, sorted(set(latest) - found)
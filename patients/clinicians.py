@@ -0,0 +1,35 @@
+import threading
+import time
+
+from .metrics import registry
+from .models import Clinician
+
+
+# Other worker processes only see changes once their copy expires, so keep
+# this short enough that a newly added clinician appears promptly everywhere.
+CACHE_TTL_SECONDS = 60
+
+_lock = threading.Lock()
+_cached = None
+_loaded_at = 0.0
+
+
+def clinician_choices():
+    """Active (id, name) pairs for form dropdowns, cached per process"""
+    global _cached, _loaded_at
+    cached = _cached
+    if cached is not None and time.monotonic() - _loaded_at < CACHE_TTL_SECONDS:
+        registry.inc('medlyst_cache_requests_total', {'cache': 'clinicians', 'result': 'hit'})
+        return cached
+    registry.inc('medlyst_cache_requests_total', {'cache': 'clinicians', 'result': 'miss'})
+    with _lock:
+        if _cached is None or time.monotonic() - _loaded_at >= CACHE_TTL_SECONDS:
+            _cached = tuple(Clinician.objects.filter(active=True).values_list('id', 'name'))
+            _loaded_at = time.monotonic()
+        return _cached
+
+
+def invalidate_clinician_cache(**kwargs):
+    """Drop this process's cached list; connected to Clinician save/delete"""
+    global _cached
+    _cached = None
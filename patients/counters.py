@@ -0,0 +1,73 @@
+import time
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ConsultRequest, Patient, Task
+
+
+def _count(model, **filters):
+    rows = (
+        model.objects.filter(patient=OuterRef('pk'), **filters)
+        .order_by()
+        .values('patient')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+# Each counter recounted from its source rows; these must agree with
+# Task.open_work and ConsultRequest.open_work
+ACTUAL_COUNTS = {
+    'open_task_count': lambda: _count(Task, status__in=Task.OPEN_STATUSES),
+    'urgent_task_count': lambda: _count(Task, status__in=Task.OPEN_STATUSES, priority='URGENT'),
+    'open_consult_count': lambda: _count(ConsultRequest, status__in=ConsultRequest.QUEUE_STATUSES),
+}
+
+
+def reconcile_open_work_counts(batch_size=1000, pause=0.0):
+    """Recount every patient's open work and correct counters that drifted.
+
+    Walks patients by id in batches of ``batch_size``. Each batch is locked
+    (select_for_update) before it is recounted, so a task or consult saved
+    meanwhile either is in the recount or increments the corrected value
+    once the batch commits. Returns (patients checked, corrections), with
+    each correction as (patient id, {counter: (stored, actual)}).
+    """
+    checked = 0
+    corrections = []
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Patient.objects.select_for_update()
+                .filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            rows = (
+                Patient.objects.filter(pk__in=ids)
+                .order_by()
+                .values('pk', *Patient.COUNTER_FIELDS)
+                .annotate(**{f'actual_{name}': count() for name, count in ACTUAL_COUNTS.items()})
+            )
+            for row in rows:
+                drift = {
+                    name: (row[name], row[f'actual_{name}'])
+                    for name in Patient.COUNTER_FIELDS
+                    if row[name] != row[f'actual_{name}']
+                }
+                if drift:
+                    Patient._base_manager.filter(pk=row['pk']).update(
+                        **{name: actual for name, (_, actual) in drift.items()}
+                    )
+                    corrections.append((row['pk'], drift))
+        checked += len(ids)
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
+    return checked, corrections
@@ -0,0 +1,253 @@
+import re
+from datetime import timedelta
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DuplicateBlockKey, DuplicateCandidate, JobCheckpoint, Patient
+
+
+CHECKPOINT_NAME = 'duplicate_detection'
+
+# Words dropped before comparing names ("Dr. Jane Smith MD" -> "jane smith")
+NAME_NOISE = {'mr', 'mrs', 'ms', 'miss', 'mx', 'dr', 'prof', 'sir', 'dame', 'jr', 'sr', 'ii', 'iii', 'iv', 'md', 'phd'}
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+# Score weights: name similarity, surnames sounding alike, NHIs one
+# character apart, and how close together the arrivals were
+WEIGHTS = {'name': 0.5, 'surname': 0.2, 'nhi': 0.2, 'arrival': 0.1}
+
+# Values read for each patient when building keys and scoring
+PATIENT_FIELDS = ['id', *Patient.BLOCK_KEY_FIELDS]
+
+
+def name_tokens(name):
+    """Lower-case name words without titles and suffixes, surname last ("Smith, Jane" too)"""
+    if ',' in name:
+        surname, _, given = name.partition(',')
+        name = f'{given} {surname}'
+    words = re.findall(r"[^\W\d_]+(?:['-][^\W\d_]+)*", name.casefold())
+    return [word for word in words if word not in NAME_NOISE]
+
+
+def soundex(word):
+    """American Soundex code (R163 for Robert and Rupert); '' for an empty word"""
+    letters = [c for c in word.casefold() if 'a' <= c <= 'z']
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W don't separate letters with the same code; vowels do
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def _arrival_day(patient):
+    return timezone.localdate(patient['datetime_of_arrival'])
+
+
+def block_keys(patient):
+    """Blocking keys stored for a patient (a PATIENT_FIELDS dict).
+
+    One key per NHI position with that character wildcarded, so NHIs one
+    substitution apart share a key, and one for the surname's Soundex code
+    on the day of arrival.
+    """
+    nhi = patient['nhi_number']
+    keys = [f'nhi:{nhi[:i]}_{nhi[i + 1:]}' for i in range(len(nhi))]
+    tokens = name_tokens(patient['name'])
+    if tokens:
+        keys.append(f'name:{soundex(tokens[-1])}:{_arrival_day(patient).isoformat()}')
+    return keys
+
+
+def lookup_keys(patient):
+    """Keys whose patients ``patient`` is compared with: its NHI keys, and its
+    surname code on each day within DUPLICATE_ARRIVAL_WINDOW_DAYS of arrival"""
+    keys = [key for key in block_keys(patient) if key.startswith('nhi:')]
+    tokens = name_tokens(patient['name'])
+    if tokens:
+        code = soundex(tokens[-1])
+        day = _arrival_day(patient)
+        window = settings.DUPLICATE_ARRIVAL_WINDOW_DAYS
+        keys.extend(
+            f'name:{code}:{(day + timedelta(days=offset)).isoformat()}'
+            for offset in range(-window, window + 1)
+        )
+    return keys
+
+
+def score_pair(a, b):
+    """(score 0-1, reasons) for two patients (PATIENT_FIELDS dicts)"""
+    tokens_a, tokens_b = name_tokens(a['name']), name_tokens(b['name'])
+    similarity = SequenceMatcher(None, ' '.join(tokens_a), ' '.join(tokens_b)).ratio()
+    score = WEIGHTS['name'] * similarity
+    reasons = [f'names {similarity:.0%} alike']
+
+    if tokens_a and tokens_b and soundex(tokens_a[-1]) == soundex(tokens_b[-1]):
+        score += WEIGHTS['surname']
+        reasons.append('surnames sound alike')
+
+    nhi_a, nhi_b = a['nhi_number'], b['nhi_number']
+    if len(nhi_a) == len(nhi_b) and sum(x != y for x, y in zip(nhi_a, nhi_b)) <= 1:
+        score += WEIGHTS['nhi']
+        reasons.append(f'NHIs {nhi_a}/{nhi_b} one character apart')
+
+    gap = abs(a['datetime_of_arrival'] - b['datetime_of_arrival'])
+    window = timedelta(days=settings.DUPLICATE_ARRIVAL_WINDOW_DAYS + 1)
+    if gap < window:
+        score += WEIGHTS['arrival'] * (1 - gap / window)
+        hours = gap.total_seconds() / 3600
+        reasons.append(f'arrived {hours:.0f}h apart' if hours >= 1 else 'arrived within the hour')
+    return score, ', '.join(reasons)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _key_chunk():
+    # Each lookup key is a query parameter
+    return max(1, (connection.features.max_query_params or 2000) // 2)
+
+
+def _index(batch):
+    """Store ``batch``'s blocking keys and record its probable duplicates.
+
+    ``batch`` is a list of PATIENT_FIELDS dicts. Returns (pairs scored,
+    candidates added).
+    """
+    key_chunk = _key_chunk()
+    DuplicateBlockKey.objects.bulk_create(
+        [DuplicateBlockKey(key=key, patient_id=patient['id']) for patient in batch for key in block_keys(patient)],
+        batch_size=1000,
+    )
+
+    wanted = {key for patient in batch for key in lookup_keys(patient)}
+    blocks = {}
+    for keys in _chunks(sorted(wanted), key_chunk):
+        for key, patient_id in DuplicateBlockKey.objects.filter(key__in=keys).values_list('key', 'patient_id'):
+            blocks.setdefault(key, []).append(patient_id)
+
+    pairs = set()
+    for patient in batch:
+        for key in lookup_keys(patient):
+            members = blocks.get(key, ())
+            if len(members) > settings.DUPLICATE_MAX_BLOCK_SIZE:
+                continue
+            pairs.update(
+                (min(patient['id'], other), max(patient['id'], other))
+                for other in members if other != patient['id']
+            )
+
+    patients = {}
+    for ids in _chunks(sorted({pk for pair in pairs for pk in pair}), key_chunk):
+        patients.update((row['id'], row) for row in Patient.objects.filter(pk__in=ids).values(*PATIENT_FIELDS))
+    candidates = []
+    for first, second in sorted(pairs):
+        score, reasons = score_pair(patients[first], patients[second])
+        if score >= settings.DUPLICATE_SCORE_THRESHOLD:
+            candidates.append(DuplicateCandidate(
+                patient_id=first, other_id=second, score=round(score, 3), reasons=reasons,
+            ))
+    # Pairs already recorded are left alone by ignore_conflicts
+    existing = set()
+    for chunk in _chunks(candidates, key_chunk):
+        existing.update(
+            DuplicateCandidate.objects.filter(
+                patient_id__in={c.patient_id for c in chunk}, other_id__in={c.other_id for c in chunk},
+            ).values_list('patient_id', 'other_id')
+        )
+    DuplicateCandidate.objects.bulk_create(candidates, ignore_conflicts=True)
+    return len(pairs), sum((c.patient_id, c.other_id) not in existing for c in candidates)
+
+
+def detect_duplicates(full=False, batch_size=500):
+    """Index patients created since the last run and record probable duplicates.
+
+    Each new patient's blocking keys are stored in DuplicateBlockKey, and
+    only patients sharing a lookup key with it are scored, so the work
+    grows with the number of new patients times the (small) block sizes
+    rather than with every pair in the table. Blocks larger than
+    DUPLICATE_MAX_BLOCK_SIZE (a common surname on a busy day) are skipped
+    as too unspecific. Pairs scoring at least DUPLICATE_SCORE_THRESHOLD
+    become open DuplicateCandidates; pairs already recorded keep their
+    review status. ``full`` rebuilds the keys for every patient.
+
+    Returns (patients indexed, pairs scored, candidates added).
+    """
+    if full:
+        with transaction.atomic():
+            DuplicateBlockKey.objects.all().delete()
+            JobCheckpoint.objects.update_or_create(name=CHECKPOINT_NAME, defaults={'last_id': 0})
+
+    indexed = scored = added = 0
+    while True:
+        with transaction.atomic():
+            # Locked for the batch, so overlapping runs take turns
+            checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT_NAME)
+            batch = list(
+                Patient.objects.filter(pk__gt=checkpoint.last_id)
+                .order_by('pk')
+                .values(*PATIENT_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+
+            pairs, new = _index(batch)
+
+            checkpoint.last_id = batch[-1]['id']
+            checkpoint.save(update_fields=['last_id', 'updated_at'])
+        indexed += len(batch)
+        scored += pairs
+        added += new
+    return indexed, scored, added
+
+
+def refresh_block_keys(patient_ids):
+    """Re-index already indexed patients whose BLOCK_KEY_FIELDS changed.
+
+    Their old keys and open candidates are replaced by those for their
+    current values; reviewed candidates keep their status. Patients the
+    detection run hasn't reached yet are left for it. Returns the number
+    of patients re-indexed.
+    """
+    if not patient_ids:
+        return 0
+    with transaction.atomic():
+        # Waits for a detection batch in progress, which may be indexing
+        # these patients with their old values
+        last_id = (
+            JobCheckpoint.objects.select_for_update()
+            .filter(name=CHECKPOINT_NAME)
+            .values_list('last_id', flat=True)
+            .first()
+        )
+        ids = sorted(pk for pk in patient_ids if last_id and pk <= last_id)
+        if not ids:
+            return 0
+        for chunk in _chunks(ids, _key_chunk()):
+            DuplicateBlockKey.objects.filter(patient_id__in=chunk).delete()
+            DuplicateCandidate.objects.filter(
+                Q(patient_id__in=chunk) | Q(other_id__in=chunk), status='OPEN',
+            ).delete()
+        batch = []
+        for chunk in _chunks(ids, _key_chunk()):
+            batch.extend(Patient.objects.filter(pk__in=chunk).order_by('pk').values(*PATIENT_FIELDS))
+        _index(batch)
+    return len(batch)
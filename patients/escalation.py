@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import JobCheckpoint, Task
+
+
+CHECKPOINT_NAME = 'task_escalation'
+
+
+def sweep_overdue_tasks(now=None):
+    """Flag open tasks that became due-soon or overdue since the last sweep.
+
+    Each sweep only range-scans the (status, due_date) index between the
+    previous watermark and now, so its cost follows the number of tasks
+    whose due date has just passed rather than the size of the task table.
+    Tasks whose due date is edited behind the watermark are flagged on save.
+    Returns (newly_overdue, newly_due_soon).
+    """
+    now = now or timezone.now()
+    window = timedelta(hours=settings.TASK_DUE_SOON_HOURS)
+
+    with transaction.atomic():
+        checkpoint, _ = (
+            JobCheckpoint.objects.select_for_update()
+            .get_or_create(name=CHECKPOINT_NAME)
+        )
+        since = checkpoint.watermark
+
+        overdue = Task.objects.filter(status__in=Task.OPEN_STATUSES, due_date__lte=now)
+        due_soon = Task.objects.filter(
+            status__in=Task.OPEN_STATUSES,
+            due_date__gt=now,
+            due_date__lte=now + window,
+        )
+        if since is not None:
+            overdue = overdue.filter(due_date__gt=since)
+            due_soon = due_soon.filter(due_date__gt=since + window)
+
+        # update() bypasses auto_now; stamp updated_at so delta sync sees the change
+        newly_overdue = overdue.exclude(escalation='OVERDUE').update(
+            escalation='OVERDUE', escalated_at=now, updated_at=now
+        )
+        newly_due_soon = due_soon.filter(escalation='').update(
+            escalation='DUE_SOON', escalated_at=now, updated_at=now
+        )
+
+        checkpoint.watermark = now
+        checkpoint.save(update_fields=['watermark', 'updated_at'])
+
+    return newly_overdue, newly_due_soon
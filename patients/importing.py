@@ -0,0 +1,217 @@
+import json
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .bedfeed import LocationChange
+from .duplicates import refresh_block_keys
+from .models import Patient
+from .signals import patient_locations_changed
+
+
+# NHI: three letters then four digits, or the newer AAANNAA form
+NHI_RE = re.compile(r'^[A-Z]{3}(\d{4}|\d{2}[A-Z]{2})$')
+
+REQUIRED_FIELDS = [
+    'nhi_number', 'name', 'datetime_of_arrival', 'presenting_complaint',
+    'current_parent_specialty', 'current_responsible_team', 'referral_source', 'referral_time',
+]
+OPTIONAL_FIELDS = ['patient_category', 'location', 'bed_number', 'admission_type', 'referral_reason']
+
+# Columns owned by the PAS/ADT feed, refreshed on patients that already
+# exist. The rest are only set when a patient is first imported, so
+# workflow fields edited in MedLyst are never overwritten by an extract.
+PAS_FIELDS = [
+    'name', 'datetime_of_arrival', 'location', 'bed_number',
+    'referral_source', 'referral_time', 'admission_type',
+]
+
+DATETIME_FIELDS = {'datetime_of_arrival', 'referral_time'}
+
+CHOICES = {
+    field.name: {code for code, _ in field.choices}
+    for field in Patient._meta.concrete_fields
+    if field.choices
+}
+MAX_LENGTHS = {
+    field.name: field.max_length
+    for field in Patient._meta.concrete_fields
+    if field.max_length and not field.choices
+}
+
+
+class RowError(Exception):
+    """Raised for an extract row that fails validation"""
+
+
+def clean_row(raw):
+    """Validate one extract row (a dict) into Patient field values"""
+    values = {}
+    for name in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        value = raw.get(name)
+        value = '' if value is None else str(value).strip()
+        if not value:
+            if name in REQUIRED_FIELDS:
+                raise RowError(f'{name} is required')
+            continue
+
+        if name == 'nhi_number':
+            value = value.upper()
+            if not NHI_RE.match(value):
+                raise RowError(f'nhi_number {value!r} is not a valid NHI')
+        elif name in DATETIME_FIELDS:
+            try:
+                parsed = parse_datetime(value)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                raise RowError(f'{name} {value!r} is not an ISO 8601 date and time')
+            value = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+        elif name == 'bed_number':
+            if not value.isdigit() or int(value) < 1:
+                raise RowError(f'bed_number {value!r} is not a positive whole number')
+            value = int(value)
+        elif name in CHOICES:
+            value = value.upper()
+            if value not in CHOICES[name]:
+                raise RowError(f'{name} {value!r} is not one of {", ".join(sorted(CHOICES[name]))}')
+        elif name in MAX_LENGTHS and len(value) > MAX_LENGTHS[name]:
+            raise RowError(f'{name} is longer than {MAX_LENGTHS[name]} characters')
+        values[name] = value
+    return values
+
+
+def parse_batch(kind, header, items, lines):
+    """Parse and validate one batch of raw extract rows (run in the worker pool).
+
+    ``items`` are NDJSON lines, or CSV rows as lists matched against
+    ``header``, and ``lines`` the line number each one starts on. Returns
+    (values, rejects): valid rows as field dicts, and (line, NHI, error) for
+    each rejected row.
+    """
+    rows = []
+    rejects = []
+    for line, item in zip(lines, items):
+        if not item or kind == 'ndjson' and not item.strip():
+            # Blank line
+            continue
+        raw = {}
+        try:
+            if kind == 'ndjson':
+                try:
+                    raw = json.loads(item)
+                except ValueError as exc:
+                    raise RowError(f'invalid JSON: {exc}')
+                if not isinstance(raw, dict):
+                    raise RowError('line is not a JSON object')
+            else:
+                if len(item) != len(header):
+                    raise RowError(f'expected {len(header)} columns, found {len(item)}')
+                raw = dict(zip(header, item))
+            rows.append(clean_row(raw))
+        except RowError as exc:
+            rejects.append((line, str(raw.get('nhi_number') or ''), str(exc)))
+    return rows, rejects
+
+
+def upsert_patients(rows):
+    """Insert new patients and refresh PAS_FIELDS on existing ones (by NHI).
+
+    Uses INSERT ... ON CONFLICT (nhi_number) DO UPDATE in one transaction
+    per batch. Existing
+    rows are only updated, and their version and updated_at bumped, when a
+    PAS field actually changed, so re-importing an unchanged extract doesn't
+    invalidate open forms or resend every patient to sync clients. Returns
+    the number of rows inserted or changed. patient_locations_changed is sent
+    on commit for existing patients whose location or bed changed, and those
+    whose name or arrival changed get fresh duplicate detection keys.
+    """
+    # Within one statement a row may only be updated once; the last
+    # occurrence of an NHI in the batch wins
+    rows = list({values['nhi_number']: values for values in rows}.values())
+    if not rows:
+        return 0
+
+    # The real connection rather than the thread-local proxy, which is
+    # noticeably slow when preparing hundreds of thousands of parameters
+    db = connections[DEFAULT_DB_ALIAS]
+    quote = db.ops.quote_name
+    table = quote(Patient._meta.db_table)
+    fields = [field for field in Patient._meta.concrete_fields if not field.primary_key]
+    columns = [field.column for field in fields]
+    pas_columns = [Patient._meta.get_field(name).column for name in PAS_FIELDS]
+    # PostgreSQL and SQLite spell a null-safe "differs" differently
+    differs = 'IS DISTINCT FROM' if db.vendor == 'postgresql' else 'IS NOT'
+
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    insert = f'INSERT INTO {table} ({", ".join(quote(column) for column in columns)}) VALUES '
+    updates = [f'{quote(column)} = EXCLUDED.{quote(column)}' for column in pas_columns]
+    changed = ' OR '.join(f'{table}.{quote(column)} {differs} EXCLUDED.{quote(column)}' for column in pas_columns)
+    on_conflict = (
+        f' ON CONFLICT ({quote("nhi_number")}) DO UPDATE SET {", ".join(updates)}, '
+        f'{quote("updated_at")} = EXCLUDED.{quote("updated_at")}, '
+        f'{quote("version")} = {table}.{quote("version")} + 1 '
+        f'WHERE {changed}'
+    )
+
+    # Prepared once: the timestamps and the defaults for columns an extract
+    # doesn't carry. Only the row's own values are prepared per row.
+    now = timezone.now()
+    constants = {
+        field.name: field.get_db_prep_save(now if field.name in ('created_at', 'updated_at') else field.get_default(), db)
+        for field in fields
+    }
+    timestamps = {'created_at', 'updated_at'}
+
+    location_default = Patient._meta.get_field('location').get_default()
+    bed_number_default = Patient._meta.get_field('bed_number').get_default()
+
+    written = 0
+    changes = []
+    rekeyed = []
+    # Split to the backend's parameter limit, every column being a parameter
+    # (Django only reports SQLite's; PostgreSQL's protocol allows 65535), all
+    # in one transaction
+    batch_size = max(1, (db.features.max_query_params or 65535) // len(fields))
+    with transaction.atomic(), db.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            # Where the existing patients are now, to report moves the same
+            # way the bed feed does, and what their duplicate keys were built from
+            current = {
+                patient['nhi_number']: patient
+                for patient in (
+                    Patient.objects.select_for_update()
+                    .filter(nhi_number__in=[values['nhi_number'] for values in batch])
+                    .order_by('pk')
+                    .values('pk', 'location', 'bed_number', *Patient.BLOCK_KEY_FIELDS)
+                )
+            }
+            params = []
+            for values in batch:
+                for field in fields:
+                    if field.name in values and field.name not in timestamps:
+                        params.append(field.get_db_prep_save(values[field.name], db))
+                    else:
+                        params.append(constants[field.name])
+            cursor.execute(insert + ', '.join([placeholders] * len(batch)) + on_conflict, params)
+            written += cursor.rowcount
+
+            for values in batch:
+                if values['nhi_number'] not in current:
+                    continue
+                old = current[values['nhi_number']]
+                location = values.get('location', location_default)
+                bed_number = values.get('bed_number', bed_number_default)
+                if (location, bed_number) != (old['location'], old['bed_number']):
+                    changes.append(LocationChange(
+                        old['pk'], values['nhi_number'], old['location'], old['bed_number'], location, bed_number,
+                    ))
+                if any(values[name] != old[name] for name in Patient.BLOCK_KEY_FIELDS):
+                    rekeyed.append(old['pk'])
+        refresh_block_keys(rekeyed)
+        if changes:
+            transaction.on_commit(lambda: patient_locations_changed.send(sender=Patient, changes=changes))
+    return written
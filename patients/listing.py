@@ -0,0 +1,101 @@
+from django.db.models import Count, Q
+
+from .models import Patient, Task
+
+
+# Display labels for every Patient choice field, built once at import instead
+# of calling get_FOO_display() on each row
+CHOICE_LABELS = {
+    field.name: dict(field.flatchoices)
+    for field in Patient._meta.concrete_fields
+    if field.choices
+}
+
+# Columns every list row reads; views add the extra ones they display
+ROW_FIELDS = [
+    'id', 'name', 'nhi_number', 'patient_category', 'location', 'bed_number',
+    'current_parent_specialty', 'current_responsible_team', 'clerking_status',
+    'post_take_ward_round_status', 'priority_flag', 'weekend_review', 'datetime_of_arrival',
+    'open_task_count', 'urgent_task_count', 'open_consult_count',
+]
+
+# Each patient's overdue open task count, computed in the list query
+OVERDUE_TASK_COUNT = Count(
+    'tasks',
+    filter=Q(tasks__escalation='OVERDUE', tasks__status__in=Task.OPEN_STATUSES),
+)
+
+# Columns only some lists show; rows built without them hold None
+OPTIONAL_FIELDS = (
+    'presenting_complaint', 'referral_reason', 'referral_to_specialty_datetime',
+    'overdue_task_count', 'clerking_doctor_name', 'ptwr_doctor_name',
+)
+
+
+class PatientRow:
+    """Read-only patient row for list pages.
+
+    Holds only the displayed columns, with choice labels and the
+    location/bed string worked out once when the row is built.
+    """
+
+    __slots__ = (
+        'id', 'name', 'nhi_number', 'priority_flag', 'weekend_review', 'datetime_of_arrival',
+        'open_task_count', 'urgent_task_count', 'open_consult_count',
+        'patient_category', 'category_display',
+        'current_parent_specialty', 'specialty_display',
+        'current_responsible_team', 'team_display',
+        'clerking_status', 'clerking_display',
+        'post_take_ward_round_status', 'ptwr_display',
+        'location_display',
+        'presenting_complaint', 'referral_reason', 'referral_to_specialty_datetime',
+        'overdue_task_count', 'clerking_doctor_name', 'ptwr_doctor_name',
+    )
+
+    def __init__(self, values):
+        self.id = values['id']
+        self.name = values['name']
+        self.nhi_number = values['nhi_number']
+        self.priority_flag = values['priority_flag']
+        self.weekend_review = values['weekend_review']
+        self.datetime_of_arrival = values['datetime_of_arrival']
+        self.open_task_count = values['open_task_count']
+        self.urgent_task_count = values['urgent_task_count']
+        self.open_consult_count = values['open_consult_count']
+
+        self.patient_category = values['patient_category']
+        self.category_display = CHOICE_LABELS['patient_category'].get(self.patient_category, self.patient_category)
+        self.current_parent_specialty = values['current_parent_specialty']
+        self.specialty_display = CHOICE_LABELS['current_parent_specialty'].get(
+            self.current_parent_specialty, self.current_parent_specialty
+        )
+        self.current_responsible_team = values['current_responsible_team']
+        self.team_display = CHOICE_LABELS['current_responsible_team'].get(
+            self.current_responsible_team, self.current_responsible_team
+        )
+        self.clerking_status = values['clerking_status']
+        self.clerking_display = CHOICE_LABELS['clerking_status'].get(self.clerking_status, self.clerking_status)
+        self.post_take_ward_round_status = values['post_take_ward_round_status']
+        self.ptwr_display = CHOICE_LABELS['post_take_ward_round_status'].get(
+            self.post_take_ward_round_status, self.post_take_ward_round_status
+        )
+
+        location = CHOICE_LABELS['location'].get(values['location'], values['location'])
+        bed_number = values['bed_number']
+        self.location_display = f"{location} - Bed {bed_number}" if bed_number else location
+
+        for name in OPTIONAL_FIELDS:
+            setattr(self, name, values.get(name))
+
+
+def patient_rows(queryset, fields=(), **expressions):
+    """Evaluate ``queryset`` into a list of PatientRow.
+
+    Only ROW_FIELDS plus the given optional ``fields`` and ``expressions``
+    (e.g. ``overdue_task_count=OVERDUE_TASK_COUNT``) are selected, so the
+    text columns a list doesn't show are never read from the database.
+    Expressions are added after values() so an aggregate groups by the
+    selected columns only.
+    """
+    rows = queryset.values(*ROW_FIELDS, *fields).annotate(**expressions)
+    return [PatientRow(values) for values in rows]
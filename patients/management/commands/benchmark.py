@@ -0,0 +1,517 @@
+import gzip
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from patients.analytics import AnalyticsUnavailable, CohortAccumulator, TIMESTAMP_FIELDS, cohort_report, np
+from patients.duplicates import detect_duplicates
+from patients.listing import patient_rows
+from patients.middleware import brotli
+from patients.models import DuplicateCandidate, Patient, VersionConflict
+
+
+# Render with plain static storage so the benchmark does not depend on a
+# collectstatic manifest being present.
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against the configured database'
+
+    scenarios = {
+        'page_weight': 'Bytes per page for the main list views, before and after externalising CSS',
+        'cohort': 'Chunked numpy cohort analytics over synthetic rows and the patient table',
+        'sessions': 'DB statements per workflow action for each session engine / message storage',
+        'list_rows': 'Memory per row and build/render time for list pages: model instances vs PatientRow',
+        'sqlite_concurrency': 'Concurrent workflow writes and list reads: default SQLite vs SQLITE_CONCURRENT',
+        'single_flight': 'Concurrent identical kiosk take-list requests with and without single-flight rendering',
+        'duplicates': 'Duplicate detection time and recall on growing synthetic patient histories (rolled back)',
+    }
+
+    # SQLite engines compared by sqlite_concurrency
+    SQLITE_MODES = [
+        ('default', 'django.db.backends.sqlite3'),
+        ('concurrent', 'patients.sqlite_backend'),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(self.scenarios), help='Benchmark to run')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per page when timing')
+        parser.add_argument('--rows', type=int, default=2_000_000, help='Synthetic rows for data-volume scenarios')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per chunk for chunked scenarios')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent connections for concurrency scenarios')
+        parser.add_argument('--seconds', type=float, default=10.0, help='Run time per mode for concurrency scenarios')
+
+    def handle(self, *args, **options):
+        scenario = options['scenario']
+        self.stdout.write(f'{scenario}: {self.scenarios[scenario]}\n')
+        getattr(self, f'bench_{scenario}')(**options)
+
+    def client(self, **defaults):
+        # 'localhost' is in ALLOWED_HOSTS in every configuration
+        return Client(SERVER_NAME='localhost', **defaults)
+
+    def sample_pages(self):
+        patient = Patient.objects.order_by('id').first()
+        if patient is None:
+            raise CommandError('No patients found - run generate_dummy_data first')
+        return [
+            ('patient_list', reverse('patient_list')),
+            ('take_list', reverse('take_list')),
+            ('weekend_review_list', reverse('weekend_review_list')),
+            ('consults_list', reverse('consults_list')),
+            ('patient_detail', reverse('patient_detail', args=[patient.id])),
+        ]
+
+    def count_statements(self, client, method, url, **kwargs):
+        """Issue a request; return (statements, session-table statements, writes)"""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, **kwargs)
+        if response.status_code not in (200, 302):
+            raise CommandError(f'{url} returned {response.status_code}')
+        sql = [query['sql'] for query in queries]
+        return (
+            len(sql),
+            sum('django_session' in statement for statement in sql),
+            sum(statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')) for statement in sql),
+        )
+
+    def bench_page_weight(self, repeat, **options):
+        """Compare per-request bytes with the stylesheet inlined vs cached"""
+        asset_bytes = 0
+        for asset in ['patients/css/medlyst.css', 'patients/js/medlyst.js']:
+            with open(finders.find(asset), 'rb') as f:
+                asset_bytes += len(f.read())
+
+        client = self.client()
+        header = f"{'page':<22}{'before':>10}{'html':>10}{'gzip':>10}{'brotli':>10}{'ms':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        totals = {'before': 0, 'html': 0, 'gzip': 0, 'brotli': 0}
+        with override_settings(STORAGES=PLAIN_STATIC_STORAGES):
+            for name, url in self.sample_pages():
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    response = client.get(url)
+                elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+
+                html = response.content
+                row = {
+                    # Previously every page carried the stylesheet inline
+                    'before': len(html) + asset_bytes,
+                    'html': len(html),
+                    'gzip': len(gzip.compress(html)),
+                    'brotli': len(brotli.compress(html, quality=5)) if brotli else 0,
+                }
+                for key in totals:
+                    totals[key] += row[key]
+                self.stdout.write(
+                    f"{name:<22}{row['before']:>10}{row['html']:>10}{row['gzip']:>10}"
+                    f"{row['brotli'] or '-':>10}{elapsed_ms:>8.1f}"
+                )
+
+        self.stdout.write('-' * len(header))
+        self.stdout.write(
+            f"{'total':<22}{totals['before']:>10}{totals['html']:>10}{totals['gzip']:>10}"
+            f"{totals['brotli'] or '-':>10}"
+        )
+        best = totals['brotli'] or totals['gzip']
+        self.stdout.write(
+            f'\nStatic assets ({asset_bytes} bytes) are now fetched once and cached; '
+            f'each poll of these pages transfers {best} bytes instead of {totals["before"]} '
+            f'({100 - 100 * best / totals["before"]:.0f}% less).'
+        )
+
+    def bench_cohort(self, rows, chunk_size, **options):
+        """Time the vectorised accumulator on synthetic chunks, then on the real table"""
+        if np is None:
+            raise CommandError('numpy is not installed')
+
+        rng = np.random.default_rng(0)
+        started_at = time.time() - 365 * 86400
+
+        def synthetic_chunk(size, groups):
+            arrival = started_at + rng.uniform(0, 365 * 86400, size)
+            timestamps = {'datetime_of_arrival': arrival}
+            previous = arrival
+            for field in TIMESTAMP_FIELDS[1:]:
+                step = previous + rng.lognormal(np.log(4 * 3600), 0.8, size)
+                # Later workflow steps are increasingly often incomplete
+                step[rng.random(size) < 0.15] = np.nan
+                timestamps[field] = step
+                previous = step
+            codes = {
+                dimension: rng.integers(0, len(choices), size)
+                for dimension, choices in groups.items()
+            }
+            return timestamps, codes
+
+        accumulator = CohortAccumulator()
+        tracemalloc.start()
+        elapsed = 0.0
+        remaining = rows
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            chunk = synthetic_chunk(size, accumulator.groups)
+            started = time.perf_counter()
+            accumulator.add_chunk(*chunk)
+            elapsed += time.perf_counter() - started
+            remaining -= size
+        started = time.perf_counter()
+        report = accumulator.report()
+        report_ms = (time.perf_counter() - started) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        los = report['metrics']['length_of_stay']['overall']
+        self.stdout.write(
+            f'synthetic: {rows} rows in chunks of {chunk_size}: '
+            f'{elapsed:.2f} s accumulating ({rows / elapsed:,.0f} rows/s), {report_ms:.0f} ms to report, '
+            f'peak {peak / 1024 / 1024:.1f} MiB (including chunk generation)'
+        )
+        self.stdout.write(f'  length of stay p50/p90/p95: {los["p50_hours"]}/{los["p90_hours"]}/{los["p95_hours"]} h')
+
+        started = time.perf_counter()
+        try:
+            report = cohort_report(chunk_size=chunk_size)
+        except AnalyticsUnavailable as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'database: {report["rows"]} patients in {elapsed * 1000:.0f} ms '
+            f'(fetch, conversion and accumulation)'
+        )
+
+    def bench_sessions(self, **options):
+        """Compare DB statements per workflow action across session/message backends"""
+        patient = Patient.objects.order_by('id').first()
+        if patient is None:
+            raise CommandError('No patients found - run generate_dummy_data first')
+        configurations = [
+            ('db + session messages', 'db', 'session'),
+            ('db + fallback (before)', 'db', 'fallback'),
+            ('db + cookie', 'db', 'cookie'),
+            ('cached_db + cookie', 'cached_db', 'cookie'),
+            ('signed_cookies + cookie', 'signed_cookies', 'cookie'),
+        ]
+        toggle_url = reverse('toggle_priority', args=[patient.id])
+        detail_url = reverse('patient_detail', args=[patient.id])
+        list_url = reverse('patient_list')
+        # Admin pages read request.user, so they load the session every time
+        admin_url = reverse('admin:patients_patient_changelist')
+
+        header = (
+            f"{'configuration':<26}{'action':>8}{'session':>9}{'writes':>8}"
+            f"{'admin':>7}{'session':>9}{'anon':>6}"
+        )
+        self.stdout.write('action = POST toggle + redirected GET while logged in; '
+                          'admin = GET patient changelist; anon = GET patient list with no session\n')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        # Everything (the benchmark user, sessions, toggled flags) is rolled back
+        with transaction.atomic(), override_settings(STORAGES=PLAIN_STATIC_STORAGES):
+            user = User.objects.create_superuser('benchmark-sessions', None, None)
+            for label, session_backend, message_backend in configurations:
+                with override_settings(
+                    SESSION_ENGINE=settings.SESSION_ENGINES[session_backend],
+                    MESSAGE_STORAGE=settings.MESSAGE_STORAGES[message_backend],
+                ):
+                    client = self.client()
+                    client.force_login(user)
+                    # Warm caches so every configuration is measured steady-state
+                    client.get(admin_url)
+
+                    post = self.count_statements(client, 'post', toggle_url)
+                    follow = self.count_statements(client, 'get', detail_url)
+                    poll = self.count_statements(client, 'get', admin_url)
+                    anonymous = self.count_statements(self.client(), 'get', list_url)
+
+                    self.stdout.write(
+                        f'{label:<26}{post[0] + follow[0]:>8}{post[1] + follow[1]:>9}'
+                        f'{post[2] + follow[2]:>8}{poll[0]:>7}{poll[1]:>9}{anonymous[0]:>6}'
+                    )
+            transaction.set_rollback(True)
+
+    def bench_list_rows(self, repeat, **options):
+        """Compare full Patient instances with PatientRow projections for the list pages"""
+        if not Patient.objects.exists():
+            raise CommandError('No patients found - run generate_dummy_data first')
+        builders = [
+            # What the list views used to build: every column, plus the doctors
+            ('Patient instances', lambda: list(
+                Patient.objects.select_related('clerking_doctor', 'ptwr_doctor')
+            )),
+            ('PatientRow', lambda: patient_rows(
+                Patient.objects.all(), ['presenting_complaint', 'referral_reason', 'referral_to_specialty_datetime'],
+                clerking_doctor_name=F('clerking_doctor__name'), ptwr_doctor_name=F('ptwr_doctor__name'),
+            )),
+        ]
+
+        header = f"{'rows built as':<20}{'rows':>8}{'bytes/row':>12}{'build ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for label, build in builders:
+            tracemalloc.start()
+            rows = build()
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del rows
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = build()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'{label:<20}{len(rows):>8}{size / len(rows):>12,.0f}{min(timings) * 1000:>10.1f}'
+            )
+
+        self.stdout.write(f"\n{'page':<22}{'render ms':>10}")
+        client = self.client()
+        with override_settings(STORAGES=PLAIN_STATIC_STORAGES):
+            for name, url in self.sample_pages()[:3]:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+                self.stdout.write(f'{name:<22}{min(timings) * 1000:>10.1f}')
+
+    def bench_sqlite_concurrency(self, threads, seconds, **options):
+        """Run the same mixed workload against a copy of the database in each SQLite mode"""
+        settings_dict = connection.settings_dict
+        if settings_dict['ENGINE'] not in dict(self.SQLITE_MODES).values():
+            raise CommandError('sqlite_concurrency compares SQLite modes - unset DATABASE_URL')
+        patient_ids = list(Patient.objects.values_list('id', flat=True)[:500])
+        if not patient_ids:
+            raise CommandError('No patients found - run generate_dummy_data first')
+
+        self.stdout.write(
+            f'{threads} connections for {seconds:.0f}s per mode: half run read-then-write workflow '
+            f'transactions, half read the take list\n'
+        )
+        header = (
+            f"{'mode':<12}{'writes/s':>10}{'reads/s':>9}{'locked':>8}"
+            f"{'write p50':>11}{'write p99':>11}{'read p99':>10}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        with tempfile.TemporaryDirectory() as directory:
+            for label, engine in self.SQLITE_MODES:
+                path = os.path.join(directory, f'{label}.sqlite3')
+                source, target = sqlite3.connect(settings_dict['NAME']), sqlite3.connect(path)
+                source.backup(target)
+                # WAL is stored in the file; start every mode from the default journal
+                target.execute('PRAGMA journal_mode = DELETE')
+                source.close()
+                target.close()
+
+                alias = f'benchmark_{label}'
+                connections.settings[alias] = dict(settings_dict, ENGINE=engine, NAME=path)
+                try:
+                    result = self.run_concurrent_workload(alias, patient_ids, threads, seconds)
+                finally:
+                    del connections.settings[alias]
+
+                writes, reads = sorted(result['writes']), sorted(result['reads'])
+                self.stdout.write(
+                    f'{label:<12}{len(writes) / seconds:>10.1f}{len(reads) / seconds:>9.1f}{result["locked"]:>8}'
+                    f'{self.percentile_ms(writes, 50):>11}{self.percentile_ms(writes, 99):>11}'
+                    f'{self.percentile_ms(reads, 99):>10}'
+                )
+        self.stdout.write('\nlocked = operations that failed with "database is locked"; latencies in ms')
+
+    def bench_single_flight(self, threads, seconds, **options):
+        """Hammer one kiosk URL from many threads, rendering every request vs. sharing renders"""
+        if not Patient.objects.exists():
+            raise CommandError('No patients found - run generate_dummy_data first')
+        url = reverse('kiosk_take_list') + '?team=MEDA'
+        self.stdout.write(f'{threads} threads requesting {url} for {seconds:.0f}s per mode\n')
+        header = f"{'mode':<15}{'req/s':>8}{'renders':>9}{'coalesced':>11}{'p50 ms':>8}{'p99 ms':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for label, enabled in (('every request', False), ('single-flight', True)):
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                STORAGES=PLAIN_STATIC_STORAGES, ENDPOINT_LIMITS={},
+                SINGLE_FLIGHT=enabled, SINGLE_FLIGHT_DIR=directory,
+            ):
+                timings, roles = self.run_identical_requests(url, threads, seconds)
+            timings.sort()
+            renders = roles.get('leader', 0)
+            self.stdout.write(
+                f'{label:<15}{len(timings) / seconds:>8.1f}{renders:>9}{1 - renders / max(len(timings), 1):>11.0%}'
+                f'{self.percentile_ms(timings, 50):>8}{self.percentile_ms(timings, 99):>8}'
+            )
+        self.stdout.write('\ncoalesced = share of responses that reused another request\'s render')
+
+    def run_identical_requests(self, url, threads, seconds):
+        """GET ``url`` from ``threads`` clients until the time is up: (latencies, {role: count})"""
+        timings, roles = [], {}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+
+        def worker():
+            client = self.client()
+            own_timings, own_roles = [], {}
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    own_timings.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url} returned {response.status_code}')
+                    role = response['X-Single-Flight']
+                    own_roles[role] = own_roles.get(role, 0) + 1
+            finally:
+                connection.close()
+            with lock:
+                timings.extend(own_timings)
+                for role, count in own_roles.items():
+                    roles[role] = roles.get(role, 0) + count
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return timings, roles
+
+    def bench_duplicates(self, **options):
+        """Index synthetic histories of growing size from scratch and check the planted duplicates are found"""
+        self.stdout.write(
+            'Patients arrive at 50 a day, so larger histories span more days; 1% are '
+            're-entered with a typo in the name and NHI. Each size runs in a rolled-back transaction.\n'
+        )
+        header = f"{'patients':>9}{'seconds':>9}{'us/patient':>12}{'pairs scored':>14}{'recall':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for size in (2500, 5000, 10000, 20000):
+            with transaction.atomic():
+                planted = self.create_synthetic_history(size, random.Random(size))
+                started = time.perf_counter()
+                _, scored, _ = detect_duplicates(full=True)
+                elapsed = time.perf_counter() - started
+                found = set(DuplicateCandidate.objects.values_list('patient__nhi_number', 'other__nhi_number'))
+                recall = sum(pair in found or pair[::-1] in found for pair in planted) / len(planted)
+                transaction.set_rollback(True)
+            self.stdout.write(f'{size:>9}{elapsed:>9.2f}{elapsed / size * 1e6:>12.0f}{scored:>14}{recall:>8.0%}')
+
+    def create_synthetic_history(self, size, rng):
+        """Insert ``size`` synthetic patients; returns the (original, re-entered) NHI pairs planted"""
+        letters = 'ABCDEFGHJKLMNPRSTUVWXYZ'
+        syllables = ['an', 'ber', 'cal', 'dor', 'el', 'fin', 'gar', 'har', 'is', 'jon', 'kel', 'lor', 'mar', 'ne', 'son']
+        surnames = [rng.choice(syllables).title() + rng.choice(syllables) + rng.choice(syllables) for _ in range(2000)]
+        given = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Charlie', 'Robin']
+        start = timezone.now() - timedelta(days=size / 50)
+        used = set(Patient.objects.values_list('nhi_number', flat=True))
+
+        def new_nhi():
+            while True:
+                nhi = ''.join(rng.choice(letters) for _ in range(3)) + f'{rng.randrange(10000):04d}'
+                if nhi not in used:
+                    used.add(nhi)
+                    return nhi
+
+        def patient(name, nhi, arrival):
+            return Patient(
+                name=name, nhi_number=nhi, datetime_of_arrival=arrival, presenting_complaint='Synthetic',
+                current_parent_specialty='MEDICINE', current_responsible_team='MEDA',
+                referral_source='ED', referral_time=arrival,
+            )
+
+        patients, planted = [], []
+        for i in range(size):
+            name = f'{rng.choice(given)} {rng.choice(surnames)}'
+            arrival = start + timedelta(days=i / 50)
+            patients.append(patient(name, new_nhi(), arrival))
+            if i % 100 == 0:
+                # Re-entered a few hours later: one letter of the name and one NHI digit mistyped
+                original = patients[-1].nhi_number
+                typo = original[:6] + str((int(original[6]) + 1) % 10)
+                if typo in used:
+                    continue
+                used.add(typo)
+                position = rng.randrange(1, len(name))
+                retyped = name[:position] + rng.choice('aeiou') + name[position + 1:]
+                patients.append(patient(retyped, typo, arrival + timedelta(hours=rng.uniform(1, 12))))
+                planted.append((original, typo))
+        Patient.objects.bulk_create(patients, batch_size=1000)
+        return planted
+
+    def percentile_ms(self, values, p):
+        if not values:
+            return '-'
+        return f'{values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000:.1f}'
+
+    def run_concurrent_workload(self, alias, patient_ids, threads, seconds):
+        """Writers and readers on their own connections to ``alias`` until the time is up"""
+        result = {'writes': [], 'reads': [], 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+
+        def write(rng):
+            # Read then write in one transaction, as the workflow views and
+            # the bed feed do: the case deferred SQLite transactions fail
+            with transaction.atomic(using=alias):
+                patient = Patient.objects.using(alias).get(pk=rng.choice(patient_ids))
+                patient.summary = f'Reviewed {rng.random():.6f}'
+                patient.save(using=alias)
+
+        def read(rng):
+            len(patient_rows(Patient.objects.using(alias).filter(patient_category='ACUTE_INPROCESS')))
+
+        def worker(index):
+            rng = random.Random(index)
+            action, kind = (write, 'writes') if index % 2 == 0 else (read, 'reads')
+            timings, locked = [], 0
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        action(rng)
+                    except OperationalError as exc:
+                        if 'locked' not in str(exc):
+                            raise
+                        locked += 1
+                    except VersionConflict:
+                        # Another writer got there first; not a locking failure
+                        pass
+                    else:
+                        timings.append(time.perf_counter() - started)
+            finally:
+                connections[alias].close()
+            with lock:
+                result[kind].extend(timings)
+                result['locked'] += locked
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return result
@@ -0,0 +1,47 @@
+import json
+import sys
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from patients.analytics import AnalyticsUnavailable, cohort_report, write_report_csv
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Length-of-stay and workflow-timing percentiles by team, specialty, referral source and admission type'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['json', 'csv'], default='json')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+        parser.add_argument('--days', type=int, help='Only patients who arrived in the last N days')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        patients = Patient.objects.all()
+        if options['days']:
+            patients = patients.filter(
+                datetime_of_arrival__gte=timezone.now() - timedelta(days=options['days'])
+            )
+
+        started = time.perf_counter()
+        try:
+            report = cohort_report(patients, chunk_size=options['chunk_size'])
+        except AnalyticsUnavailable as exc:
+            raise CommandError(f'{exc} - pip install numpy')
+        elapsed = time.perf_counter() - started
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            if options['format'] == 'csv':
+                write_report_csv(report, output)
+            else:
+                json.dump(report, output, indent=2)
+                output.write('\n')
+        finally:
+            if options['output']:
+                output.close()
+
+        self.stderr.write(f'{report["rows"]} patients analysed in {elapsed:.2f} s')
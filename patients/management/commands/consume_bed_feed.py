@@ -0,0 +1,124 @@
+import os
+import shutil
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from patients.bedfeed import FeedError, apply_moves, coalesce, feed_files, parse_event
+from patients.metrics import registry
+
+
+class Command(BaseCommand):
+    help = (
+        'Tail a directory of ADT bed-move drop files (NDJSON, one move per line), '
+        'coalesce moves per NHI over a short window and write the real changes in '
+        'one batched UPDATE per window'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Drop directory the ADT interface writes feed files into')
+        parser.add_argument(
+            '--window', type=float, default=2.0,
+            help='Seconds of moves to coalesce into each write (default 2)',
+        )
+        parser.add_argument('--archive', help='Move applied feed files here instead of deleting them')
+        parser.add_argument(
+            '--report-every', type=float, default=60.0,
+            help='Seconds between throughput and lag reports (default 60)',
+        )
+        parser.add_argument('--once', action='store_true', help='Apply the files already waiting, then exit')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f'{directory} is not a directory')
+        if options['archive']:
+            os.makedirs(options['archive'], exist_ok=True)
+
+        self.verbosity = options['verbosity']
+        self.reset_report()
+        reported_at = time.monotonic()
+        try:
+            while True:
+                started = time.monotonic()
+                self.consume(directory, options['archive'])
+                registry.flush()
+                if options['once']:
+                    break
+                if time.monotonic() - reported_at >= options['report_every']:
+                    self.report(time.monotonic() - reported_at)
+                    reported_at = time.monotonic()
+                time.sleep(max(0.0, options['window'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        self.report(time.monotonic() - reported_at)
+        registry.flush(force=True)
+
+    def reset_report(self):
+        self.counts = dict.fromkeys(('applied', 'unchanged', 'superseded', 'unknown_patient', 'rejected'), 0)
+        self.lags = []
+
+    def consume(self, directory, archive):
+        """Read every waiting feed file, apply the coalesced moves, then remove the files"""
+        paths = feed_files(directory)
+        if not paths:
+            return
+        events = []
+        for path in paths:
+            file_time = datetime.fromtimestamp(os.path.getmtime(path), dt_timezone.utc)
+            with open(path, encoding='utf-8') as f:
+                for number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        events.append(parse_event(line, file_time))
+                    except FeedError as exc:
+                        self.count('rejected')
+                        self.stderr.write(f'{os.path.basename(path)} line {number}: {exc}')
+
+        latest = coalesce(events)
+        changes, unknown = apply_moves(latest)
+        # Files are only removed once the moves are committed; if we stop in
+        # between, re-reading them is harmless because unchanged moves are skipped
+        for path in paths:
+            if archive:
+                shutil.move(path, os.path.join(archive, os.path.basename(path)))
+            else:
+                os.remove(path)
+
+        now = timezone.now()
+        changed = {change.nhi_number for change in changes}
+        for event in latest.values():
+            if event.nhi_number in changed:
+                lag = max(0.0, (now - event.received).total_seconds())
+                self.lags.append(lag)
+                registry.observe('medlyst_bed_feed_lag_seconds', {}, lag)
+        self.count('superseded', len(events) - len(latest))
+        self.count('applied', len(changes))
+        self.count('unknown_patient', len(unknown))
+        self.count('unchanged', len(latest) - len(changes) - len(unknown))
+        if unknown:
+            self.stderr.write(f'No patient with NHI {", ".join(unknown)}')
+        if self.verbosity >= 2:
+            self.stdout.write(
+                f'{len(paths)} files, {len(events)} moves for {len(latest)} patients: {len(changes)} written'
+            )
+
+    def count(self, result, amount=1):
+        if amount:
+            self.counts[result] += amount
+            registry.inc('medlyst_bed_feed_events_total', {'result': result}, amount)
+
+    def report(self, seconds):
+        events = sum(self.counts.values())
+        line = (
+            f'{events} moves in {seconds:.0f}s ({events / max(seconds, 0.001):.1f}/s): '
+            + ', '.join(f'{count} {result.replace("_", " ")}' for result, count in self.counts.items())
+        )
+        if self.lags:
+            lags = sorted(self.lags)
+            line += f'; lag p50 {lags[len(lags) // 2]:.1f}s, max {lags[-1]:.1f}s'
+        self.stdout.write(line)
+        self.reset_report()
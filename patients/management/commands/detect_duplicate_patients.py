@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from patients.duplicates import detect_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        'Find probable duplicate patients among those created since the last run, '
+        'comparing each only with patients in the same blocks (similar NHI, or '
+        'similar-sounding surname arriving around the same time)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Re-index every patient, not just new ones')
+        parser.add_argument('--batch-size', type=int, default=500, help='New patients indexed per transaction')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        indexed, scored, added = detect_duplicates(options['full'], options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Indexed {indexed} patients and scored {scored} pairs in {elapsed:.1f}s: '
+            f'{added} new probable duplicates (review them in the admin)'
+        )
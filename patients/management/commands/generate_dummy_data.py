@@ -3,7 +3,8 @@ from django.utils import timezone
 from faker import Faker
 import random
 from datetime import timedelta
-from patients.models import Patient, ConsultRequest, WardRound, Task
+from patients.models import Clinician, Patient, ConsultRequest, TakeFlowTransition, WardRound, Task
+from patients.rollups import rebuild_rollups, transitions_for
 
 
 class Command(BaseCommand):
@@ -35,6 +36,7 @@ class Command(BaseCommand):
             'Dr. Garcia', 'Dr. Miller', 'Dr. Davis', 'Dr. Rodriguez', 'Dr. Martinez',
             'Dr. Anderson', 'Dr. Taylor', 'Dr. Thomas', 'Dr. Moore', 'Dr. Jackson'
         ]
+        doctors = [Clinician.from_name(name) for name in doctors]
         
         self.stdout.write('Generating 200 patients...')
         
@@ -113,7 +115,7 @@ class Command(BaseCommand):
                 referral_to_specialty_datetime = arrival_time if patient_category in ['ACUTE_INPROCESS', 'ACUTE_ADMITTED'] else None
             
             # Generate clerking details if applicable
-            clerking_doctor = ''
+            clerking_doctor = None
             clerking_completed_at = None
             if clerking_status == 'COMPLETED':
                 clerking_doctor = random.choice(doctors)
@@ -122,7 +124,7 @@ class Command(BaseCommand):
                 clerking_doctor = random.choice(doctors)
             
             # Generate PTWR details if applicable
-            ptwr_doctor = ''
+            ptwr_doctor = None
             ptwr_completed_at = None
             if ptwr_status == 'COMPLETED':
                 ptwr_doctor = random.choice(doctors)
@@ -133,6 +135,10 @@ class Command(BaseCommand):
             elif ptwr_status == 'IN_PROGRESS':
                 ptwr_doctor = random.choice(doctors)
             
+            admission_completed_at = None
+            if patient_category == 'ACUTE_ADMITTED' and ptwr_completed_at:
+                admission_completed_at = ptwr_completed_at + timedelta(hours=random.randint(1, 6))
+            
             # Generate NHI number (format: ABC1234)
             nhi_number = ''.join([
                 chr(random.randint(65, 90)) for _ in range(3)
@@ -158,12 +164,14 @@ class Command(BaseCommand):
                 ptwr_doctor=ptwr_doctor,
                 ptwr_completed_at=ptwr_completed_at,
                 admission_type=admission_type,
+                admission_completed_at=admission_completed_at,
                 patient_category=patient_category,
                 priority_flag=priority_flag,
                 weekend_review=weekend_review,
                 referral_reason=referral_reason,
                 referral_to_specialty_datetime=referral_to_specialty_datetime,
             )
+            TakeFlowTransition.objects.bulk_create(transitions_for(patient))
             
             # Add some consult requests (30% of patients)
             if random.random() < 0.3:
@@ -205,8 +213,9 @@ class Command(BaseCommand):
                         priority=random.choice(['LOW', 'MEDIUM', 'HIGH', 'URGENT']),
                         status=random.choice(['PENDING', 'IN_PROGRESS', 'COMPLETED']),
                         created_by=random.choice(doctors),
-                        assigned_to=random.choice(doctors) if random.random() < 0.7 else '',
+                        assigned_to=random.choice(doctors) if random.random() < 0.7 else None,
                         created_at=arrival_time + timedelta(hours=random.randint(1, 72)),
+                        due_date=timezone.now() + timedelta(hours=random.randint(-24, 72)) if random.random() < 0.6 else None,
                     )
             
             if (i + 1) % 50 == 0:
@@ -214,6 +223,9 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS(f'Successfully created 200 patients!'))
         
+        # Transitions were created directly, not through the workflow views
+        rebuild_rollups()
+        
         # Print summary
         total_patients = Patient.objects.count()
         ed_patients = Patient.objects.filter(patient_category='ED').count()
@@ -0,0 +1,141 @@
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from patients.importing import REQUIRED_FIELDS, parse_batch, upsert_patients
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream a CSV or NDJSON patient extract into the database, upserting by NHI. '
+        'Rows are validated in a worker pool and written in batches, so memory use '
+        'does not grow with the file size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Extract file (.csv, or .ndjson/.jsonl with one JSON object per line)')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='File format (default: from the extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per validation batch and upsert')
+        parser.add_argument(
+            '--workers', type=int, default=min(4, os.cpu_count() or 1),
+            help='Validation worker processes (0 validates in this process)',
+        )
+        parser.add_argument('--rejects', help='Write rejected rows (line, NHI, error) to this CSV file')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; write nothing to the database')
+
+    def handle(self, *args, **options):
+        kind = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'ndjson')
+        if options['batch_size'] < 1 or options['workers'] < 0:
+            raise CommandError('--batch-size must be at least 1 and --workers at least 0')
+        if connection.vendor not in ('postgresql', 'sqlite') and not options['dry_run']:
+            raise CommandError(f'Upserts need INSERT ... ON CONFLICT, which {connection.vendor} does not support')
+
+        try:
+            source = open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}")
+
+        self.read = self.written = self.rejected = self.reported = 0
+        self.reject_writer = None
+        self.started = time.perf_counter()
+        rejects_file = None
+        pool = None
+        try:
+            if options['rejects']:
+                rejects_file = open(options['rejects'], 'w', newline='')
+                self.reject_writer = csv.writer(rejects_file)
+                self.reject_writer.writerow(['line', 'nhi_number', 'error'])
+            if options['workers']:
+                # Workers only parse and validate; the database is written
+                # from this process. django.setup lets spawned workers import
+                # the models.
+                pool = ProcessPoolExecutor(options['workers'], initializer=django.setup)
+
+            header, batches = self.read_batches(source, kind, options['batch_size'])
+            # At most two batches per worker in flight, so a fast reader
+            # can't queue the whole file in memory ahead of the database
+            pending = deque()
+            for lines, items in batches:
+                if pool is None:
+                    self.write_batch(parse_batch(kind, header, items, lines), options)
+                    continue
+                pending.append(pool.submit(parse_batch, kind, header, items, lines))
+                if len(pending) >= 2 * options['workers']:
+                    self.write_batch(pending.popleft().result(), options)
+            while pending:
+                self.write_batch(pending.popleft().result(), options)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            source.close()
+            if rejects_file is not None:
+                rejects_file.close()
+
+        elapsed = time.perf_counter() - self.started
+        summary = f'Read {self.read} rows in {elapsed:.1f}s ({self.read / elapsed:,.0f} rows/s): '
+        if options['dry_run']:
+            summary += f'{self.written} valid, {self.rejected} rejected (dry run, nothing written)'
+        else:
+            summary += (
+                f'{self.written} inserted or changed, {self.read - self.written - self.rejected} unchanged, '
+                f'{self.rejected} rejected'
+            )
+        self.stdout.write(summary)
+
+    def read_batches(self, source, kind, batch_size):
+        """The header (CSV only) and a generator of (line numbers, raw rows) batches"""
+        if kind == 'csv':
+            reader = csv.reader(source)
+            header = [name.strip().lower() for name in next(reader, [])]
+            missing = [name for name in REQUIRED_FIELDS if name not in header]
+            if missing:
+                raise CommandError(f"CSV header is missing required columns: {', '.join(missing)}")
+        else:
+            reader = source
+            header = None
+
+        def batches():
+            # Rows are numbered by the line they start on, counting a CSV
+            # header as line 1. A quoted CSV field can span several lines,
+            # so the reader's line count is used rather than the row count.
+            last = reader.line_num if kind == 'csv' else 0
+            lines = []
+            items = []
+            for item in reader:
+                lines.append(last + 1)
+                last = reader.line_num if kind == 'csv' else last + 1
+                items.append(item)
+                if len(items) == batch_size:
+                    yield lines, items
+                    lines = []
+                    items = []
+            if items:
+                yield lines, items
+
+        return header, batches()
+
+    def write_batch(self, result, options):
+        rows, rejects = result
+        self.read += len(rows) + len(rejects)
+        self.rejected += len(rejects)
+        if options['dry_run']:
+            self.written += len(rows)
+        else:
+            self.written += upsert_patients(rows)
+
+        for line, nhi_number, error in rejects:
+            if self.reject_writer is not None:
+                self.reject_writer.writerow([line, nhi_number, error])
+            elif self.reported < 20:
+                # Without --rejects, show the first few so a bad extract is obvious
+                self.reported += 1
+                self.stderr.write(f'Line {line} ({nhi_number or "no NHI"}): {error}')
+        if options['verbosity'] >= 2:
+            elapsed = time.perf_counter() - self.started
+            self.stdout.write(f'{self.read} rows, {self.read / elapsed:,.0f} rows/s, {self.rejected} rejected')
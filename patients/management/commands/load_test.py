@@ -0,0 +1,393 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+
+from patients.models import Clinician, ConsultRequest, Patient, Task
+
+
+# A Monday-morning take: mostly list polling and chart reads, with a steady
+# trickle of workflow writes. Any key can be overridden from --scenario.
+DEFAULT_SCENARIO = {
+    'clinicians': 20,
+    # Seconds of load after the ramp-up
+    'duration': 60,
+    # Seconds over which clinicians start, so the server isn't hit all at once
+    'ramp_up': 10,
+    # Pause between one clinician's actions, picked uniformly from this range
+    'think_time': [0.5, 2.0],
+    'timeout': 30,
+    # Relative weight of each action
+    'actions': {
+        'take_list': 30,
+        'patient_list': 10,
+        'patient_detail': 25,
+        'clerking': 8,
+        'ptwr': 5,
+        'add_task': 12,
+        'request_consult': 10,
+    },
+}
+
+VERSION_RE = re.compile(r'name="version" value="(\d+)"')
+
+# Backends currently blocked on a lock in this database
+LOCK_WAIT_SQL = """
+    SELECT count(*) FROM pg_stat_activity
+    WHERE datname = current_database() AND wait_event_type = 'Lock'
+"""
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Results:
+    """Latencies and failures per endpoint, kept per thread and merged at the end"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.server_errors = {}
+        self.statuses = {}
+
+    def record(self, endpoint, seconds, status):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 'error' or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        # 4xx are expected under load (version conflicts, shed requests)
+        if status == 'error' or status >= 500:
+            self.server_errors[endpoint] = self.server_errors.get(endpoint, 0) + 1
+
+    def merge(self, other):
+        for endpoint, latencies in other.latencies.items():
+            self.latencies.setdefault(endpoint, []).extend(latencies)
+        for endpoint, count in other.errors.items():
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + count
+        for endpoint, count in other.server_errors.items():
+            self.server_errors[endpoint] = self.server_errors.get(endpoint, 0) + count
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+class LockSampler(threading.Thread):
+    """Counts PostgreSQL backends waiting on locks while the test runs"""
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = 0
+        self.samples_waiting = 0
+        self.peak = 0
+
+    def run(self):
+        # Runs on its own thread, so it gets its own database connection
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopped.wait(self.interval):
+                    cursor.execute(LOCK_WAIT_SQL)
+                    waiting = cursor.fetchone()[0]
+                    self.samples += 1
+                    self.samples_waiting += bool(waiting)
+                    self.peak = max(self.peak, waiting)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class ClinicianSession:
+    """One simulated clinician: a cookie-keeping HTTP client and the workload actions"""
+
+    def __init__(self, base_url, timeout, targets, results, rng):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.targets = targets
+        self.results = results
+        self.rng = rng
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def request(self, endpoint, path, data=None):
+        """Issue one request, following redirects, and record it; return the body or None"""
+        url = self.base_url + path
+        body = None
+        headers = {}
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token())
+            body = urlencode(data).encode()
+            headers['Referer'] = url
+
+        content = None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(Request(url, data=body, headers=headers), timeout=self.timeout) as response:
+                content = response.read()
+                status = response.status
+        except HTTPError as exc:
+            exc.read()
+            status = exc.code
+        except (URLError, OSError):
+            # Refused connections, resets and timeouts
+            status = 'error'
+        self.results.record(endpoint, time.perf_counter() - started, status)
+        return content.decode('utf-8', 'replace') if content else None
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def patient(self, acute=False):
+        return self.rng.choice(self.targets['acute_ids' if acute and self.targets['acute_ids'] else 'patient_ids'])
+
+    def doctor(self):
+        return self.rng.choice(self.targets['doctors'])
+
+    def take_list(self):
+        self.request('take_list', reverse('take_list'))
+
+    def patient_list(self):
+        self.request('patient_list', reverse('patient_list'))
+
+    def patient_detail(self):
+        self.request('patient_detail', reverse('patient_detail', args=[self.patient()]))
+
+    def _submit(self, endpoint, path, data):
+        # Open the form first, as a clinician would: that sets the CSRF cookie,
+        # and the post carries the version the form was rendered with, so
+        # concurrent edits hit real version conflicts
+        page = self.request(f'{endpoint}_form', path)
+        match = VERSION_RE.search(page or '')
+        if match:
+            data['version'] = match.group(1)
+        self.request(endpoint, path, data)
+
+    def clerking(self):
+        self._submit('clerking', reverse('clerking_workflow', args=[self.patient(acute=True)]), {
+            'status': self.rng.choice(['IN_PROGRESS', 'COMPLETED']),
+            'doctor': self.doctor(),
+        })
+
+    def ptwr(self):
+        self._submit('ptwr', reverse('ptwr_workflow', args=[self.patient(acute=True)]), {
+            'status': self.rng.choice(['IN_PROGRESS', 'COMPLETED']),
+            'doctor': self.doctor(),
+            'notes': 'Load test post-take review',
+        })
+
+    def add_task(self):
+        self._submit('add_task', reverse('add_task', args=[self.patient()]), {
+            'description': 'Load test task',
+            'priority': self.rng.choice(self.targets['priorities']),
+            'assigned_to': self.doctor(),
+            'created_by': self.doctor(),
+            'due_date': '',
+        })
+
+    def request_consult(self):
+        self._submit('request_consult', reverse('consult_request', args=[self.patient()]), {
+            'specialty': self.rng.choice(self.targets['specialties']),
+            'reason': 'Load test consult',
+            'requested_by': self.doctor(),
+        })
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate concurrent clinicians against a running server and report throughput, '
+        'p50/p99 latency and errors per endpoint, and database lock waits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the running server')
+        parser.add_argument(
+            '--scenario',
+            help='JSON file overriding any of: ' + ', '.join(DEFAULT_SCENARIO),
+        )
+        parser.add_argument('--clinicians', type=int, help='Override the number of concurrent clinicians')
+        parser.add_argument('--duration', type=float, help='Override the test duration in seconds')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the action mix')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        scenario = self.load_scenario(options)
+        targets = self.load_targets()
+        base_url = options['url'].rstrip('/')
+        try:
+            build_opener().open(base_url + reverse('take_list'), timeout=scenario['timeout']).close()
+        except (URLError, OSError) as exc:
+            raise CommandError(f'Cannot reach {base_url}: {exc}')
+
+        if not options['json']:
+            self.stdout.write(
+                f"{scenario['clinicians']} clinicians for {scenario['duration']}s "
+                f"(+{scenario['ramp_up']}s ramp-up) against {base_url}"
+            )
+
+        sampler = LockSampler() if connection.vendor == 'postgresql' else None
+        if sampler:
+            sampler.start()
+
+        started = time.monotonic()
+        deadline = started + scenario['ramp_up'] + scenario['duration']
+        per_thread = [Results() for _ in range(scenario['clinicians'])]
+        threads = [
+            threading.Thread(
+                target=self.run_clinician,
+                args=(i, scenario, targets, base_url, deadline, per_thread[i], options['seed']),
+                daemon=True,
+            )
+            for i in range(scenario['clinicians'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        if sampler:
+            sampler.stop()
+
+        results = Results()
+        for thread_results in per_thread:
+            results.merge(thread_results)
+        report = self.build_report(results, elapsed, sampler)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+        if report['server_errors']:
+            failing = ', '.join(
+                f"{endpoint} ({row['server_errors']})"
+                for endpoint, row in report['endpoints'].items() if row['server_errors']
+            )
+            raise CommandError(f"{report['server_errors']} requests failed with a server error: {failing}")
+
+    def load_scenario(self, options):
+        scenario = dict(DEFAULT_SCENARIO)
+        if options['scenario']:
+            try:
+                with open(options['scenario']) as f:
+                    overrides = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read scenario {options['scenario']}: {exc}")
+            unknown = set(overrides) - set(DEFAULT_SCENARIO)
+            if unknown:
+                raise CommandError(f"Unknown scenario keys: {', '.join(sorted(unknown))}")
+            scenario.update(overrides)
+        for key in ('clinicians', 'duration'):
+            if options[key] is not None:
+                scenario[key] = options[key]
+
+        unknown = set(scenario['actions']) - set(DEFAULT_SCENARIO['actions'])
+        if unknown:
+            raise CommandError(
+                f"Unknown actions: {', '.join(sorted(unknown))} "
+                f"(available: {', '.join(DEFAULT_SCENARIO['actions'])})"
+            )
+        if scenario['clinicians'] < 1 or not any(scenario['actions'].values()):
+            raise CommandError('A scenario needs at least one clinician and one weighted action')
+        return scenario
+
+    def load_targets(self):
+        """Patient ids and form values the actions pick from, read from this database"""
+        patient_ids = list(Patient.objects.values_list('id', flat=True))
+        if not patient_ids:
+            raise CommandError('No patients found - run generate_dummy_data first')
+        return {
+            'patient_ids': patient_ids,
+            'acute_ids': list(
+                Patient.objects.filter(patient_category='ACUTE_INPROCESS').values_list('id', flat=True)
+            ),
+            'doctors': list(Clinician.objects.filter(active=True).values_list('name', flat=True)) or ['Dr. Load Test'],
+            'priorities': [code for code, _ in Task.PRIORITY_CHOICES],
+            'specialties': [code for code, _ in ConsultRequest.SPECIALTY_CHOICES],
+        }
+
+    def run_clinician(self, index, scenario, targets, base_url, deadline, results, seed):
+        rng = random.Random(seed * 1000 + index)
+        session = ClinicianSession(base_url, scenario['timeout'], targets, results, rng)
+        actions, weights = zip(*scenario['actions'].items())
+        time.sleep(scenario['ramp_up'] * index / scenario['clinicians'])
+        while time.monotonic() < deadline:
+            getattr(session, rng.choices(actions, weights)[0])()
+            time.sleep(rng.uniform(*scenario['think_time']))
+
+    def build_report(self, results, elapsed, sampler):
+        endpoints = {}
+        for endpoint, latencies in sorted(results.latencies.items()):
+            latencies.sort()
+            errors = results.errors.get(endpoint, 0)
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'server_errors': results.server_errors.get(endpoint, 0),
+                'error_rate': round(errors / len(latencies), 4),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+            }
+        total = sum(row['requests'] for row in endpoints.values())
+        errors = sum(row['errors'] for row in endpoints.values())
+        report = {
+            'elapsed_seconds': round(elapsed, 1),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1) if elapsed else 0,
+            'errors': errors,
+            'server_errors': sum(row['server_errors'] for row in endpoints.values()),
+            'error_rate': round(errors / total, 4) if total else 0,
+            'statuses': {str(status): count for status, count in sorted(results.statuses.items(), key=str)},
+            'endpoints': endpoints,
+            'lock_waits': None,
+        }
+        if sampler:
+            report['lock_waits'] = {
+                'samples': sampler.samples,
+                'samples_with_waiters': sampler.samples_waiting,
+                'peak_waiting_backends': sampler.peak,
+            }
+        return report
+
+    def write_report(self, report):
+        header = f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'err %':>7}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        self.stdout.write('\n' + header)
+        self.stdout.write('-' * len(header))
+        for endpoint, row in report['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<22}{row['requests']:>9}{row['errors']:>8}{row['error_rate'] * 100:>7.1f}"
+                f"{row['p50_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}"
+            )
+        self.stdout.write('-' * len(header))
+        self.stdout.write(
+            f"{report['requests']} requests in {report['elapsed_seconds']}s: "
+            f"{report['throughput_rps']} req/s, {report['error_rate'] * 100:.1f}% errors"
+        )
+        self.stdout.write('Responses by status: ' + ', '.join(
+            f'{status}: {count}' for status, count in report['statuses'].items()
+        ))
+
+        lock_waits = report['lock_waits']
+        if lock_waits is None:
+            self.stdout.write(
+                f'Lock waits: not sampled on {connection.vendor}; '
+                'SQLite lock timeouts show up as 500 errors on the write endpoints'
+            )
+        else:
+            share = lock_waits['samples_with_waiters'] / lock_waits['samples'] if lock_waits['samples'] else 0
+            self.stdout.write(
+                f"Lock waits: backends waiting in {share * 100:.1f}% of {lock_waits['samples']} samples, "
+                f"peak {lock_waits['peak_waiting_backends']} waiting at once"
+            )
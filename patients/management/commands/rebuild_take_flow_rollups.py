@@ -0,0 +1,23 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from patients.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute hourly take-flow rollups from the recorded transitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=48, help='Rebuild this many hours back (default 48)')
+        parser.add_argument('--all', action='store_true', help='Rebuild all history')
+
+    def handle(self, *args, **options):
+        since = None if options['all'] else timezone.now() - timedelta(hours=options['hours'])
+        started = time.perf_counter()
+        written = rebuild_rollups(since)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        window = 'all history' if since is None else f'the last {options["hours"]} hours'
+        self.stdout.write(f'Rebuilt {written} rollup rows for {window} ({elapsed_ms:.1f} ms)')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from patients.counters import reconcile_open_work_counts
+
+
+class Command(BaseCommand):
+    help = "Recount each patient's open tasks, urgent tasks and open consults and fix counters that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients locked and recounted per transaction')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        checked, corrections = reconcile_open_work_counts(options['batch_size'], options['pause'])
+        if options['verbosity'] >= 2:
+            for patient_id, drift in corrections:
+                changes = ', '.join(f'{name} {stored} -> {actual}' for name, (stored, actual) in drift.items())
+                self.stdout.write(f'Patient {patient_id}: {changes}')
+        self.stdout.write(f'Checked {checked} patients, corrected {len(corrections)}')
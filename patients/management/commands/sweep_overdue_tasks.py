@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from patients.escalation import sweep_overdue_tasks
+
+
+class Command(BaseCommand):
+    help = 'Flag tasks that have become overdue or are coming due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping until interrupted')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            overdue, due_soon = sweep_overdue_tasks()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if overdue or due_soon or not options['loop']:
+                self.stdout.write(
+                    f'{overdue} newly overdue, {due_soon} coming due ({elapsed_ms:.1f} ms)'
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,346 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.db.models import Count, Q
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+
+# Exported metrics: name -> (type, help). Label values are view names,
+# template names and cache names, never request data, so series stay bounded.
+METRICS = {
+    'medlyst_http_requests_total': ('counter', 'Requests handled, by view, method and status code'),
+    'medlyst_http_request_duration_seconds': ('histogram', 'Request latency, by view'),
+    'medlyst_db_queries_total': ('counter', 'SQL statements executed, by view'),
+    'medlyst_db_query_seconds_total': ('counter', 'Time spent executing SQL, by view'),
+    'medlyst_template_render_seconds': ('histogram', 'Template render time, by top-level template'),
+    'medlyst_cache_requests_total': ('counter', 'Cache lookups, by cache and result (hit or miss)'),
+    'medlyst_bed_feed_events_total': (
+        'counter', 'Bed feed events, by result (applied, unchanged, superseded, unknown_patient or rejected)',
+    ),
+    'medlyst_bed_feed_lag_seconds': ('histogram', 'Seconds from an ADT bed move to it being written'),
+    'medlyst_endpoint_in_flight_requests': ('gauge', 'Requests running, by endpoint class'),
+    'medlyst_endpoint_queue_depth': ('gauge', 'Requests waiting for a slot, by endpoint class'),
+    'medlyst_endpoint_queue_wait_seconds': ('histogram', 'Time spent waiting for a slot, by endpoint class'),
+    'medlyst_load_shed_total': ('counter', 'Requests turned away with a 503, by endpoint class'),
+    'medlyst_single_flight_requests_total': (
+        'counter', 'Single-flight requests, by view and role (leader rendered; follower or shared reused a render)',
+    ),
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between writes of this process's metrics to METRICS_DIR
+FLUSH_INTERVAL = 1.0
+
+# Gauges from files older than this are ignored once their worker has
+# exited. A live worker's gauges are kept however old: its requests may all
+# be stuck, and the limiter flushes whenever its gauges change, so the last
+# values written are current.
+GAUGE_MAX_AGE = 10.0
+
+
+class Registry:
+    """Counters, gauges and histograms for this process.
+
+    Each process periodically writes its totals to its own file in
+    METRICS_DIR, and /metrics sums every file, so counts from all gunicorn
+    workers are combined. Files of exited workers are kept so totals never
+    go backwards; clear the directory when the service restarts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while writing the file; separate so snapshot() can take self.lock
+        self.flush_lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [per-bucket counts..., overflow count, sum]
+        self.histograms = {}
+        self.pid = None
+        self.file_name = None
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    break
+            else:
+                i = len(DURATION_BUCKETS)
+            histogram[i] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, labels, values] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this process's totals to METRICS_DIR (at most once per FLUSH_INTERVAL unless forced)"""
+        # One writer at a time: threads share the file (and its .tmp). A
+        # routine flush skips rather than waits when another is writing.
+        if not self.flush_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if not force and now - self.flushed_at < FLUSH_INTERVAL:
+                return
+            self.flushed_at = now
+            if self.pid != os.getpid():
+                # First flush in this process (or in a worker forked after import)
+                self.pid = os.getpid()
+                self.file_name = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+            path = os.path.join(settings.METRICS_DIR, self.file_name)
+            try:
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                with open(f'{path}.tmp', 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(f'{path}.tmp', path)
+            except OSError as exc:
+                # Metrics are best-effort; never fail a request over them
+                logger.warning('Could not write metrics to %s: %s', path, exc)
+        finally:
+            self.flush_lock.release()
+
+
+registry = Registry()
+atexit.register(lambda: registry.pid and registry.flush(force=True))
+
+
+class QueryTimer:
+    """Database execute wrapper counting statements and their total time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class TimedTemplate:
+    """Backend template wrapper that records render time"""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            registry.observe(
+                'medlyst_template_render_seconds',
+                {'template': self._template.origin.template_name or 'string'},
+                time.perf_counter() - started,
+            )
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template engine that times each top-level render (includes count towards their parent)"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+_MISSING = object()
+
+
+class MeteredCacheMixin:
+    """Counts get()/get_many() hits and misses in medlyst_cache_requests_total"""
+
+    metrics_label = None
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        hit = value is not _MISSING
+        registry.inc('medlyst_cache_requests_total', {'cache': self.metrics_label, 'result': 'hit' if hit else 'miss'})
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version)
+        if found:
+            registry.inc('medlyst_cache_requests_total', {'cache': self.metrics_label, 'result': 'hit'}, len(found))
+        if len(found) < len(keys):
+            registry.inc(
+                'medlyst_cache_requests_total', {'cache': self.metrics_label, 'result': 'miss'},
+                len(keys) - len(found),
+            )
+        return found
+
+
+class MeteredLocMemCache(MeteredCacheMixin, LocMemCache):
+    metrics_label = 'locmem'
+
+
+class MeteredRedisCache(MeteredCacheMixin, RedisCache):
+    metrics_label = 'redis'
+
+
+def _process_alive(pid):
+    """Whether process ``pid`` is running on this host (unknown elsewhere: False)"""
+    if os.name != 'posix':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except (OSError, OverflowError):
+        return False
+    return True
+
+
+def collect():
+    """Sum the metrics written by every process, including this one's latest values"""
+    registry.flush(force=True)
+    counters = {}
+    gauges = {}
+    histograms = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            fresh = time.time() - os.path.getmtime(path) < GAUGE_MAX_AGE
+            if not fresh:
+                pid = os.path.basename(path).partition('-')[0]
+                fresh = pid.isdigit() and _process_alive(int(pid))
+        except (OSError, ValueError):
+            # Removed or replaced while reading
+            continue
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data.get('gauges', []) if fresh else []:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, gauges, histograms
+
+
+def business_gauges():
+    """Take-list and consult gauges: (name, help, [(labels, value)]) triples.
+
+    Two aggregate queries, cached for METRICS_GAUGE_SECONDS so frequent or
+    duplicated scrapes don't add database load.
+    """
+    gauges = cache.get('metrics:business_gauges')
+    if gauges is not None:
+        return gauges
+
+    from .models import ConsultRequest, Patient
+
+    take = Patient.objects.filter(patient_category='ACUTE_INPROCESS').aggregate(
+        size=Count('id'),
+        awaiting_clerking=Count('id', filter=Q(clerking_status='AWAITING')),
+        awaiting_ptwr=Count('id', filter=Q(clerking_status='COMPLETED', post_take_ward_round_status='AWAITING')),
+    )
+    open_consults = dict.fromkeys((code for code, _ in ConsultRequest.SPECIALTY_CHOICES), 0)
+    rows = ConsultRequest.objects.filter(status__in=ConsultRequest.QUEUE_STATUSES).order_by()
+    for row in rows.values('specialty').annotate(n=Count('id')):
+        open_consults[row['specialty']] = row['n']
+
+    gauges = [
+        ('medlyst_take_list_patients', 'Acute in-process patients on the take list', [((), take['size'])]),
+        ('medlyst_awaiting_clerking_patients', 'Take-list patients awaiting clerking',
+         [((), take['awaiting_clerking'])]),
+        ('medlyst_awaiting_ptwr_patients', 'Clerked take-list patients awaiting the post-take ward round',
+         [((), take['awaiting_ptwr'])]),
+        ('medlyst_open_consults', 'Consults requested, accepted or in progress, by specialty',
+         [((('specialty', code),), count) for code, count in open_consults.items()]),
+    ]
+    cache.set('metrics:business_gauges', gauges, settings.METRICS_GAUGE_SECONDS)
+    return gauges
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    counters, gauges, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind in ('counter', 'gauge'):
+            for (metric, labels), value in sorted((counters if kind == 'counter' else gauges).items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            count = cumulative + values[len(DURATION_BUCKETS)]
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(float(values[-1]))}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+    for name, help_text, samples in business_gauges():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,241 @@
+import math
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from .metrics import QueryTimer, registry
+from .profiling import profile_request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compress HTML pages with brotli when available, everything else with gzip.
+
+    Pages carry CSRF tokens, so like gzip's output (see GZipMiddleware's
+    max_random_bytes) each brotli body gets random-length, incompressible
+    padding to blur the compressed length (BREACH). Responses that set the
+    CSRF cookie aren't compressed at all, and streaming responses are left
+    to gzip.
+
+    Static files never reach this middleware: WhiteNoise answers them first
+    with the pre-compressed copies built by collectstatic.
+    """
+
+    min_length = 200
+    brotli_quality = 5
+
+    def process_response(self, request, response):
+        if settings.CSRF_COOKIE_NAME in response.cookies:
+            return response
+        if (
+            brotli is None
+            or response.streaming
+            or not response.get('Content-Type', '').startswith('text/html')
+            or not self._accepts_brotli(request)
+        ):
+            return super().process_response(request, response)
+
+        # Mirror GZipMiddleware's eligibility rules
+        if response.has_header('Content-Encoding') or len(response.content) < self.min_length:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        # Random hex is incompressible, so up to max_random_bytes are added
+        padding = secrets.token_hex(secrets.randbelow(self.max_random_bytes + 1))
+        compressed = brotli.compress(
+            response.content + f'<!-- {padding} -->'.encode(), quality=self.brotli_quality,
+        )
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(response.content))
+
+        # The content changed, so a strong ETag is no longer valid
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+    @staticmethod
+    def _accepts_brotli(request):
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        return any(
+            part.split(';')[0].strip() == 'br'
+            for part in accept_encoding.split(',')
+        )
+
+
+class ProfilingMiddleware:
+    """Profile a request when a staff user asks for it with ?profile=1 or
+    an X-Profile: 1 header.
+
+    The profile id is returned in an X-Profile-Id header; profiles are listed
+    at /admin/profiles/. Other requests only pay for two string checks, and
+    the session is not loaded for them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.META.get('HTTP_X_PROFILE') == '1' or (
+            'profile=1' in request.META.get('QUERY_STRING', '') and request.GET.get('profile') == '1'
+        )
+        if not requested or not request.user.is_staff:
+            return self.get_response(request)
+
+        response, profile_id = profile_request(request, self.get_response)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+
+class MetricsMiddleware:
+    """Record latency, status and SQL count/time for each request, by view.
+
+    Requests are labelled with their URL name, so series stay bounded; paths
+    that match no URL are counted together as "unmatched".
+    """
+
+    methods = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in self.methods else 'other'
+        registry.inc('medlyst_http_requests_total', {'view': view, 'method': method, 'status': response.status_code})
+        registry.observe('medlyst_http_request_duration_seconds', {'view': view}, elapsed)
+        registry.inc('medlyst_db_queries_total', {'view': view}, queries.count)
+        registry.inc('medlyst_db_query_seconds_total', {'view': view}, queries.seconds)
+        registry.flush()
+        return response
+
+
+class EndpointLimiter:
+    """Concurrency limit for one endpoint class within this worker process.
+
+    Up to ``limit`` requests run at once; up to ``max_queue`` more wait at
+    most ``max_wait`` seconds for a slot. acquire() returns False for
+    anything beyond that, so an overloaded worker answers at once instead
+    of letting requests pile up behind its threads.
+    """
+
+    def __init__(self, name, limit, max_wait, max_queue, retry_after):
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self):
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                self._report()
+                return True
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            # The backlog is what a saturated worker most needs to show, and
+            # its requests may not finish (and flush) for a long time
+            self._report(flush=True)
+            started = time.monotonic()
+            deadline = started + self.max_wait
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+                self._report(flush=True)
+                registry.observe(
+                    'medlyst_endpoint_queue_wait_seconds', {'endpoint_class': self.name},
+                    time.monotonic() - started,
+                )
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self._report()
+            self.condition.notify()
+        # So the last values written are never an in-flight request that has
+        # finished; /metrics keeps showing them while this worker is alive
+        registry.flush(force=True)
+
+    def _report(self, flush=False):
+        labels = {'endpoint_class': self.name}
+        registry.set('medlyst_endpoint_in_flight_requests', labels, self.active)
+        registry.set('medlyst_endpoint_queue_depth', labels, self.waiting)
+        if flush:
+            registry.flush(force=True)
+
+
+class LoadSheddingMiddleware:
+    """Apply the ENDPOINT_LIMITS concurrency limits, by URL name.
+
+    Runs as a view hook, after URL resolution, so views outside every class
+    are not limited at all. A request that can't get a slot in time gets a
+    503 with Retry-After; the slot is released once the response (including
+    the middleware below this one) is complete.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiters = {}
+        for name, config in settings.ENDPOINT_LIMITS.items():
+            limiter = EndpointLimiter(
+                name, config['limit'], config['max_wait'], config['max_queue'], config['retry_after'],
+            )
+            for view_name in config['views']:
+                self.limiters[view_name] = limiter
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            limiter = getattr(request, '_endpoint_limiter', None)
+            if limiter is not None:
+                limiter.release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limiter = self.limiters.get(request.resolver_match.view_name)
+        if limiter is None:
+            return None
+        if not limiter.acquire():
+            registry.inc('medlyst_load_shed_total', {'endpoint_class': limiter.name})
+            response = HttpResponse(
+                'MedLyst is busy. Please try again in a moment.\n', status=503, content_type='text/plain',
+            )
+            response['Retry-After'] = str(math.ceil(limiter.retry_after))
+            return response
+        request._endpoint_limiter = limiter
+        return None
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0005_consultrequest_comments_patient_issues_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["assigned_to", "status", "priority", "due_date"],
+                name="task_worklist_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,92 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# (model, legacy free-text field, nullable FK replacing it)
+# Required fields are tightened to NOT NULL in 0009 once backfilled.
+CLINICIAN_FIELDS = [
+    ("patient", "clerking_doctor", "clerked_patients"),
+    ("patient", "ptwr_doctor", "ptwr_patients"),
+    ("consultrequest", "requested_by", "consults_requested"),
+    ("consultrequest", "reviewed_by", "consults_reviewed"),
+    ("wardround", "doctor", "ward_rounds"),
+    ("task", "assigned_to", "assigned_tasks"),
+    ("task", "created_by", "created_tasks"),
+]
+
+
+def legacy_field_operations():
+    # Keep the free-text values under a legacy name until 0008 has copied them
+    operations = []
+    for model_name, field_name, related_name in CLINICIAN_FIELDS:
+        operations += [
+            migrations.RenameField(
+                model_name=model_name,
+                old_name=field_name,
+                new_name=f"{field_name}_legacy",
+            ),
+            migrations.AddField(
+                model_name=model_name,
+                name=field_name,
+                field=models.ForeignKey(
+                    blank=True,
+                    null=True,
+                    on_delete=django.db.models.deletion.PROTECT,
+                    related_name=related_name,
+                    to="patients.clinician",
+                    # Covered by task_worklist_idx
+                    db_index=field_name != "assigned_to",
+                ),
+            ),
+        ]
+    return operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0006_task_worklist_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Clinician",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=200)),
+                (
+                    "normalized_name",
+                    models.CharField(
+                        editable=False,
+                        help_text="Case/punctuation-insensitive key used to stop typos splitting records",
+                        max_length=200,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "active",
+                    models.BooleanField(
+                        default=True, help_text="Offered in form dropdowns"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["name"],
+            },
+        ),
+        # Rebuilt on the foreign key column in 0009
+        migrations.RemoveIndex(
+            model_name="task",
+            name="task_worklist_idx",
+        ),
+        *legacy_field_operations(),
+    ]
@@ -0,0 +1,120 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+BATCH_SIZE = 1000
+
+# model -> free-text fields now backed by a Clinician foreign key
+CLINICIAN_FIELDS = {
+    "Patient": ["clerking_doctor", "ptwr_doctor"],
+    "ConsultRequest": ["requested_by", "reviewed_by"],
+    "WardRound": ["doctor"],
+    "Task": ["assigned_to", "created_by"],
+}
+
+# Fields that become NOT NULL in 0009; blank legacy values map to this name
+REQUIRED_FIELDS = {"requested_by", "doctor", "created_by"}
+UNKNOWN_CLINICIAN = "Unknown"
+
+
+def normalize(name):
+    # Frozen copy of Clinician.normalize
+    return " ".join(name.replace(".", " ").split()).casefold()
+
+
+def backfill_clinicians(apps, schema_editor):
+    Clinician = apps.get_model("patients", "Clinician")
+
+    # Pass 1: tally every distinct spelling with a GROUP BY per field and keep
+    # the most common spelling of each normalised name as the display name.
+    spellings = {}
+    for model_name, fields in CLINICIAN_FIELDS.items():
+        Model = apps.get_model("patients", model_name)
+        for field in fields:
+            rows = (
+                Model.objects.order_by()
+                .values_list(f"{field}_legacy")
+                .annotate(n=Count("id"))
+            )
+            for raw, n in rows:
+                name = " ".join((raw or "").split()) or (
+                    UNKNOWN_CLINICIAN if field in REQUIRED_FIELDS else ""
+                )
+                if name:
+                    counts = spellings.setdefault(normalize(name), {})
+                    counts[name] = counts.get(name, 0) + n
+
+    existing = set(Clinician.objects.values_list("normalized_name", flat=True))
+    Clinician.objects.bulk_create(
+        [
+            Clinician(name=max(counts, key=counts.get), normalized_name=key)
+            for key, counts in spellings.items()
+            if key not in existing
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    ids = dict(Clinician.objects.values_list("normalized_name", "id"))
+
+    def resolve(raw, field):
+        name = " ".join((raw or "").split())
+        if not name and field in REQUIRED_FIELDS:
+            name = UNKNOWN_CLINICIAN
+        return ids[normalize(name)] if name else None
+
+    # Pass 2: point each row at its clinician, walking the table by id
+    for model_name, fields in CLINICIAN_FIELDS.items():
+        Model = apps.get_model("patients", model_name)
+        legacy = [f"{field}_legacy" for field in fields]
+        last_id = 0
+        while True:
+            batch = list(
+                Model.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .only("id", *legacy)[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            for obj in batch:
+                for field in fields:
+                    setattr(
+                        obj,
+                        f"{field}_id",
+                        resolve(getattr(obj, f"{field}_legacy"), field),
+                    )
+            Model.objects.bulk_update(batch, [f"{field}_id" for field in fields])
+            last_id = batch[-1].id
+
+
+def restore_free_text(apps, schema_editor):
+    Clinician = apps.get_model("patients", "Clinician")
+    names = dict(Clinician.objects.values_list("id", "name"))
+
+    for model_name, fields in CLINICIAN_FIELDS.items():
+        Model = apps.get_model("patients", model_name)
+        last_id = 0
+        while True:
+            batch = list(
+                Model.objects.filter(id__gt=last_id).order_by("id")[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            for obj in batch:
+                for field in fields:
+                    setattr(
+                        obj,
+                        f"{field}_legacy",
+                        names.get(getattr(obj, f"{field}_id"), ""),
+                    )
+            Model.objects.bulk_update(batch, [f"{field}_legacy" for field in fields])
+            last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0007_clinician"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_clinicians, restore_free_text),
+    ]
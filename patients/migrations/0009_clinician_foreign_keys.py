@@ -0,0 +1,91 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0008_backfill_clinicians"),
+    ]
+
+    operations = [
+        # Give the required legacy columns a default so this migration can
+        # be reversed (the columns are re-added before 0008 refills them)
+        migrations.AlterField(
+            model_name="consultrequest",
+            name="requested_by_legacy",
+            field=models.CharField(default="", max_length=200),
+        ),
+        migrations.AlterField(
+            model_name="wardround",
+            name="doctor_legacy",
+            field=models.CharField(default="", max_length=200),
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="created_by_legacy",
+            field=models.CharField(default="", max_length=200),
+        ),
+        migrations.RemoveField(
+            model_name="patient",
+            name="clerking_doctor_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="patient",
+            name="ptwr_doctor_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="consultrequest",
+            name="requested_by_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="consultrequest",
+            name="reviewed_by_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="wardround",
+            name="doctor_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="task",
+            name="assigned_to_legacy",
+        ),
+        migrations.RemoveField(
+            model_name="task",
+            name="created_by_legacy",
+        ),
+        migrations.AlterField(
+            model_name="consultrequest",
+            name="requested_by",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="consults_requested",
+                to="patients.clinician",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="wardround",
+            name="doctor",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ward_rounds",
+                to="patients.clinician",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="created_by",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="created_tasks",
+                to="patients.clinician",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["assigned_to", "status", "priority", "due_date"],
+                name="task_worklist_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0009_clinician_foreign_keys"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                (
+                    "watermark",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Time up to which the job has processed",
+                        null=True,
+                    ),
+                ),
+                (
+                    "last_id",
+                    models.BigIntegerField(
+                        default=0, help_text="Highest row id the job has processed"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="escalated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="escalation",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("", "None"),
+                    ("DUE_SOON", "Due Soon"),
+                    ("OVERDUE", "Overdue"),
+                ],
+                default="",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(fields=["status", "due_date"], name="task_due_idx"),
+        ),
+    ]
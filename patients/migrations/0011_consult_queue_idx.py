@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0010_task_escalation"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="consultrequest",
+            index=models.Index(
+                fields=["specialty", "status", "requested_at"], name="consult_queue_idx"
+            ),
+        ),
+    ]
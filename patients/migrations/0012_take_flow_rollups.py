@@ -0,0 +1,96 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0011_consult_queue_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TakeFlowRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("REFERRAL_TO_CLERKING", "Referral → Clerking"),
+                            ("CLERKING_TO_PTWR", "Clerking → PTWR"),
+                            ("PTWR_TO_ADMISSION", "PTWR → Admission Complete"),
+                        ],
+                        max_length=25,
+                    ),
+                ),
+                (
+                    "hour",
+                    models.DateTimeField(
+                        help_text="Start of the hour (UTC) the transition completed in"
+                    ),
+                ),
+                (
+                    "specialty",
+                    models.CharField(
+                        choices=[
+                            ("ED", "Emergency Department"),
+                            ("MEDICINE", "Medicine"),
+                            ("SURGERY", "Surgery"),
+                            ("ORTHOPAEDICS", "Orthopaedics"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "team",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("ED", "Emergency Department"),
+                            ("MEDA", "Medical Team A"),
+                            ("MEDB", "Medical Team B"),
+                            ("SURGA", "Surgical Team A"),
+                            ("SURGB", "Surgical Team B"),
+                            ("ORTHO", "Orthopaedics"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("total_seconds", models.FloatField(default=0)),
+                ("max_seconds", models.FloatField(default=0)),
+                (
+                    "sketch",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Serialised QuantileSketch of durations in seconds",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["hour"],
+            },
+        ),
+        migrations.AddField(
+            model_name="patient",
+            name="admission_completed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="takeflowrollup",
+            constraint=models.UniqueConstraint(
+                fields=("metric", "hour", "specialty", "team"),
+                name="take_flow_rollup_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0012_take_flow_rollups"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="consultrequest",
+            index=models.Index(fields=["requested_at"], name="consult_requested_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                fields=["datetime_of_arrival"], name="patient_arrival_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(fields=["created_at"], name="task_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="wardround",
+            index=models.Index(fields=["timestamp"], name="wardround_timestamp_idx"),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0013_admin_date_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="patient",
+            name="version",
+            field=models.PositiveIntegerField(
+                default=1,
+                editable=False,
+                help_text="Incremented on every save; detects concurrent edits",
+            ),
+        ),
+    ]
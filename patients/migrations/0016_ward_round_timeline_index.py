@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0015_delta_sync"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="wardround",
+            index=models.Index(
+                fields=["patient", "-timestamp", "-id"], name="wardround_timeline_idx"
+            ),
+        ),
+    ]
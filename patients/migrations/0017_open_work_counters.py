@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+# Frozen copies of Task.OPEN_STATUSES and ConsultRequest.QUEUE_STATUSES
+OPEN_TASK_STATUSES = ["PENDING", "IN_PROGRESS"]
+OPEN_CONSULT_STATUSES = ["REQUESTED", "ACCEPTED", "IN_PROGRESS"]
+
+
+def backfill_counters(apps, schema_editor):
+    Patient = apps.get_model("patients", "Patient")
+    Task = apps.get_model("patients", "Task")
+    ConsultRequest = apps.get_model("patients", "ConsultRequest")
+
+    def count(model, **filters):
+        rows = (
+            model.objects.filter(patient=OuterRef("pk"), **filters)
+            .order_by()
+            .values("patient")
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        return Coalesce(Subquery(rows), 0)
+
+    # One UPDATE per id range, so no statement holds the table for long
+    last_id = Patient.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        Patient.objects.filter(id__gt=start, id__lte=start + BATCH_SIZE).update(
+            open_task_count=count(Task, status__in=OPEN_TASK_STATUSES),
+            urgent_task_count=count(Task, status__in=OPEN_TASK_STATUSES, priority="URGENT"),
+            open_consult_count=count(ConsultRequest, status__in=OPEN_CONSULT_STATUSES),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0016_ward_round_timeline_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="patient",
+            name="open_consult_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="patient",
+            name="open_task_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="patient",
+            name="urgent_task_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
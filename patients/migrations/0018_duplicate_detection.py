@@ -0,0 +1,110 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0017_open_work_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DuplicateBlockKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=40)),
+                (
+                    "patient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="patients.patient",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DuplicateCandidate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "score",
+                    models.FloatField(
+                        help_text="0-1; higher is more likely the same person"
+                    ),
+                ),
+                ("reasons", models.CharField(max_length=300)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("OPEN", "Open"),
+                            ("DUPLICATE", "Confirmed duplicate"),
+                            ("NOT_DUPLICATE", "Not a duplicate"),
+                        ],
+                        default="OPEN",
+                        max_length=15,
+                    ),
+                ),
+                (
+                    "detected_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("reviewed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "other",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="patients.patient",
+                    ),
+                ),
+                (
+                    "patient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="patients.patient",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-score"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "-score"], name="duplicate_review_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="duplicatecandidate",
+            constraint=models.UniqueConstraint(
+                fields=("patient", "other"), name="duplicate_pair_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="duplicateblockkey",
+            index=models.Index(fields=["key"], name="duplicate_block_key_idx"),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:24
+
+from django.db import migrations, models
+
+
+# Frozen copies of Task.PRIORITY_RANK and Task.OPEN_STATUSES
+PRIORITY_RANK = {"URGENT": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+OPEN_TASK_STATUSES = ["PENDING", "IN_PROGRESS"]
+
+
+def backfill_worklist_keys(apps, schema_editor):
+    Task = apps.get_model("patients", "Task")
+    # A few bucket-wide UPDATEs, run before the indexes are built
+    Task.objects.exclude(status__in=OPEN_TASK_STATUSES).update(is_open=False)
+    for priority, rank in PRIORITY_RANK.items():
+        tasks = Task.objects.filter(priority=priority)
+        tasks.filter(due_date__isnull=False).update(worklist_rank=2 * rank)
+        tasks.filter(due_date__isnull=True).update(worklist_rank=2 * rank + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0018_duplicate_detection"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="task",
+            name="task_worklist_idx",
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="is_open",
+            field=models.BooleanField(
+                default=True, editable=False, help_text="Status is in OPEN_STATUSES"
+            ),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="worklist_rank",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_worklist_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["assigned_to", "worklist_rank", "due_date", "id"],
+                name="task_worklist_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["is_open", "worklist_rank", "due_date", "id"],
+                name="task_open_worklist_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["status", "worklist_rank", "due_date", "id"],
+                name="task_status_worklist_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["worklist_rank", "due_date", "id"], name="task_rank_idx"
+            ),
+        ),
+    ]
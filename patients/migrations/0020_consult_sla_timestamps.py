@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Frozen copy of ConsultRequest.ACCEPTED_STATUSES
+ACCEPTED_STATUSES = ["ACCEPTED", "IN_PROGRESS", "COMPLETED"]
+
+
+def backfill_timestamps(apps, schema_editor):
+    # The last review is the best record there is of when these happened
+    ConsultRequest = apps.get_model("patients", "ConsultRequest")
+    ConsultRequest.objects.filter(status__in=ACCEPTED_STATUSES).update(accepted_at=F("reviewed_at"))
+    ConsultRequest.objects.filter(status="COMPLETED").update(completed_at=F("reviewed_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0019_task_worklist_rank"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="consultrequest",
+            name="accepted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="consultrequest",
+            name="completed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_timestamps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+# Frozen copy of TakeFlowRollup.METRIC_FIELDS
+METRIC_FIELDS = {
+    "REFERRAL_TO_CLERKING": ("referral_to_specialty_datetime", "clerking_completed_at"),
+    "CLERKING_TO_PTWR": ("clerking_completed_at", "ptwr_completed_at"),
+    "PTWR_TO_ADMISSION": ("ptwr_completed_at", "admission_completed_at"),
+}
+
+
+def backfill_transitions(apps, schema_editor):
+    # Where patients were when they completed each step wasn't kept; their
+    # current specialty and team are the best record there is
+    Patient = apps.get_model("patients", "Patient")
+    TakeFlowTransition = apps.get_model("patients", "TakeFlowTransition")
+    for metric, (start_field, end_field) in METRIC_FIELDS.items():
+        rows = (
+            Patient.objects.filter(**{f"{start_field}__isnull": False, f"{end_field}__isnull": False})
+            .order_by()
+            .values_list("id", start_field, end_field, "current_parent_specialty", "current_responsible_team")
+        )
+        TakeFlowTransition.objects.bulk_create(
+            (
+                TakeFlowTransition(
+                    patient_id=patient_id,
+                    metric=metric,
+                    completed_at=max(start, end),
+                    seconds=max(0.0, (end - start).total_seconds()),
+                    specialty=specialty,
+                    team=team or "",
+                )
+                for patient_id, start, end, specialty, team in rows.iterator(chunk_size=BATCH_SIZE)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("patients", "0020_consult_sla_timestamps"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TakeFlowTransition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("REFERRAL_TO_CLERKING", "Referral → Clerking"),
+                            ("CLERKING_TO_PTWR", "Clerking → PTWR"),
+                            ("PTWR_TO_ADMISSION", "PTWR → Admission Complete"),
+                        ],
+                        max_length=25,
+                    ),
+                ),
+                (
+                    "completed_at",
+                    models.DateTimeField(
+                        help_text="When the later of the two steps completed"
+                    ),
+                ),
+                (
+                    "seconds",
+                    models.FloatField(
+                        help_text="Duration counted; 0 when the steps were recorded out of order"
+                    ),
+                ),
+                (
+                    "specialty",
+                    models.CharField(
+                        choices=[
+                            ("ED", "Emergency Department"),
+                            ("MEDICINE", "Medicine"),
+                            ("SURGERY", "Surgery"),
+                            ("ORTHOPAEDICS", "Orthopaedics"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "team",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("ED", "Emergency Department"),
+                            ("MEDA", "Medical Team A"),
+                            ("MEDB", "Medical Team B"),
+                            ("SURGA", "Surgical Team A"),
+                            ("SURGB", "Surgical Team B"),
+                            ("ORTHO", "Orthopaedics"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "patient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="take_flow_transitions",
+                        to="patients.patient",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["completed_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["completed_at"], name="take_flow_transition_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_transitions, migrations.RunPython.noop),
+    ]
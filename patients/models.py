@@ -1,5 +1,60 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import (
+    BooleanField, Case, DurationField, ExpressionWrapper, F, Q, Value, When,
+)
+from django.db.models.functions import Now
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .pagination import InvalidCursor
+
+
+class VersionConflict(Exception):
+    """Raised when a row was changed by someone else since it was read"""
+
+
+class Clinician(models.Model):
+    """Model representing a doctor named on workflow records"""
+    
+    name = models.CharField(max_length=200)
+    normalized_name = models.CharField(
+        max_length=200,
+        unique=True,
+        editable=False,
+        help_text="Case/punctuation-insensitive key used to stop typos splitting records",
+    )
+    active = models.BooleanField(default=True, help_text="Offered in form dropdowns")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    @staticmethod
+    def normalize(name):
+        """Collapse case, dots and whitespace: 'Dr. Smith' and 'dr  smith' match"""
+        return ' '.join(name.replace('.', ' ').split()).casefold()
+    
+    @classmethod
+    def from_name(cls, name):
+        """Return the clinician for a typed name, creating one if needed (None if blank)"""
+        name = ' '.join((name or '').split())
+        if not name:
+            return None
+        clinician, _ = cls.objects.get_or_create(
+            normalized_name=cls.normalize(name),
+            defaults={'name': name},
+        )
+        return clinician
+    
+    def save(self, *args, **kwargs):
+        self.normalized_name = self.normalize(self.name)
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return self.name
 
 
 class Patient(models.Model):
@@ -93,7 +148,9 @@ class Patient(models.Model):
         choices=CLERKING_STATUS_CHOICES,
         default='NOT_REQUIRED'
     )
-    clerking_doctor = models.CharField(max_length=200, blank=True)
+    clerking_doctor = models.ForeignKey(
+        Clinician, on_delete=models.PROTECT, null=True, blank=True, related_name='clerked_patients'
+    )
     clerking_completed_at = models.DateTimeField(null=True, blank=True)
     
     # Post Take Ward Round (PTWR)
@@ -109,7 +166,9 @@ class Patient(models.Model):
         choices=PTWR_STATUS_CHOICES,
         default='NOT_REQUIRED'
     )
-    ptwr_doctor = models.CharField(max_length=200, blank=True)
+    ptwr_doctor = models.ForeignKey(
+        Clinician, on_delete=models.PROTECT, null=True, blank=True, related_name='ptwr_patients'
+    )
     ptwr_completed_at = models.DateTimeField(null=True, blank=True)
     
     # Admission Type
@@ -123,13 +182,38 @@ class Patient(models.Model):
         choices=ADMISSION_TYPE_CHOICES,
         default='ACUTE'
     )
+    admission_completed_at = models.DateTimeField(null=True, blank=True)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Optimistic concurrency control
+    version = models.PositiveIntegerField(
+        default=1, editable=False, help_text="Incremented on every save; detects concurrent edits"
+    )
+    
+    # Open-work counters shown as list badges. Task and consult saves and
+    # deletes keep them in step with F() increments (see OpenWorkCounted);
+    # reconcile_open_work_counts corrects any drift.
+    open_task_count = models.IntegerField(default=0, editable=False)
+    urgent_task_count = models.IntegerField(default=0, editable=False)
+    open_consult_count = models.IntegerField(default=0, editable=False)
+    
+    COUNTER_FIELDS = ('open_task_count', 'urgent_task_count', 'open_consult_count')
+    
+    # Fields duplicate detection's blocking keys are built from; a save that
+    # changes them re-indexes the patient (see signals.refresh_duplicate_keys)
+    BLOCK_KEY_FIELDS = ('name', 'nhi_number', 'datetime_of_arrival')
+    
     class Meta:
         ordering = ['-datetime_of_arrival']
+        indexes = [
+            # Default ordering and the admin date hierarchy
+            models.Index(fields=['datetime_of_arrival'], name='patient_arrival_idx'),
+            # Delta sync reads changes in (updated_at, id) order
+            models.Index(fields=['updated_at', 'id'], name='patient_sync_idx'),
+        ]
     
     def is_ed_patient(self):
         """Check if patient is in ED category"""
@@ -161,6 +245,55 @@ class Patient(models.Model):
                 self.clerking_status == 'COMPLETED' and 
                 self.post_take_ward_round_status == 'COMPLETED')
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._keyed = instance.block_key_values()
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._keyed = self.block_key_values()
+    
+    def block_key_values(self):
+        """BLOCK_KEY_FIELDS as in memory, or None if some are deferred"""
+        if self.get_deferred_fields() & set(self.BLOCK_KEY_FIELDS):
+            return None
+        return {name: getattr(self, name) for name in self.BLOCK_KEY_FIELDS}
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        # A savepoint, so a VersionConflict doesn't poison an enclosing transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """UPDATE ... WHERE version = <version read>, setting version + 1.
+        
+        A concurrent save will have bumped the version, so this matches no
+        row and raises VersionConflict instead of overwriting that edit.
+        Callers set ``version`` to the value a form was rendered with to
+        extend the check across the user's think time.
+        """
+        expected = self.version
+        # Counters are only ever written as increments, so a save never puts
+        # back the stale counts this instance was loaded with
+        values = [
+            (field, model, expected + 1 if field.attname == 'version' else value)
+            for field, model, value in values
+            if field.attname not in self.COUNTER_FIELDS
+        ]
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(f'Patient {pk_val} changed since version {expected}')
+        if updated:
+            self.version = expected + 1
+        return updated
+    
     def get_location_display_full(self):
         """Get full location display with bed number"""
         location = self.get_location_display()
@@ -172,7 +305,162 @@ class Patient(models.Model):
         return f"{self.name} - {self.nhi_number}"
 
 
-class ConsultRequest(models.Model):
+def open_work_changes(previous, current):
+    """Counter deltas between two (patient id, counts) states: {patient_id: {counter: delta}}"""
+    changes = {}
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is None or state[0] is None:
+            continue
+        deltas = changes.setdefault(state[0], {})
+        for name, count in state[1].items():
+            deltas[name] = deltas.get(name, 0) + sign * count
+    return changes
+
+
+def adjust_open_work_counts(changes):
+    """Apply open_work_changes() to the patients with F() increments.
+
+    A plain queryset update: it doesn't bump the patient's version or
+    updated_at, so adding a task never conflicts with an open patient form.
+    """
+    for patient_id, deltas in changes.items():
+        increments = {name: F(name) + delta for name, delta in deltas.items() if delta}
+        if increments:
+            Patient._base_manager.filter(pk=patient_id).update(**increments)
+
+
+class OpenWorkCounted:
+    """Keeps the patient's open-work counters in step with this row.
+    
+    ``open_work(values)`` gives the counters a row adds to its patient given
+    its ``open_work_fields``. Updates are a conditional UPDATE on the values
+    this instance loaded (or last saved), so the counts being replaced are
+    exactly those of the stored row: when another request changed it in
+    the meantime, the save re-reads the row and replaces what it holds
+    instead. The difference is applied to the patient in the same
+    transaction. Deletes, including cascades and queryset deletes, are
+    handled by a post_delete receiver.
+    """
+    
+    open_work_fields = ()
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted = instance.open_work_values()
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._counted = self.open_work_values()
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._counted = self.open_work_values()
+    
+    def open_work_values(self):
+        """patient_id and open_work_fields as in memory, or None if some are deferred"""
+        names = ['patient_id', *self.open_work_fields]
+        if self.get_deferred_fields() & set(names):
+            return None
+        return {name: getattr(self, name) for name in names}
+    
+    @classmethod
+    def open_work_state(cls, values):
+        """(patient id, counts) for open_work_values() or a stored row; None for None"""
+        return values and (values['patient_id'], cls.open_work(values))
+    
+    def _count(self, replaced, current):
+        """Apply the counter change from the ``replaced`` values to ``current``"""
+        changes = open_work_changes(self.open_work_state(replaced), self.open_work_state(current))
+        adjust_open_work_counts(changes)
+        return any(any(deltas.values()) for deltas in changes.values())
+    
+    def _do_insert(self, manager, using, fields, returning_fields, raw):
+        with transaction.atomic(using=using):
+            result = super()._do_insert(manager, using, fields, returning_fields, raw)
+            self._count(None, self.open_work_values())
+        return result
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        names = ['patient_id', *self.open_work_fields]
+        if not {field.attname for field, _, _ in values} & set(names):
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        
+        def update_if_holding(expected):
+            return super(OpenWorkCounted, self)._do_update(
+                base_qs.filter(**expected), using, pk_val, values, update_fields, forced_update,
+            )
+        
+        expected = getattr(self, '_counted', None)
+        current = self.open_work_values()
+        if expected is not None and current is not None and not any(
+            any(deltas.values())
+            for deltas in open_work_changes(self.open_work_state(expected), self.open_work_state(current)).values()
+        ):
+            # Most edits (notes, due dates) leave the counts alone and need
+            # no transaction, as long as the row still holds what was loaded
+            if update_if_holding(expected):
+                return True
+            expected = None
+        
+        with transaction.atomic(using=using):
+            while True:
+                if expected is None:
+                    expected = base_qs.filter(pk=pk_val).values(*names).first()
+                    if expected is None:
+                        # Deleted meanwhile; Django inserts it again
+                        return False
+                if update_if_holding(expected):
+                    break
+                # Someone else saved it first; replace what they stored
+                expected = None
+            # Deferred fields are only known once saved
+            current = current or base_qs.filter(pk=pk_val).values(*names).get()
+            self._count(expected, current)
+        return True
+
+
+class ConsultRequestQuerySet(models.QuerySet):
+    """Query helpers for specialty consult work queues"""
+    
+    def with_timers(self):
+        """Annotate waiting times and SLA breach flags, computed in the database.
+        
+        time_to_accept runs until the consult is first accepted (accepted_at);
+        time_to_complete runs until it is completed (completed_at).
+        """
+        def elapsed_until(end):
+            return ExpressionWrapper(end - F('requested_at'), output_field=DurationField())
+        
+        accept_sla = timedelta(hours=settings.CONSULT_ACCEPT_SLA_HOURS)
+        complete_sla = timedelta(hours=settings.CONSULT_COMPLETE_SLA_HOURS)
+        
+        return self.annotate(
+            waiting=elapsed_until(Now()),
+            time_to_accept=Case(
+                When(accepted_at__isnull=False, then=elapsed_until(F('accepted_at'))),
+                default=elapsed_until(Now()),
+            ),
+            time_to_complete=Case(
+                When(status='COMPLETED', then=elapsed_until(F('completed_at'))),
+                default=elapsed_until(Now()),
+            ),
+        ).annotate(
+            accept_breached=Case(
+                When(time_to_accept__gt=accept_sla, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+            complete_breached=Case(
+                When(time_to_complete__gt=complete_sla, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        )
+
+
+class ConsultRequest(OpenWorkCounted, models.Model):
     """Model representing a consult request for a patient"""
     
     SPECIALTY_CHOICES = [
@@ -191,22 +479,49 @@ class ConsultRequest(models.Model):
         ('DECLINED', 'Declined'),
     ]
     
+    # Statuses that make up a specialty's work queue, in workflow order
+    QUEUE_STATUSES = ['REQUESTED', 'ACCEPTED', 'IN_PROGRESS']
+    
+    # Statuses a consult has been accepted in
+    ACCEPTED_STATUSES = ['ACCEPTED', 'IN_PROGRESS', 'COMPLETED']
+    
+    open_work_fields = ('status',)
+    
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='consult_requests')
     specialty = models.CharField(max_length=20, choices=SPECIALTY_CHOICES)
     reason = models.TextField()
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='REQUESTED')
-    requested_by = models.CharField(max_length=200)
+    requested_by = models.ForeignKey(Clinician, on_delete=models.PROTECT, related_name='consults_requested')
     requested_at = models.DateTimeField(default=timezone.now)
-    reviewed_by = models.CharField(max_length=200, blank=True)
+    reviewed_by = models.ForeignKey(
+        Clinician, on_delete=models.PROTECT, null=True, blank=True, related_name='consults_reviewed'
+    )
     reviewed_at = models.DateTimeField(null=True, blank=True)
+    # SLA timer end points; unlike reviewed_at, later status changes don't move them
+    accepted_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True)
     comments = models.TextField(blank=True, help_text="Reviewer comments")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = ConsultRequestQuerySet.as_manager()
     
     class Meta:
         ordering = ['-requested_at']
+        indexes = [
+            # One bounded range scan per specialty/status queue, oldest first
+            models.Index(fields=['specialty', 'status', 'requested_at'], name='consult_queue_idx'),
+            models.Index(fields=['requested_at'], name='consult_requested_idx'),
+            models.Index(fields=['updated_at', 'id'], name='consult_sync_idx'),
+        ]
         
     def __str__(self):
         return f"{self.specialty} consult for {self.patient.name}"
+    
+    @classmethod
+    def open_work(cls, values):
+        """Patient counters an open consult adds to"""
+        return {'open_consult_count': 1} if values['status'] in cls.QUEUE_STATUSES else {}
 
 
 class WardRound(models.Model):
@@ -219,18 +534,67 @@ class WardRound(models.Model):
     
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='ward_rounds')
     ward_round_type = models.CharField(max_length=15, choices=WARD_ROUND_TYPE_CHOICES)
-    doctor = models.CharField(max_length=200)
+    doctor = models.ForeignKey(Clinician, on_delete=models.PROTECT, related_name='ward_rounds')
     notes = models.TextField()
     timestamp = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='wardround_timestamp_idx'),
+            models.Index(fields=['updated_at', 'id'], name='wardround_sync_idx'),
+            # A patient's timeline, newest first, paged by (timestamp, id)
+            models.Index(fields=['patient', '-timestamp', '-id'], name='wardround_timeline_idx'),
+        ]
         
     def __str__(self):
         return f"{self.ward_round_type} - {self.patient.name} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
 
-class Task(models.Model):
+class TaskQuerySet(models.QuerySet):
+    """Query helpers for cross-patient task worklists"""
+
+    def open(self):
+        # Compared with "= true" rather than tested bare, so the planner can
+        # seek task_open_worklist_idx on it
+        return self.filter(is_open=Value(True))
+
+    def in_worklist_order(self):
+        """Order URGENT to LOW, then soonest due date (undated last), then id.
+
+        Sorting on the stored worklist_rank rather than a computed priority
+        lets the worklist indexes return rows already in order, so a page
+        reads only its own rows however many tasks match.
+        """
+        return self.order_by('worklist_rank', 'due_date', 'id')
+    
+    def after(self, cursor):
+        """Keyset filter for rows following cursor in worklist order.
+
+        Raises InvalidCursor unless cursor is a [rank, due date or None, id]
+        triple as produced by Task.worklist_cursor.
+        """
+        rank, due_date, task_id = cursor
+        if not isinstance(rank, int) or not isinstance(task_id, int) or isinstance(rank, bool):
+            raise InvalidCursor('Malformed cursor')
+        if rank % 2:
+            # Undated tasks have their own rank, ordered by id
+            if due_date is not None:
+                raise InvalidCursor('Malformed cursor')
+            same_rank = Q(id__gt=task_id)
+        else:
+            try:
+                due_date = parse_datetime(due_date) if isinstance(due_date, str) else None
+            except ValueError:
+                due_date = None
+            if due_date is None:
+                raise InvalidCursor('Malformed cursor')
+            same_rank = Q(due_date__gt=due_date) | Q(due_date=due_date, id__gt=task_id)
+        return self.filter(Q(worklist_rank__gt=rank) | Q(worklist_rank=rank) & same_rank)
+
+
+class Task(OpenWorkCounted, models.Model):
     """Model representing a pending task for a patient"""
     
     PRIORITY_CHOICES = [
@@ -247,18 +611,262 @@ class Task(models.Model):
         ('CANCELLED', 'Cancelled'),
     ]
     
+    OPEN_STATUSES = ['PENDING', 'IN_PROGRESS']
+    
+    ESCALATION_CHOICES = [
+        ('', 'None'),
+        ('DUE_SOON', 'Due Soon'),
+        ('OVERDUE', 'Overdue'),
+    ]
+    
+    # Worklist sort order, most urgent first
+    PRIORITY_RANK = {'URGENT': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+    
+    @classmethod
+    def rank_for(cls, priority, due_date):
+        """worklist_rank: two per priority, dated tasks before undated ones"""
+        return 2 * cls.PRIORITY_RANK.get(priority, len(cls.PRIORITY_RANK)) + (due_date is None)
+    
+    open_work_fields = ('status', 'priority')
+    
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='tasks')
     description = models.TextField()
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='MEDIUM')
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='PENDING')
-    assigned_to = models.CharField(max_length=200, blank=True)
-    created_by = models.CharField(max_length=200)
+    # Indexed as the leading column of task_worklist_idx
+    assigned_to = models.ForeignKey(
+        Clinician,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='assigned_tasks',
+        db_index=False,
+    )
+    created_by = models.ForeignKey(Clinician, on_delete=models.PROTECT, related_name='created_tasks')
     created_at = models.DateTimeField(default=timezone.now)
     due_date = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    # Set by the overdue sweeper (see patients.escalation) or when edited
+    escalation = models.CharField(max_length=10, choices=ESCALATION_CHOICES, blank=True, default='')
+    escalated_at = models.DateTimeField(null=True, blank=True)
+    
+    # Worklist keys set on save (see rank_for), so the worklist is read in
+    # order along an index: (is_open or status, worklist_rank, due_date, id)
+    worklist_rank = models.PositiveSmallIntegerField(default=0, editable=False)
+    is_open = models.BooleanField(default=True, editable=False, help_text="Status is in OPEN_STATUSES")
+    
+    objects = TaskQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Walked in worklist order per clinician, for open work, for one
+            # status and across every status
+            models.Index(
+                fields=['assigned_to', 'worklist_rank', 'due_date', 'id'],
+                name='task_worklist_idx',
+            ),
+            models.Index(fields=['is_open', 'worklist_rank', 'due_date', 'id'], name='task_open_worklist_idx'),
+            models.Index(fields=['status', 'worklist_rank', 'due_date', 'id'], name='task_status_worklist_idx'),
+            models.Index(fields=['worklist_rank', 'due_date', 'id'], name='task_rank_idx'),
+            # Range scans by the overdue sweeper
+            models.Index(fields=['status', 'due_date'], name='task_due_idx'),
+            models.Index(fields=['created_at'], name='task_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='task_sync_idx'),
+        ]
         
     def __str__(self):
         return f"{self.description[:50]} - {self.patient.name}"
+    
+    @classmethod
+    def open_work(cls, values):
+        """Patient counters an open task adds to"""
+        if values['status'] not in cls.OPEN_STATUSES:
+            return {}
+        return {'open_task_count': 1, 'urgent_task_count': int(values['priority'] == 'URGENT')}
+    
+    def escalation_state(self, now=None):
+        """Escalation this task should carry right now"""
+        if self.status not in self.OPEN_STATUSES or self.due_date is None:
+            return ''
+        now = now or timezone.now()
+        if self.due_date <= now:
+            return 'OVERDUE'
+        if self.due_date <= now + timedelta(hours=settings.TASK_DUE_SOON_HOURS):
+            return 'DUE_SOON'
+        return ''
+    
+    def refresh_escalation(self, now=None):
+        """Update the escalation flag after due date or status edits"""
+        escalation = self.escalation_state(now)
+        if escalation != self.escalation:
+            self.escalation = escalation
+            self.escalated_at = (now or timezone.now()) if escalation else None
+    
+    def save(self, *args, **kwargs):
+        # Edits can move a due date behind the sweeper's watermark, so
+        # evaluate the flag here rather than waiting for the next sweep
+        self.refresh_escalation()
+        self.worklist_rank = self.rank_for(self.priority, self.due_date)
+        self.is_open = self.status in self.OPEN_STATUSES
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'worklist_rank', 'is_open'}
+        super().save(*args, **kwargs)
+    
+    def worklist_cursor(self):
+        """Keyset position of this task in worklist order"""
+        due_date = self.due_date.isoformat() if self.due_date else None
+        return [self.worklist_rank, due_date, self.id]
+
+
+class JobCheckpoint(models.Model):
+    """High-water mark for an incremental background job"""
+    
+    name = models.CharField(max_length=50, unique=True)
+    watermark = models.DateTimeField(null=True, blank=True, help_text="Time up to which the job has processed")
+    last_id = models.BigIntegerField(default=0, help_text="Highest row id the job has processed")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class DuplicateBlockKey(models.Model):
+    """Blocking key for duplicate detection; only patients sharing a key are compared"""
+    
+    key = models.CharField(max_length=40)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['key'], name='duplicate_block_key_idx'),
+        ]
+    
+    def __str__(self):
+        return self.key
+
+
+class DuplicateCandidate(models.Model):
+    """Two patients that are probably the same person (see patients.duplicates)"""
+    
+    STATUS_CHOICES = [
+        ('OPEN', 'Open'),
+        ('DUPLICATE', 'Confirmed duplicate'),
+        ('NOT_DUPLICATE', 'Not a duplicate'),
+    ]
+    
+    # The pair is stored once, lower patient id first
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(help_text="0-1; higher is more likely the same person")
+    reasons = models.CharField(max_length=300)
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='OPEN')
+    detected_at = models.DateTimeField(default=timezone.now)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-score']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'other'], name='duplicate_pair_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', '-score'], name='duplicate_review_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient} / {self.other}"
+
+
+class Tombstone(models.Model):
+    """Record of a deleted row, so delta sync clients can drop it too"""
+    
+    KIND_CHOICES = [
+        ('patient', 'Patient'),
+        ('consult', 'Consult request'),
+        ('ward_round', 'Ward round'),
+        ('task', 'Task'),
+    ]
+    
+    kind = models.CharField(max_length=15, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_sync_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+class TakeFlowRollup(models.Model):
+    """Hourly take-flow timing totals per specialty and team.
+    
+    One row per metric, hour (in which the later step completed), specialty
+    and team, holding the count, sum and a mergeable percentile sketch of
+    the durations so reports never have to scan Patient rows.
+    """
+    
+    METRIC_CHOICES = [
+        ('REFERRAL_TO_CLERKING', 'Referral → Clerking'),
+        ('CLERKING_TO_PTWR', 'Clerking → PTWR'),
+        ('PTWR_TO_ADMISSION', 'PTWR → Admission Complete'),
+    ]
+    
+    # (start, end) Patient timestamps measured by each metric
+    METRIC_FIELDS = {
+        'REFERRAL_TO_CLERKING': ('referral_to_specialty_datetime', 'clerking_completed_at'),
+        'CLERKING_TO_PTWR': ('clerking_completed_at', 'ptwr_completed_at'),
+        'PTWR_TO_ADMISSION': ('ptwr_completed_at', 'admission_completed_at'),
+    }
+    
+    metric = models.CharField(max_length=25, choices=METRIC_CHOICES)
+    hour = models.DateTimeField(help_text="Start of the hour (UTC) the transition completed in")
+    specialty = models.CharField(max_length=20, choices=Patient.SPECIALTY_CHOICES)
+    team = models.CharField(max_length=10, choices=Patient.TEAM_CHOICES, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    sketch = models.JSONField(default=dict, help_text="Serialised QuantileSketch of durations in seconds")
+    
+    class Meta:
+        ordering = ['hour']
+        constraints = [
+            # Also serves report range scans on (metric, hour)
+            models.UniqueConstraint(
+                fields=['metric', 'hour', 'specialty', 'team'], name='take_flow_rollup_unique'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.metric} {self.hour:%Y-%m-%d %H:00} {self.specialty}/{self.team or '-'}"
+
+
+class TakeFlowTransition(models.Model):
+    """One timed take-flow step, recorded when its later step completes.
+    
+    Keeps the patient's specialty and team at that moment, so rollups
+    rebuilt from these rows bucket every transition as it was counted live,
+    however the patient has moved since.
+    """
+    
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='take_flow_transitions')
+    metric = models.CharField(max_length=25, choices=TakeFlowRollup.METRIC_CHOICES)
+    completed_at = models.DateTimeField(help_text="When the later of the two steps completed")
+    seconds = models.FloatField(help_text="Duration counted; 0 when the steps were recorded out of order")
+    specialty = models.CharField(max_length=20, choices=Patient.SPECIALTY_CHOICES)
+    team = models.CharField(max_length=10, choices=Patient.TEAM_CHOICES, blank=True)
+    
+    class Meta:
+        ordering = ['completed_at']
+        indexes = [
+            models.Index(fields=['completed_at'], name='take_flow_transition_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.metric} {self.completed_at:%Y-%m-%d %H:%M} {self.specialty}/{self.team or '-'}"
@@ -0,0 +1,66 @@
+import base64
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(values):
+    """Encode a keyset position (a list of JSON-serialisable values) as an opaque token"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, length=None):
+    """Decode a token produced by encode_cursor, checking it has the expected length"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor('Malformed cursor') from exc
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        raise InvalidCursor('Malformed cursor')
+    return values
+
+
+def keyset_page(queryset, page_size, cursor_for):
+    """Fetch one page plus a look-ahead row; return (rows, next_cursor or None)"""
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(cursor_for(rows[-1]))
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses the planner's row estimate for unfiltered tables.
+
+    On PostgreSQL an exact COUNT(*) scans the whole table; for an unfiltered
+    queryset over a large table the pg_class estimate is close enough for
+    page links. Filtered querysets and other databases count exactly.
+    """
+
+    # Below this many (estimated) rows an exact count is cheap
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                        [queryset.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= self.estimate_threshold:
+                    return int(row[0])
+        return super().count
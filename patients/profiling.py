@@ -0,0 +1,154 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+
+# Rows kept in each saved summary
+TOP_FUNCTIONS = 30
+SLOW_QUERIES = 20
+
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+
+
+class QueryRecorder:
+    """Database execute wrapper that times each statement.
+
+    Only the SQL text is kept, never the parameters, so saved profiles hold
+    no patient data.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'ms': (time.perf_counter() - started) * 1000})
+
+
+def profile_request(request, get_response):
+    """Run ``get_response`` under cProfile with SQL timing; return (response, profile id)"""
+    profiler = cProfile.Profile()
+    recorder = QueryRecorder()
+    started = time.perf_counter()
+    with connection.execute_wrapper(recorder):
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    summary = {
+        'path': request.get_full_path(),
+        'method': request.method,
+        'user': request.user.get_username(),
+        'status': response.status_code,
+        'captured_at': timezone.now().isoformat(),
+        'duration_ms': round(duration_ms, 1),
+        'query_count': len(recorder.queries),
+        'query_ms': round(sum(query['ms'] for query in recorder.queries), 1),
+        'functions': _top_functions(profiler),
+        'slow_queries': [
+            dict(query, ms=round(query['ms'], 2))
+            for query in sorted(recorder.queries, key=lambda query: query['ms'], reverse=True)[:SLOW_QUERIES]
+        ],
+    }
+    return response, save_profile(profiler, summary)
+
+
+def _top_functions(profiler):
+    """The functions with the most cumulative time, as summary rows"""
+    rows = []
+    for (filename, line, name), (_, calls, internal, cumulative, _) in pstats.Stats(profiler).stats.items():
+        rows.append({
+            'function': f'{name} ({_short_path(filename)}:{line})',
+            'calls': calls,
+            'internal_ms': round(internal * 1000, 2),
+            'cumulative_ms': round(cumulative * 1000, 2),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _short_path(filename):
+    """Source path relative to the project or site-packages directory"""
+    _, found, tail = filename.rpartition('site-packages' + os.sep)
+    if found:
+        return tail
+    base = str(settings.BASE_DIR) + os.sep
+    return filename[len(base):] if filename.startswith(base) else filename
+
+
+def save_profile(profiler, summary):
+    """Write the raw stats and summary to PROFILE_DIR, dropping the oldest
+    beyond PROFILE_KEEP. Returns the new profile's id."""
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    # Timestamped ids sort oldest first
+    profile_id = f"{timezone.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    summary = dict(summary, id=profile_id)
+
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    # Write then rename, so readers never see a half-written summary
+    temporary = os.path.join(directory, f'.{profile_id}.json')
+    with open(temporary, 'w') as f:
+        json.dump(summary, f)
+    os.replace(temporary, os.path.join(directory, f'{profile_id}.json'))
+
+    profile_ids = _profile_ids()
+    for stale in profile_ids[:max(0, len(profile_ids) - settings.PROFILE_KEEP)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f'{stale}.{extension}'))
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+    return profile_id
+
+
+def _profile_ids():
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.json') and PROFILE_ID_RE.match(name[:-5]))
+
+
+def list_profiles():
+    """Saved profile summaries, newest first"""
+    profiles = []
+    for profile_id in reversed(_profile_ids()):
+        summary = load_profile(profile_id)
+        if summary is not None:
+            profiles.append(summary)
+    return profiles
+
+
+def load_profile(profile_id):
+    """A saved profile's summary, or None if the id is unknown or pruned"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILE_DIR, f'{profile_id}.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def stats_path(profile_id):
+    """Path of a saved profile's raw cProfile stats (for pstats or snakeviz), or None"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, f'{profile_id}.prof')
+    return path if os.path.exists(path) else None
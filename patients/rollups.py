@@ -0,0 +1,180 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+
+from .models import Patient, TakeFlowRollup, TakeFlowTransition
+from .sketches import QuantileSketch
+
+
+def rollup_hour(value):
+    """Truncate a datetime to the start of its UTC hour"""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class _Bucket:
+    """In-memory accumulator for one rollup row"""
+
+    def __init__(self, count=0, total_seconds=0.0, max_seconds=0.0, sketch=None):
+        self.count = count
+        self.total_seconds = total_seconds
+        self.max_seconds = max_seconds
+        self.sketch = QuantileSketch.from_dict(sketch)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.sketch.add(seconds)
+
+
+def _apply(metric, hour, specialty, team, seconds):
+    with transaction.atomic():
+        rollup, _ = TakeFlowRollup.objects.select_for_update().get_or_create(
+            metric=metric, hour=hour, specialty=specialty, team=team,
+        )
+        bucket = _Bucket(rollup.count, rollup.total_seconds, rollup.max_seconds, rollup.sketch)
+        bucket.add(seconds)
+        rollup.count = bucket.count
+        rollup.total_seconds = bucket.total_seconds
+        rollup.max_seconds = bucket.max_seconds
+        rollup.sketch = bucket.sketch.to_dict()
+        rollup.save()
+
+
+def transitions_for(patient, completed_field=None):
+    """Unsaved TakeFlowTransitions for the steps that ``completed_field`` (a
+    Patient timestamp just set) completes; every completed step when None.
+
+    Steps can be recorded out of order (a PTWR before clerking is marked
+    complete), so each is timed by whichever of its timestamps is set last.
+    """
+    transitions = []
+    for metric, (start_field, end_field) in TakeFlowRollup.METRIC_FIELDS.items():
+        start, end = getattr(patient, start_field), getattr(patient, end_field)
+        if completed_field not in (None, start_field, end_field) or start is None or end is None:
+            continue
+        transitions.append(TakeFlowTransition(
+            patient=patient,
+            metric=metric,
+            completed_at=max(start, end),
+            seconds=max(0.0, (end - start).total_seconds()),
+            specialty=patient.current_parent_specialty,
+            team=patient.current_responsible_team or '',
+        ))
+    return transitions
+
+
+def record_transitions(patient, completed_field):
+    """Save the steps ``completed_field`` completes and add each to its
+    hourly rollup once the surrounding transaction commits.
+
+    A failed rollup update is logged rather than failing the request; the
+    ``rebuild_take_flow_rollups`` command recomputes any hours that drift.
+    """
+    for transition in transitions_for(patient, completed_field):
+        transition.save()
+        args = (
+            transition.metric, rollup_hour(transition.completed_at), transition.specialty, transition.team,
+            transition.seconds,
+        )
+        transaction.on_commit(lambda args=args: _apply(*args), robust=True)
+
+
+def rebuild_rollups(since=None, chunk_size=2000):
+    """Recompute rollups from the recorded transitions for every hour from
+    ``since`` (all history when None). Returns the number of rollup rows written.
+    """
+    if since is not None:
+        since = rollup_hour(since)
+
+    transitions = TakeFlowTransition.objects.all()
+    if since is not None:
+        transitions = transitions.filter(completed_at__gte=since)
+    rows = transitions.order_by().values_list('metric', 'completed_at', 'specialty', 'team', 'seconds')
+    buckets = {}
+    for metric, completed_at, specialty, team, seconds in rows.iterator(chunk_size=chunk_size):
+        key = (metric, rollup_hour(completed_at), specialty, team)
+        if key not in buckets:
+            buckets[key] = _Bucket()
+        buckets[key].add(seconds)
+
+    rollups = [
+        TakeFlowRollup(
+            metric=metric,
+            hour=hour,
+            specialty=specialty,
+            team=team,
+            count=bucket.count,
+            total_seconds=bucket.total_seconds,
+            max_seconds=bucket.max_seconds,
+            sketch=bucket.sketch.to_dict(),
+        )
+        for (metric, hour, specialty, team), bucket in buckets.items()
+    ]
+
+    with transaction.atomic():
+        stale = TakeFlowRollup.objects.all()
+        if since is not None:
+            stale = stale.filter(hour__gte=since)
+        stale.delete()
+        TakeFlowRollup.objects.bulk_create(rollups, batch_size=500)
+
+    return len(rollups)
+
+
+def summarize_rollups(since, specialty=None, team=None):
+    """Merge hourly rollups from ``since`` into per-metric summaries.
+
+    Returns one dict per metric with overall stats and a per-specialty
+    breakdown; durations are timedeltas (None when there is no data).
+    """
+    rollups = TakeFlowRollup.objects.filter(hour__gte=rollup_hour(since))
+    if specialty:
+        rollups = rollups.filter(specialty=specialty)
+    if team:
+        rollups = rollups.filter(team=team)
+
+    overall = {}
+    by_specialty = {}
+    rows = rollups.order_by().values_list(
+        'metric', 'specialty', 'count', 'total_seconds', 'max_seconds', 'sketch',
+    )
+    for metric, row_specialty, count, total_seconds, max_seconds, sketch in rows.iterator():
+        for buckets, key in ((overall, metric), (by_specialty, (metric, row_specialty))):
+            if key not in buckets:
+                buckets[key] = _Bucket()
+            bucket = buckets[key]
+            bucket.count += count
+            bucket.total_seconds += total_seconds
+            bucket.max_seconds = max(bucket.max_seconds, max_seconds)
+            bucket.sketch.merge(QuantileSketch.from_dict(sketch))
+
+    specialty_names = dict(Patient.SPECIALTY_CHOICES)
+    return [
+        {
+            'metric': metric,
+            'metric_display': name,
+            'overall': _stats(overall.get(metric)),
+            'by_specialty': [
+                dict(_stats(bucket), specialty=specialty_names.get(key[1], key[1]))
+                for key, bucket in sorted(by_specialty.items())
+                if key[0] == metric
+            ],
+        }
+        for metric, name in TakeFlowRollup.METRIC_CHOICES
+    ]
+
+
+def _stats(bucket):
+    def duration(seconds):
+        return None if seconds is None else timedelta(seconds=seconds)
+
+    if bucket is None or not bucket.count:
+        return {'count': 0, 'mean': None, 'p50': None, 'p90': None, 'max': None}
+    return {
+        'count': bucket.count,
+        'mean': duration(bucket.total_seconds / bucket.count),
+        'p50': duration(bucket.sketch.quantile(0.5)),
+        'p90': duration(bucket.sketch.quantile(0.9)),
+        'max': duration(bucket.max_seconds),
+    }
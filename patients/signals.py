@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+
+from .clinicians import invalidate_clinician_cache
+from .duplicates import refresh_block_keys
+from .models import (
+    Clinician, ConsultRequest, Patient, Task, Tombstone, WardRound, adjust_open_work_counts, open_work_changes,
+)
+
+
+# Models mirrored by the delta sync API, with the tombstone kind for each
+SYNCED_MODELS = {
+    Patient: 'patient',
+    ConsultRequest: 'consult',
+    WardRound: 'ward_round',
+    Task: 'task',
+}
+
+# Sent by the bed feed consumer and the patient import once their
+# location/bed moves are committed, with ``changes``: a list of
+# bedfeed.LocationChange (one per patient moved).
+# Queryset updates don't send post_save, so caches keyed on patient location
+# should listen here.
+patient_locations_changed = Signal()
+
+
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=SYNCED_MODELS[sender], object_id=instance.pk)
+
+
+def refresh_duplicate_keys(sender, instance, created, update_fields=None, **kwargs):
+    # New patients are indexed by the next detection run
+    if update_fields is not None and not set(update_fields) & set(Patient.BLOCK_KEY_FIELDS):
+        return
+    current = instance.block_key_values()
+    if not created and (current is None or current != getattr(instance, '_keyed', None)):
+        refresh_block_keys([instance.pk])
+    instance._keyed = current
+
+
+def uncount_open_work(sender, instance, origin=None, **kwargs):
+    # Nothing to keep in step when the patient itself is being deleted
+    if isinstance(origin, Patient) or getattr(origin, 'model', None) is Patient:
+        return
+    values = getattr(instance, '_counted', None) or instance.open_work_values()
+    adjust_open_work_counts(open_work_changes(instance.open_work_state(values), None))
+
+
+def connect_signals():
+    post_save.connect(invalidate_clinician_cache, sender=Clinician, dispatch_uid='clinician_cache_save')
+    post_delete.connect(invalidate_clinician_cache, sender=Clinician, dispatch_uid='clinician_cache_delete')
+    post_save.connect(refresh_duplicate_keys, sender=Patient, dispatch_uid='patient_duplicate_keys')
+    for model, kind in SYNCED_MODELS.items():
+        post_delete.connect(record_tombstone, sender=model, dispatch_uid=f'{kind}_tombstone')
+    for model in (ConsultRequest, Task):
+        post_delete.connect(uncount_open_work, sender=model, dispatch_uid=f'{model._meta.model_name}_open_work')
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; requests then only coalesce within a worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds between attempts to take another worker's render lock
+LOCK_POLL_INTERVAL = 0.01
+
+
+class Flight:
+    """One in-progress computation that later callers with the same key wait for"""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, compute, label):
+    """Return compute() (bytes), shared with concurrent callers for the same ``key``.
+
+    Within this process the first caller is the leader and the rest wait
+    for its result. The leader also takes a file lock for the key in
+    SINGLE_FLIGHT_DIR, so leaders in other workers queue behind one
+    render and reuse its result when it finished after they arrived.
+    Nothing is reused once a render is complete, so responses are never
+    staler than the render a caller joined. Waits are bounded by
+    SINGLE_FLIGHT_WAIT, after which the caller renders by itself.
+
+    Returns (value, role), with role 'leader', 'follower' (same worker) or
+    'shared' (another worker's render), counted in
+    medlyst_single_flight_requests_total under ``label``.
+    """
+    arrived = time.time()
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+
+    if not leader:
+        if flight.done.wait(settings.SINGLE_FLIGHT_WAIT):
+            registry.inc('medlyst_single_flight_requests_total', {'view': label, 'role': 'follower'})
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, 'follower'
+        value, role = compute(), 'leader'
+    else:
+        try:
+            value, role = _lead(key, compute, arrived)
+        except Exception as exc:
+            flight.error = exc
+            raise
+        else:
+            flight.value = value
+        finally:
+            with _flights_lock:
+                del _flights[key]
+            flight.done.set()
+
+    registry.inc('medlyst_single_flight_requests_total', {'view': label, 'role': role})
+    return value, role
+
+
+def _lead(key, compute, arrived):
+    """Compute under the key's cross-worker lock, or reuse a render that finished after ``arrived``"""
+    if fcntl is None:
+        return compute(), 'leader'
+
+    path = os.path.join(settings.SINGLE_FLIGHT_DIR, hashlib.sha1(key.encode()).hexdigest())
+    try:
+        os.makedirs(settings.SINGLE_FLIGHT_DIR, exist_ok=True)
+        lock_file = open(f'{path}.lock', 'a')
+    except OSError as exc:
+        logger.warning('Could not open single-flight lock %s: %s', path, exc)
+        return compute(), 'leader'
+
+    with lock_file:
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    # The other worker is stuck; don't wait on it any longer
+                    return compute(), 'leader'
+                time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            shared = _read_result(path, arrived)
+            if shared is not None:
+                return shared, 'shared'
+            value = compute()
+            _write_result(path, value)
+            return value, 'leader'
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_result(path, arrived):
+    """The stored result if its render finished at or after ``arrived``"""
+    try:
+        with open(path, 'rb') as f:
+            finished = float(f.readline())
+            if finished < arrived:
+                return None
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _write_result(path, value):
+    try:
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(b'%f\n' % time.time())
+            f.write(value)
+        os.replace(f'{path}.tmp', path)
+    except OSError as exc:
+        # Only the sharing is lost; this request still has its result
+        logger.warning('Could not write single-flight result %s: %s', path, exc)
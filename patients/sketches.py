@@ -0,0 +1,75 @@
+import math
+
+
+class QuantileSketch:
+    """Mergeable log-bucketed histogram for approximate percentiles.
+
+    Values are counted in buckets whose bounds grow geometrically, so any
+    quantile estimate is within ``relative_accuracy`` of a true sample value.
+    Sketches with the same accuracy merge by adding bucket counts, which lets
+    hourly rollups be combined into any reporting window without rereading
+    the source rows. Values <= 0 are counted separately as zero.
+    """
+
+    relative_accuracy = 0.02
+
+    def __init__(self, buckets=None, zero_count=0):
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = dict(buckets or {})
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.buckets.values())
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """Count ``value`` (e.g. a duration in seconds)"""
+        if value <= 0:
+            self.zero_count += count
+            return
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other):
+        """Add another sketch's counts into this one"""
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        return self
+
+    def quantile(self, q):
+        """Approximate value at quantile ``q`` (0-1), or None when empty"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return self._value(index)
+        return self._value(max(self.buckets))
+
+    def to_dict(self):
+        """JSON-serialisable form (JSON object keys must be strings)"""
+        return {
+            'zero': self.zero_count,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            buckets={int(index): count for index, count in data.get('buckets', {}).items()},
+            zero_count=data.get('zero', 0),
+        )
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite backend for sites serving concurrent writers from one file.
+
+    Transactions start with BEGIN IMMEDIATE, taking the write lock up front.
+    A deferred transaction that reads and then writes can't wait for the
+    lock when another writer holds it (waiting could deadlock), so SQLite
+    fails it at once with "database is locked" whatever the busy timeout.
+    Taking the lock at BEGIN means contended writers queue on busy_timeout
+    instead. The pragmas in SQLITE_PRAGMAS are applied to every new
+    connection by apply_pragmas.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """connection_created hook: WAL, busy timeout and cache pragmas for this backend's connections"""
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+connection_created.connect(apply_pragmas, sender=DatabaseWrapper, dispatch_uid='sqlite_concurrent_pragmas')
@@ -0,0 +1,116 @@
+/* MedLyst front-end behaviour.
+ *
+ * Kept free of inline handlers so the templates stay cacheable and this file
+ * can be served with far-future cache headers from the hashed static build.
+ */
+(function () {
+    'use strict';
+
+    // Filter selects marked data-autosubmit submit their form on change.
+    // requestSubmit() fires the submit event so data-partial forms still
+    // update in place.
+    document.addEventListener('change', function (event) {
+        var target = event.target;
+        if (target.matches && target.matches('select[data-autosubmit]') && target.form) {
+            if (target.form.requestSubmit) {
+                target.form.requestSubmit();
+            } else {
+                target.form.submit();
+            }
+        }
+    });
+
+    // Replace each element on the page whose id matches a top-level element
+    // of the returned fragment.
+    function patchFragments(html) {
+        var template = document.createElement('template');
+        template.innerHTML = html.trim();
+        Array.prototype.slice.call(template.content.children).forEach(function (fragment) {
+            var current = fragment.id && document.getElementById(fragment.id);
+            if (current) {
+                current.replaceWith(fragment);
+            }
+        });
+    }
+
+    function showMessage(text) {
+        var container = document.querySelector('.messages');
+        if (!container) {
+            container = document.createElement('div');
+            container.className = 'messages';
+            var page = document.querySelector('.container');
+            page.insertBefore(container, page.firstChild);
+        }
+        container.innerHTML = '';
+        var message = document.createElement('div');
+        message.className = 'message success';
+        message.textContent = text;
+        container.appendChild(message);
+    }
+
+    // Forms marked data-partial post in the background and patch the
+    // returned fragments in place instead of reloading the page. Any failure
+    // (including a 409 version conflict) falls back to a normal submit, which
+    // shows the server's full-page response.
+    document.addEventListener('submit', function (event) {
+        var form = event.target;
+        if (!form.matches('form[data-partial]') || !window.fetch || event.defaultPrevented) {
+            return;
+        }
+        event.preventDefault();
+        fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: {'X-Partial': 'html'},
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error('Partial update failed: ' + response.status);
+            }
+            var message = response.headers.get('X-Message');
+            return response.text().then(function (html) {
+                patchFragments(html);
+                if (message) {
+                    showMessage(decodeURIComponent(message));
+                }
+            });
+        }).catch(function () {
+            form.submit();
+        });
+    });
+
+    // Links marked data-replace="<id>" fetch their page as a fragment and put
+    // it in place of that element (the next ward rounds, a full note). If the
+    // fetch fails the link is followed as a normal page.
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest ? event.target.closest('a[data-replace]') : null;
+        var target = link && document.getElementById(link.getAttribute('data-replace'));
+        if (!target || !window.fetch) {
+            return;
+        }
+        event.preventDefault();
+        fetch(link.href, {
+            headers: {'X-Partial': 'html'},
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error('Fragment request failed: ' + response.status);
+            }
+            return response.text();
+        }).then(function (html) {
+            var template = document.createElement('template');
+            template.innerHTML = html.trim();
+            target.replaceWith(template.content);
+        }).catch(function () {
+            window.location.href = link.href;
+        });
+    });
+
+    // Buttons marked data-confirm ask before submitting.
+    document.addEventListener('click', function (event) {
+        var target = event.target.closest ? event.target.closest('[data-confirm]') : null;
+        if (target && !window.confirm(target.getAttribute('data-confirm'))) {
+            event.preventDefault();
+        }
+    });
+})();
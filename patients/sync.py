@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ConsultRequest, Patient, Task, Tombstone, WardRound
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+# Each stream: response key -> (queryset, change column, fields, renamed
+# fields). Rows are read as values() dicts in (change column, id) order,
+# straight off the matching index.
+STREAMS = {
+    'patients': (
+        Patient.objects.all(),
+        'updated_at',
+        [
+            'id', 'name', 'nhi_number', 'patient_category', 'location', 'bed_number',
+            'clerking_status', 'priority_flag', 'weekend_review', 'version', 'updated_at',
+        ],
+        {
+            'specialty': F('current_parent_specialty'),
+            'team': F('current_responsible_team'),
+            'ptwr_status': F('post_take_ward_round_status'),
+        },
+    ),
+    'consults': (
+        ConsultRequest.objects.all(),
+        'updated_at',
+        ['id', 'patient_id', 'specialty', 'status', 'reason', 'requested_at', 'reviewed_at', 'updated_at'],
+        {'requested_by_name': F('requested_by__name'), 'reviewed_by_name': F('reviewed_by__name')},
+    ),
+    'ward_rounds': (
+        WardRound.objects.all(),
+        'updated_at',
+        ['id', 'patient_id', 'ward_round_type', 'notes', 'timestamp', 'updated_at'],
+        {'doctor_name': F('doctor__name')},
+    ),
+    'tasks': (
+        Task.objects.all(),
+        'updated_at',
+        ['id', 'patient_id', 'description', 'priority', 'status', 'due_date', 'escalation', 'updated_at'],
+        {'assigned_to_name': F('assigned_to__name')},
+    ),
+    'deleted': (
+        Tombstone.objects.all(),
+        'deleted_at',
+        ['id', 'kind', 'object_id', 'deleted_at'],
+        {},
+    ),
+}
+
+
+class CursorExpired(Exception):
+    """Raised when a cursor predates retained tombstones; the client must resync"""
+
+
+def _decode(token):
+    """Decode a sync cursor into (issued_at, {stream: (changed_at, id) or None})"""
+    values = decode_cursor(token, length=1 + len(STREAMS))
+    issued_at = parse_datetime(values[0]) if isinstance(values[0], str) else None
+    if issued_at is None:
+        raise InvalidCursor('Malformed cursor')
+    positions = {}
+    for name, position in zip(STREAMS, values[1:]):
+        if position is None:
+            positions[name] = None
+            continue
+        if not isinstance(position, list) or len(position) != 2:
+            raise InvalidCursor('Malformed cursor')
+        changed_at = parse_datetime(position[0]) if isinstance(position[0], str) else None
+        if changed_at is None or not isinstance(position[1], int):
+            raise InvalidCursor('Malformed cursor')
+        positions[name] = (changed_at, position[1])
+    return issued_at, positions
+
+
+def changes_since(token=None, limit=500, now=None):
+    """Rows created, updated or deleted after ``token`` (None for a full sync).
+
+    Returns (changes, next_token, has_more); ``changes`` maps each stream to a
+    list of at most ``limit`` row dicts. Rows changed in the last
+    SYNC_SETTLE_SECONDS are held back until the next call, so a transaction
+    that stamps updated_at but commits a moment later is not skipped over.
+    """
+    now = now or timezone.now()
+    positions = dict.fromkeys(STREAMS)
+    if token:
+        issued_at, positions = _decode(token)
+        retention = timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        if issued_at < now - retention:
+            raise CursorExpired('Cursor is older than the tombstone retention period')
+    settled = now - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+    changes = {}
+    has_more = False
+    next_positions = []
+    for name, (queryset, column, fields, renamed) in STREAMS.items():
+        rows = queryset.filter(**{f'{column}__lte': settled})
+        position = positions[name]
+        if position is not None:
+            changed_at, last_id = position
+            rows = rows.filter(
+                Q(**{f'{column}__gt': changed_at}) | Q(**{column: changed_at, 'id__gt': last_id})
+            )
+        rows = list(rows.order_by(column, 'id').values(*fields, **renamed)[:limit + 1])
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        changes[name] = rows
+        if rows:
+            last = rows[-1]
+            position = [last[column].isoformat(), last['id']]
+        elif position is not None:
+            position = [position[0].isoformat(), position[1]]
+        next_positions.append(position)
+
+    return changes, encode_cursor([now.isoformat()] + next_positions), has_more
@@ -0,0 +1,18 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def hours_minutes(duration):
+    """Format a timedelta as e.g. '2d 3h', '3h 05m' or '12m'"""
+    if duration is None:
+        return '-'
+    minutes = max(int(duration.total_seconds() // 60), 0)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f'{days}d {hours}h'
+    if hours:
+        return f'{hours}h {minutes:02d}m'
+    return f'{minutes}m'
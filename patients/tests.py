@@ -1,3 +1,1703 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import secrets
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.cookies import SimpleCookie
+from io import StringIO
+from unittest import addModuleCleanup, mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage import default_storage
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import (
+    LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, views
+from .clinicians import clinician_choices, invalidate_clinician_cache
+from .duplicates import PATIENT_FIELDS, block_keys, soundex
+from .escalation import sweep_overdue_tasks
+from .metrics import collect, registry
+from .middleware import CompressionMiddleware, EndpointLimiter, brotli
+from .models import (
+    Clinician, ConsultRequest, DuplicateBlockKey, DuplicateCandidate, Patient, TakeFlowRollup, Task, VersionConflict,
+    WardRound,
+)
+from .pagination import encode_cursor
+from .profiling import list_profiles
+from .rollups import rebuild_rollups, summarize_rollups
+from .signals import patient_locations_changed
+from .singleflight import single_flight
+from .sketches import QuantileSketch
+from .sync import STREAMS, changes_since
+
+
+# Admin templates use {% static %}; avoid needing a collectstatic manifest
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def setUpModule():
+    # Every request flushes metrics and kiosk renders share files; keep them
+    # out of the project directory (classes testing them use their own)
+    scratch = tempfile.TemporaryDirectory()
+    addModuleCleanup(scratch.cleanup)
+    scratch_dirs = override_settings(
+        METRICS_DIR=os.path.join(scratch.name, 'metrics'),
+        SINGLE_FLIGHT_DIR=os.path.join(scratch.name, 'singleflight'),
+    )
+    scratch_dirs.enable()
+    addModuleCleanup(scratch_dirs.disable)
+    # Nor write this process's totals there at exit
+    addModuleCleanup(setattr, registry, 'pid', None)
+
+
+def create_patients(count, start=0):
+    """Create ``count`` patients, each with a consult, ward round and task"""
+    doctor = Clinician.from_name('Dr. Test')
+    now = timezone.now()
+    for i in range(start, start + count):
+        patient = Patient.objects.create(
+            name=f'Patient {i}',
+            nhi_number=f'ABC{i:04d}',
+            datetime_of_arrival=now - timedelta(hours=i),
+            presenting_complaint='Chest pain',
+            current_parent_specialty='MEDICINE',
+            current_responsible_team='MEDA',
+            referral_source='ED',
+            referral_time=now - timedelta(hours=i),
+        )
+        ConsultRequest.objects.create(
+            patient=patient, specialty='RENAL', reason='Review', requested_by=doctor,
+        )
+        WardRound.objects.create(
+            patient=patient, ward_round_type='GENERAL', doctor=doctor, notes='Stable', timestamp=now,
+        )
+        Task.objects.create(
+            patient=patient, description='Bloods', assigned_to=doctor, created_by=doctor,
+        )
+
+
+@skipUnless(brotli, 'brotli is not installed')
+class CompressionTests(SimpleTestCase):
+    """Pages are negotiated to brotli, gzip or identity; only large, non-streaming ones are compressed"""
+
+    PAGE = '<html><body>' + ''.join(f'<p>Patient {i}</p>' for i in range(100)) + '</body></html>'
+
+    def compress(self, response, accept_encoding=None):
+        headers = {'HTTP_ACCEPT_ENCODING': accept_encoding} if accept_encoding is not None else {}
+        request = RequestFactory().get('/', **headers)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_encoding_is_negotiated(self):
+        for accept_encoding, encoding in [
+            ('gzip, deflate, br', 'br'), ('br;q=1.0, gzip;q=0.8', 'br'), ('gzip', 'gzip'), ('', None), (None, None),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.compress(HttpResponse(self.PAGE), accept_encoding)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                if encoding:
+                    self.assertIn('Accept-Encoding', response['Vary'])
+                    self.assertEqual(response['Content-Length'], str(len(response.content)))
+                    self.assertLess(len(response.content), len(self.PAGE))
+                if encoding == 'br':
+                    self.assertTrue(brotli.decompress(response.content).decode().startswith(self.PAGE))
+                elif encoding == 'gzip':
+                    self.assertEqual(gzip.decompress(response.content).decode(), self.PAGE)
+                else:
+                    self.assertEqual(response.content.decode(), self.PAGE)
+
+    def test_brotli_lengths_are_padded(self):
+        lengths = {len(self.compress(HttpResponse(self.PAGE), 'br').content) for _ in range(20)}
+        self.assertGreater(len(lengths), 1)
+
+    def test_json_streaming_and_small_responses(self):
+        response = self.compress(JsonResponse({'rows': list(range(200))}), 'br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        response = self.compress(StreamingHttpResponse(iter([self.PAGE] * 3)), 'br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), self.PAGE * 3)
+
+        response = self.compress(HttpResponse('<p>Short</p>'), 'br, gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, b'<p>Short</p>')
+
+    def test_responses_setting_the_csrf_cookie_are_not_compressed(self):
+        response = HttpResponse(self.PAGE)
+        response.set_cookie(settings.CSRF_COOKIE_NAME, 'token')
+        for accept_encoding in ['br', 'gzip']:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertFalse(self.compress(response, accept_encoding).has_header('Content-Encoding'))
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class TaskWorklistTests(TestCase):
+    """Worklist pages follow (worklist_rank, due_date, id) along an index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(1)
+        patient = Patient.objects.get()
+        doctor = Clinician.objects.get()
+        now = timezone.now()
+        priorities = [code for code, _ in Task.PRIORITY_CHOICES]
+        statuses = [code for code, _ in Task.STATUS_CHOICES]
+        # Repeated due dates and undated tasks exercise every tie-break
+        for i in range(130):
+            Task.objects.create(
+                patient=patient, description=f'Task {i}', created_by=doctor,
+                priority=priorities[i % 4], status=statuses[i % 3],
+                due_date=None if i % 5 == 0 else now + timedelta(hours=i % 7),
+            )
+
+    def expected(self, tasks):
+        rank = Task.PRIORITY_RANK
+        return [
+            task.id for task in sorted(
+                tasks, key=lambda t: (rank[t.priority], t.due_date is None, t.due_date and t.due_date.timestamp(), t.id),
+            )
+        ]
+
+    def walk(self, **params):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(reverse('task_worklist_api'), dict(params, cursor=cursor) if cursor else params)
+            data = response.json()
+            seen.extend(row['id'] for row in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_task_once_in_order(self):
+        self.assertEqual(self.walk(status='ALL'), self.expected(Task.objects.all()))
+        self.assertEqual(self.walk(), self.expected(Task.objects.filter(status__in=Task.OPEN_STATUSES)))
+        self.assertEqual(self.walk(status='COMPLETED'), self.expected(Task.objects.filter(status='COMPLETED')))
+
+        # Edits move a task to its new place
+        task = Task.objects.filter(priority='LOW', due_date__isnull=True).first()
+        task.priority = 'URGENT'
+        task.due_date = timezone.now() - timedelta(days=1)
+        task.save()
+        self.assertEqual(self.walk(status='ALL')[0], task.id)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_pages_are_read_in_index_order(self):
+        for status in ['', 'ALL', 'PENDING']:
+            with self.subTest(status=status):
+                # Past the undated URGENT tasks
+                cursor = encode_cursor([1, None, 0])
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('task_worklist_api'), {'status': status, 'cursor': cursor})
+                (sql,) = [q['sql'] for q in queries if 'FROM "patients_task"' in q['sql']]
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+                self.assertIn('USING INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_tampered_cursors_are_rejected(self):
+        for values in [[0, 'notadate', 1], ['x', 'x', 'x'], [0, None, 'a'], [1, '2026-01-01T00:00:00', 1], [True, None, 1]]:
+            with self.subTest(cursor=values):
+                cursor = encode_cursor(values)
+                response = self.client.get(reverse('task_worklist_api'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                response = self.client.get(reverse('task_worklist'), {'cursor': cursor})
+                self.assertRedirects(response, reverse('task_worklist'), fetch_redirect_response=False)
+
+
+class ClinicianTests(TestCase):
+    """Typed doctor names resolve to one Clinician, and the dropdown cache follows changes"""
+
+    def test_spellings_collapse_to_one_clinician(self):
+        smith = Clinician.from_name('Dr. Jane Smith')
+        for spelling in ['dr jane smith', '  DR.  Jane   SMITH ', 'Dr.Jane Smith', 'dr. jane smith.']:
+            with self.subTest(spelling=spelling):
+                self.assertEqual(Clinician.from_name(spelling), smith)
+        self.assertEqual(Clinician.objects.get().name, 'Dr. Jane Smith')
+        self.assertIsNone(Clinician.from_name('  '))
+        self.assertIsNone(Clinician.from_name(None))
+        self.assertNotEqual(Clinician.from_name('Dr. Jane Smyth'), smith)
+
+    def test_cache_is_invalidated_by_renames_and_deactivation(self):
+        invalidate_clinician_cache()
+        smith = Clinician.from_name('Dr. Smith')
+        Clinician.from_name('Dr. Jones')
+        self.assertEqual([name for _, name in clinician_choices()], ['Dr. Jones', 'Dr. Smith'])
+        with self.assertNumQueries(0):
+            clinician_choices()
+
+        smith.name = 'Dr. Smith-Hall'
+        smith.save()
+        self.assertEqual([name for _, name in clinician_choices()], ['Dr. Jones', 'Dr. Smith-Hall'])
+        self.assertEqual(smith.normalized_name, 'dr smith-hall')
+
+        smith.active = False
+        smith.save()
+        self.assertEqual([name for _, name in clinician_choices()], ['Dr. Jones'])
+        Clinician.objects.get(name='Dr. Jones').delete()
+        self.assertEqual(clinician_choices(), ())
+
+
+class ClinicianBackfillMigrationTests(TransactionTestCase):
+    """0008 maps the free-text doctor fields onto Clinician rows"""
+
+    before = [('patients', '0007_clinician')]
+    after = [('patients', '0008_backfill_clinicians')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes('patients')
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        return executor.loader.project_state(self.after).apps
+
+    def test_names_blanks_and_near_duplicates(self):
+        Patient = self.apps.get_model('patients', 'Patient')
+        ConsultRequest = self.apps.get_model('patients', 'ConsultRequest')
+        WardRound = self.apps.get_model('patients', 'WardRound')
+        Task = self.apps.get_model('patients', 'Task')
+        now = timezone.now()
+        patient = Patient.objects.create(
+            name='Patient 0', nhi_number='ABC0000', datetime_of_arrival=now, presenting_complaint='Fall',
+            current_parent_specialty='MEDICINE', current_responsible_team='MEDA', referral_source='ED',
+            referral_time=now, clerking_doctor_legacy='Dr. Jane Smith', ptwr_doctor_legacy='',
+        )
+        consult = ConsultRequest.objects.create(
+            patient=patient, specialty='RENAL', reason='AKI', requested_by_legacy='dr jane  smith',
+            reviewed_by_legacy='   ',
+        )
+        ward_round = WardRound.objects.create(
+            patient=patient, ward_round_type='GENERAL', doctor_legacy='DR. JANE SMITH', timestamp=now,
+        )
+        WardRound.objects.create(patient=patient, ward_round_type='GENERAL', doctor_legacy='Dr. Jane Smith', timestamp=now)
+        task = Task.objects.create(
+            patient=patient, description='Bloods', assigned_to_legacy='Dr Jane Smith', created_by_legacy='',
+        )
+
+        apps = self.migrate()
+        Clinician = apps.get_model('patients', 'Clinician')
+        patient = apps.get_model('patients', 'Patient').objects.get(pk=patient.pk)
+        consult = apps.get_model('patients', 'ConsultRequest').objects.get(pk=consult.pk)
+        ward_round = apps.get_model('patients', 'WardRound').objects.get(pk=ward_round.pk)
+        task = apps.get_model('patients', 'Task').objects.get(pk=task.pk)
+
+        # Four spellings of one doctor become one row under the most common spelling
+        smith = Clinician.objects.get(normalized_name='dr jane smith')
+        self.assertEqual(smith.name, 'Dr. Jane Smith')
+        self.assertEqual(
+            [patient.clerking_doctor_id, consult.requested_by_id, ward_round.doctor_id, task.assigned_to_id],
+            [smith.id] * 4,
+        )
+        # Blank optional fields stay empty; blank required ones point at "Unknown"
+        self.assertIsNone(patient.ptwr_doctor_id)
+        self.assertIsNone(consult.reviewed_by_id)
+        self.assertEqual(Clinician.objects.get(pk=task.created_by_id).name, 'Unknown')
+        self.assertEqual(Clinician.objects.count(), 2)
+
+
+@override_settings(TASK_DUE_SOON_HOURS=2)
+class TaskEscalationTests(TestCase):
+    """The sweeper flags tasks as their due dates pass, scanning only since its watermark"""
+
+    def setUp(self):
+        create_patients(1)
+        Task.objects.all().delete()
+        self.start = timezone.now()
+        patient, doctor = Patient.objects.get(), Clinician.objects.get()
+        self.tasks = {
+            hours: Task.objects.create(
+                patient=patient, description=f'Due in {hours}h', created_by=doctor,
+                due_date=self.start + timedelta(hours=hours),
+            )
+            for hours in [1, 5, 30]
+        }
+        Task.objects.create(
+            patient=patient, description='Done', created_by=doctor, status='COMPLETED',
+            due_date=self.start + timedelta(hours=5),
+        )
+
+    def sweep(self, hours):
+        return sweep_overdue_tasks(self.start + timedelta(hours=hours))
+
+    def escalation(self, hours):
+        return Task.objects.get(pk=self.tasks[hours].pk).escalation
+
+    def test_tasks_are_flagged_once_as_time_passes(self):
+        # Saving already flagged the task due within the window
+        self.assertEqual(self.escalation(1), 'DUE_SOON')
+        self.assertEqual(self.sweep(0), (0, 0))
+
+        self.assertEqual(self.sweep(4), (1, 1))
+        self.assertEqual(self.escalation(1), 'OVERDUE')
+        self.assertEqual(self.escalation(5), 'DUE_SOON')
+        self.assertEqual(Task.objects.get(status='COMPLETED').escalation, '')
+
+        self.assertEqual(self.sweep(6), (1, 0))
+        self.assertEqual(self.sweep(6), (0, 0))
+        self.assertEqual(self.sweep(29), (0, 1))
+        self.assertEqual(self.escalation(30), 'DUE_SOON')
+        self.assertEqual(self.sweep(31), (1, 0))
+        self.assertEqual(self.escalation(30), 'OVERDUE')
+
+    def test_sweeps_only_scan_past_the_watermark(self):
+        self.sweep(6)
+        # A due date already behind the watermark isn't looked at again...
+        Task.objects.filter(pk=self.tasks[1].pk).update(escalation='')
+        self.assertEqual(self.sweep(7), (0, 0))
+        self.assertEqual(self.escalation(1), '')
+
+        # ...so edits are flagged when saved instead
+        task = Task.objects.get(pk=self.tasks[30].pk)
+        task.due_date = self.start - timedelta(hours=1)
+        task.save()
+        self.assertEqual(self.escalation(30), 'OVERDUE')
+
+        stamped = Task.objects.get(pk=self.tasks[5].pk).updated_at
+        self.assertEqual(stamped, self.start + timedelta(hours=6))
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, CONSULT_ACCEPT_SLA_HOURS=4, CONSULT_COMPLETE_SLA_HOURS=24)
+class ConsultTimerTests(TestCase):
+    """SLA timers stop at the first acceptance and at completion, not at the latest review"""
+
+    def setUp(self):
+        create_patients(1)
+        self.consult = ConsultRequest.objects.get()
+        self.url = reverse('update_consult_status', args=[self.consult.id])
+
+    def hours_pass(self, hours):
+        """Move the consult's history ``hours`` into the past"""
+        earlier = {
+            field: F(field) - timedelta(hours=hours)
+            for field in ['requested_at', 'accepted_at', 'completed_at']
+        }
+        ConsultRequest.objects.filter(pk=self.consult.pk).update(**earlier)
+
+    def move_to(self, status):
+        self.client.post(self.url, {'status': status})
+
+    def assertTimer(self, name, hours, breached):
+        consult = ConsultRequest.objects.with_timers().get()
+        self.assertAlmostEqual(getattr(consult, name).total_seconds(), hours * 3600, delta=60)
+        self.assertEqual(getattr(consult, name.replace('time_to_', '') + '_breached'), breached)
+
+    def test_timers_across_status_transitions(self):
+        self.hours_pass(2)
+        self.assertTimer('time_to_accept', 2, False)
+        self.move_to('ACCEPTED')
+        self.hours_pass(10)
+        self.assertTimer('time_to_accept', 2, False)
+        self.assertTimer('time_to_complete', 12, False)
+
+        # Later moves don't restart the accept timer
+        self.move_to('IN_PROGRESS')
+        self.move_to('ACCEPTED')
+        self.hours_pass(14)
+        self.assertTimer('time_to_accept', 2, False)
+        self.assertTimer('time_to_complete', 26, True)
+
+        self.move_to('COMPLETED')
+        self.hours_pass(5)
+        self.assertTimer('time_to_accept', 2, False)
+        self.assertTimer('time_to_complete', 26, True)
+
+        # Re-posting the same status doesn't move the completion time
+        self.move_to('COMPLETED')
+        self.assertTimer('time_to_complete', 26, True)
+        self.assertAlmostEqual(
+            (timezone.now() - ConsultRequest.objects.get().reviewed_at).total_seconds(), 0, delta=60,
+        )
+
+    def test_late_acceptance_is_breached(self):
+        self.hours_pass(6)
+        self.move_to('IN_PROGRESS')
+        self.assertTimer('time_to_accept', 6, True)
+        self.move_to('COMPLETED')
+        self.assertTimer('time_to_accept', 6, True)
+        self.assertTimer('time_to_complete', 6, False)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class TakeFlowRollupTests(TestCase):
+    """Rollups kept as workflow steps commit match a rebuild from the recorded transitions"""
+
+    def rollups(self):
+        return sorted(
+            (r.metric, r.hour, r.specialty, r.team, r.count, round(r.total_seconds, 3), r.max_seconds, r.sketch)
+            for r in TakeFlowRollup.objects.all()
+        )
+
+    def post(self, name, patient, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse(name, args=[patient.id]), dict(data, doctor='Dr. Test'))
+
+    def test_sketch_quantiles_are_accurate_and_merge(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(8, 1) for _ in range(3000)]
+        whole = QuantileSketch()
+        parts = [QuantileSketch() for _ in range(3)]
+        for i, value in enumerate(values):
+            whole.add(value)
+            parts[i % 3].add(value)
+        merged = QuantileSketch.from_dict(parts[0].to_dict())
+        for part in parts[1:]:
+            merged.merge(QuantileSketch.from_dict(part.to_dict()))
+        self.assertEqual(merged.to_dict(), whole.to_dict())
+
+        values.sort()
+        for q in [0.1, 0.5, 0.9, 0.99]:
+            with self.subTest(q=q):
+                exact = values[int(q * (len(values) - 1))]
+                self.assertLessEqual(abs(merged.quantile(q) - exact) / exact, QuantileSketch.relative_accuracy)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+    def test_recorded_transitions_match_a_rebuild(self):
+        create_patients(3)
+        Patient.objects.update(
+            patient_category='ACUTE_INPROCESS', clerking_status='AWAITING', post_take_ward_round_status='AWAITING',
+            referral_to_specialty_datetime=timezone.now() - timedelta(hours=5),
+        )
+        first, second, third = Patient.objects.order_by('id')
+        for patient in (first, second, third):
+            self.post('clerking_workflow', patient, status='COMPLETED')
+        for patient in (first, second):
+            self.post('ptwr_workflow', patient, status='COMPLETED')
+        self.post('complete_admission', first)
+
+        # Reopening and re-completing doesn't count the patient again
+        self.post('clerking_workflow', third, status='IN_PROGRESS')
+        self.post('clerking_workflow', third, status='COMPLETED')
+        self.post('ptwr_workflow', second, status='IN_PROGRESS')
+        self.post('ptwr_workflow', second, status='COMPLETED')
+
+        recorded = self.rollups()
+        counts = dict.fromkeys(TakeFlowRollup.METRIC_FIELDS, 0)
+        for metric, *_, count, _, _, _ in recorded:
+            counts[metric] += count
+        self.assertEqual(counts, {'REFERRAL_TO_CLERKING': 3, 'CLERKING_TO_PTWR': 2, 'PTWR_TO_ADMISSION': 1})
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), recorded)
+
+        summary = {row['metric']: row['overall'] for row in summarize_rollups(timezone.now() - timedelta(days=1))}
+        self.assertEqual(summary['REFERRAL_TO_CLERKING']['count'], 3)
+        self.assertAlmostEqual(summary['REFERRAL_TO_CLERKING']['p50'].total_seconds(), 5 * 3600, delta=5 * 3600 * 0.03)
+
+    def test_moves_and_out_of_order_steps_match_a_rebuild(self):
+        create_patients(2)
+        Patient.objects.update(
+            patient_category='ACUTE_INPROCESS', clerking_status='AWAITING', post_take_ward_round_status='AWAITING',
+            referral_to_specialty_datetime=timezone.now() - timedelta(hours=5),
+        )
+        moved, late = Patient.objects.order_by('id')
+        # Counted under Medicine, where the patient was when clerked
+        self.post('clerking_workflow', moved, status='COMPLETED')
+        self.client.post(reverse('change_specialty', args=[moved.id]), {'specialty': 'SURGERY'})
+        # The PTWR is recorded before clerking is marked complete
+        self.post('ptwr_workflow', late, status='COMPLETED')
+        self.post('clerking_workflow', late, status='COMPLETED')
+
+        recorded = self.rollups()
+        counts = {}
+        for metric, _, specialty, _, count, *_ in recorded:
+            counts[metric, specialty] = counts.get((metric, specialty), 0) + count
+        self.assertEqual(counts, {('CLERKING_TO_PTWR', 'MEDICINE'): 1, ('REFERRAL_TO_CLERKING', 'MEDICINE'): 2})
+        self.assertEqual(Patient.objects.get(pk=moved.pk).current_parent_specialty, 'SURGERY')
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), recorded)
+
+
+@skipUnless(analytics.np is not None, 'numpy is not installed')
+class CohortAccumulatorTests(SimpleTestCase):
+    """Chunked binned statistics agree with plain numpy over all the rows"""
+
+    def setUp(self):
+        np = analytics.np
+        rng = np.random.default_rng(0)
+        self.size = 5000
+        self.now = timezone.now()
+        # Each step follows the last by 6 minutes to ~3 weeks; some never happened
+        step = lambda: rng.lognormal(1.5, 1.2, self.size).clip(0.1, 500) * 3600
+        arrival = self.now.timestamp() - rng.uniform(1, 1000, self.size) * 3600
+        self.timestamps = {'datetime_of_arrival': arrival}
+        previous = arrival
+        for field in analytics.TIMESTAMP_FIELDS[1:]:
+            previous = previous + step()
+            previous[rng.random(self.size) < 0.1] = np.nan
+            self.timestamps[field] = previous
+        self.groups = analytics.CohortAccumulator(now=self.now).groups
+        self.codes = {
+            dimension: rng.integers(0, len(groups), self.size) for dimension, groups in self.groups.items()
+        }
+
+    def expected(self, metric, mask):
+        np = analytics.np
+        start, end = analytics.METRICS[metric]
+        end_values = self.timestamps[end] if end else self.now.timestamp()
+        hours = (end_values - self.timestamps[start])[mask] / 3600
+        return np.sort(np.maximum(hours[~np.isnan(hours)], 0))
+
+    def assertStats(self, stats, hours):
+        self.assertEqual(stats['count'], len(hours))
+        self.assertAlmostEqual(stats['mean_hours'], hours.mean(), delta=0.01)
+        self.assertAlmostEqual(stats['max_hours'], hours.max(), delta=0.01)
+        for p in analytics.PERCENTILES:
+            exact = hours[math.ceil(len(hours) * p / 100) - 1]
+            self.assertLessEqual(abs(stats[f'p{p}_hours'] - exact), exact * 0.015 + 0.01)
+
+    def test_chunked_report_matches_numpy(self):
+        np = analytics.np
+        accumulator = analytics.CohortAccumulator(now=self.now)
+        for start, stop in [(0, 1), (1, 1700), (1700, 5000)]:
+            accumulator.add_chunk(
+                {field: values[start:stop] for field, values in self.timestamps.items()},
+                {dimension: codes[start:stop] for dimension, codes in self.codes.items()},
+            )
+        report = accumulator.report()
+        self.assertEqual(report['rows'], self.size)
+
+        everyone = np.ones(self.size, dtype=bool)
+        for metric, data in report['metrics'].items():
+            with self.subTest(metric=metric):
+                hours = self.expected(metric, everyone)
+                self.assertStats(data['overall'], hours)
+                bands = np.bincount(
+                    np.searchsorted(analytics.HISTOGRAM_BANDS, hours, side='right'),
+                    minlength=len(analytics.HISTOGRAM_BANDS) + 1,
+                )
+                self.assertEqual([band['count'] for band in data['histogram']], bands.tolist())
+
+                for dimension, rows in data['by'].items():
+                    self.assertEqual(sum(row['count'] for row in rows), len(hours))
+                    for row in rows:
+                        index = self.groups[dimension].index('' if row['group'] == '-' else row['group'])
+                        self.assertStats(row, self.expected(metric, self.codes[dimension] == index))
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class AdminChangelistQueryTests(TestCase):
+    """Changelist query counts must not grow with the number of rows shown"""
+
+    changelists = [
+        'admin:patients_patient_changelist',
+        'admin:patients_consultrequest_changelist',
+        'admin:patients_wardround_changelist',
+        'admin:patients_task_changelist',
+        'admin:patients_duplicatecandidate_changelist',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_scale_with_rows(self):
+        create_patients(2)
+        few = {name: self.count_queries(reverse(name)) for name in self.changelists}
+        create_patients(20, start=2)
+        for name in self.changelists:
+            with self.subTest(changelist=name):
+                self.assertEqual(self.count_queries(reverse(name)), few[name])
+
+    def test_filtered_changelist_skips_full_count(self):
+        create_patients(3)
+        url = reverse('admin:patients_consultrequest_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'status__exact': 'REQUESTED'})
+        counts = [q['sql'] for q in queries if 'COUNT(' in q['sql'].upper()]
+        self.assertEqual(len(counts), 1)
+
+    def test_nhi_search_uses_prefix_match(self):
+        create_patients(12)
+        url = reverse('admin:patients_task_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': 'abc001'})
+        self.assertEqual(
+            sorted(str(task.patient.nhi_number) for task in response.context['cl'].result_list),
+            ['ABC0010', 'ABC0011'],
+        )
+        search_sql = [q['sql'] for q in queries if 'ABC001' in q['sql']]
+        self.assertTrue(search_sql)
+        self.assertFalse(any('%ABC001%' in sql for sql in search_sql))
+
+
+class SessionStorageTests(TestCase):
+    """Expired sessions are cleared in batches, and large flash messages spill to the session"""
+
+    def request(self, cookies=None):
+        request = RequestFactory().get('/')
+        if cookies:
+            request.COOKIES.update({name: morsel.value for name, morsel in cookies.items()})
+        SessionMiddleware(lambda request: HttpResponse()).process_request(request)
+        request._messages = default_storage(request)
+        return request
+
+    def test_clear_expired_sessions_keeps_live_ones(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(hours=i + 1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + timedelta(hours=1))
+        out = StringIO()
+        call_command('clear_expired_sessions', batch_size=2, pause=0, stdout=out)
+        self.assertIn('Deleted 5 expired sessions', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+    def test_large_messages_survive_a_redirect(self):
+        # Random text doesn't compress, so it can't fit in the message cookie
+        text = secrets.token_urlsafe(6000)
+        request = self.request()
+        messages.success(request, 'Task added')
+        messages.info(request, text)
+        response = HttpResponse()
+        request._messages.update(response)
+        request.session.save()
+        response.cookies.update(SimpleCookie({settings.SESSION_COOKIE_NAME: request.session.session_key}))
+
+        following = self.request(cookies=response.cookies)
+        self.assertEqual([message.message for message in get_messages(following)], ['Task added', text])
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class PatientVersionTests(TestCase):
+    """Concurrent edits are detected by the version column, not lost"""
+
+    def setUp(self):
+        create_patients(1)
+        self.patient = Patient.objects.get()
+        self.url = reverse('edit_patient_info', args=[self.patient.id])
+
+    def post_info(self, version, summary):
+        return self.client.post(self.url, {
+            'version': version,
+            'presenting_complaint': 'Chest pain',
+            'summary': summary,
+            'past_medical_history': '',
+            'issues': '',
+        })
+
+    def test_stale_save_raises_conflict(self):
+        first = Patient.objects.get()
+        second = Patient.objects.get()
+        first.summary = 'first'
+        first.save()
+        second.summary = 'second'
+        with self.assertRaises(VersionConflict):
+            second.save()
+        self.assertEqual(Patient.objects.get().summary, 'first')
+        self.assertEqual(Patient.objects.get().version, self.patient.version + 1)
+
+    def test_conflicting_form_post_prompts_then_retries(self):
+        version = self.patient.version
+        self.assertRedirects(
+            self.post_info(version, 'theirs'), reverse('patient_detail', args=[self.patient.id]),
+            fetch_redirect_response=False,
+        )
+
+        response = self.post_info(version, 'mine')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Patient.objects.get().summary, 'theirs')
+        self.assertEqual(
+            [(c['mine'], c['theirs']) for c in response.context['conflicts']], [('mine', 'theirs')]
+        )
+
+        # Saving the re-shown form (which carries the current version) keeps the user's value
+        self.post_info(response.context['patient'].version, 'mine')
+        self.assertEqual(Patient.objects.get().summary, 'mine')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, SYNC_SETTLE_SECONDS=5, SYNC_TOMBSTONE_RETENTION_DAYS=30)
+class DeltaSyncTests(TestCase):
+    """Sync cursors return each change once, in bounded batches, with tombstones for deletes"""
+
+    def setUp(self):
+        create_patients(3)
+
+    def sync(self, cursor=None, limit=500, seconds=10):
+        """One sync call, as if made ``seconds`` from now"""
+        return changes_since(cursor, limit, now=timezone.now() + timedelta(seconds=seconds))
+
+    def test_batches_deltas_and_tombstones(self):
+        seen = {name: [] for name in STREAMS}
+        cursor, has_more, calls = None, True, 0
+        while has_more:
+            changes, cursor, has_more = self.sync(cursor, limit=2)
+            calls += 1
+            for name, rows in changes.items():
+                self.assertLessEqual(len(rows), 2)
+                seen[name].extend(row['id'] for row in rows)
+        self.assertEqual(calls, 2)
+        self.assertEqual(sorted(seen['patients']), list(Patient.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(len(seen['tasks']), 3)
+        self.assertEqual(seen['deleted'], [])
+
+        # Nothing changed, so the next call is empty and the cursor still works
+        changes, cursor, has_more = self.sync(cursor)
+        self.assertFalse(any(changes.values()) or has_more)
+
+        task = Task.objects.first()
+        task.description = 'Repeat bloods'
+        task.save()
+        round_id = WardRound.objects.first().id
+        WardRound.objects.filter(id=round_id).delete()
+
+        changes, cursor, _ = self.sync(cursor, seconds=20)
+        self.assertEqual([row['description'] for row in changes['tasks']], ['Repeat bloods'])
+        self.assertEqual(
+            [(row['kind'], row['object_id']) for row in changes['deleted']], [('ward_round', round_id)],
+        )
+        self.assertEqual(changes['patients'], [])
+        changes, _, _ = self.sync(cursor, seconds=20)
+        self.assertFalse(any(changes.values()))
+
+    def test_recent_changes_wait_for_the_settle_window(self):
+        changes, cursor, _ = self.sync(seconds=0)
+        self.assertFalse(any(changes.values()))
+        changes, _, _ = self.sync(cursor)
+        self.assertEqual(len(changes['patients']), 3)
+
+    def test_bad_and_expired_cursors(self):
+        url = reverse('sync_api')
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': encode_cursor(['x'] * 6)}).status_code, 400)
+
+        _, old_cursor, _ = self.sync(seconds=-31 * 24 * 3600)
+        self.assertEqual(self.client.get(url, {'cursor': old_cursor}).status_code, 410)
+
+        with self.settings(SYNC_SETTLE_SECONDS=0):
+            data = self.client.get(url, {'limit': '1'}).json()
+        self.assertEqual(len(data['patients']), 1)
+        self.assertTrue(data['has_more'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class PartialUpdateTests(TestCase):
+    """Requests with X-Partial get a fragment or JSON delta instead of a redirect"""
+
+    def setUp(self):
+        create_patients(1)
+        self.patient = Patient.objects.get()
+
+    def test_toggle_returns_flag_fragment(self):
+        url = reverse('toggle_priority', args=[self.patient.id])
+        response = self.client.post(url, {'version': self.patient.version}, HTTP_X_PARTIAL='html')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'id="patient-flag-actions-{self.patient.id}"')
+        self.assertContains(response, 'Remove Priority')
+        self.assertEqual(response['X-Message'], 'Priority%20flag%20enabled')
+
+        # The stale version still on the page is rejected with 409, not a redirect
+        response = self.client.post(url, {'version': self.patient.version}, HTTP_X_PARTIAL='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(Patient.objects.get().priority_flag)
+
+    def test_task_and_consult_json_deltas(self):
+        task = Task.objects.get()
+        response = self.client.post(
+            reverse('edit_task', args=[task.id]), {'action': 'complete'}, HTTP_X_PARTIAL='json',
+        )
+        self.assertEqual(response.json()['task']['status'], 'COMPLETED')
+
+        consult = ConsultRequest.objects.get()
+        response = self.client.post(
+            reverse('update_consult_status', args=[consult.id]), {'status': 'ACCEPTED'},
+            HTTP_X_PARTIAL='json',
+        )
+        self.assertEqual(response.json()['consult']['status'], 'ACCEPTED')
+        self.assertEqual(ConsultRequest.objects.get().requested_by, consult.requested_by)
+
+    def test_without_header_redirects(self):
+        response = self.client.post(
+            reverse('toggle_weekend_review', args=[self.patient.id]), {'version': self.patient.version},
+        )
+        self.assertRedirects(
+            response, reverse('patient_detail', args=[self.patient.id]), fetch_redirect_response=False,
+        )
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class ListRowTests(TestCase):
+    """List pages read only the columns they display"""
+
+    def test_lists_skip_unshown_text_columns(self):
+        create_patients(3)
+        Patient.objects.update(
+            patient_category='ACUTE_INPROCESS', weekend_review=True, location='WARD1', bed_number=4,
+            clerking_doctor=Clinician.from_name('Dr. Clerk'),
+        )
+        for name in ['patient_list', 'take_list', 'weekend_review_list']:
+            with self.subTest(page=name), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+                self.assertContains(response, 'Ward 1 - Bed 4')
+                self.assertContains(response, 'ABC0002')
+                self.assertFalse(any('past_medical_history' in q['sql'] for q in queries))
+        self.assertContains(self.client.get(reverse('take_list')), 'Dr. Clerk')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class LoadTestCommandTests(LiveServerTestCase):
+    """load_test drives a live server and reports per-endpoint results, failing on server errors"""
+
+    def setUp(self):
+        create_patients(3)
+        Patient.objects.update(patient_category='ACUTE_INPROCESS')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.scenario = os.path.join(directory.name, 'scenario.json')
+        with open(self.scenario, 'w') as f:
+            json.dump({
+                'clinicians': 1, 'duration': 0.5, 'ramp_up': 0, 'think_time': [0.05, 0.05],
+                'actions': {'take_list': 1, 'patient_list': 1, 'clerking': 1},
+            }, f)
+
+    def load_test(self):
+        out = StringIO()
+        call_command('load_test', url=self.live_server_url, scenario=self.scenario, json=True, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_reports_each_endpoint(self):
+        report = self.load_test()
+        self.assertGreater(report['requests'], 0)
+        self.assertEqual(report['server_errors'], 0)
+        self.assertLessEqual(set(report['endpoints']), {'take_list', 'patient_list', 'clerking_form', 'clerking'})
+        for row in report['endpoints'].values():
+            self.assertGreater(row['requests'], 0)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+    def test_server_errors_fail_the_run(self):
+        real_render = views.render
+
+        def render(request, template_name, *args, **kwargs):
+            if template_name == 'patients/patient_list.html':
+                raise RuntimeError('Simulated failure')
+            return real_render(request, template_name, *args, **kwargs)
+
+        with mock.patch.object(views, 'render', render), self.assertRaisesMessage(CommandError, 'patient_list ('):
+            self.load_test()
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, PROFILE_KEEP=2)
+class RequestProfilingTests(TestCase):
+    """Staff can profile a request with ?profile=1; only the newest profiles are kept"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=directory.name))
+        self.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        create_patients(2)
+
+    def test_staff_profiles_are_saved_and_pruned(self):
+        self.client.force_login(self.staff)
+        ids = [
+            self.client.get(reverse('take_list'), {'profile': '1'})['X-Profile-Id'] for _ in range(3)
+        ]
+        self.assertEqual([profile['id'] for profile in list_profiles()], ids[:0:-1])
+
+        self.assertContains(self.client.get(reverse('profile_list')), ids[-1])
+        response = self.client.get(reverse('profile_detail', args=[ids[-1]]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['profile']['slow_queries'])
+        self.assertEqual(response.context['profile']['path'], reverse('take_list') + '?profile=1')
+
+    def test_other_requests_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('take_list'), {'profile': '1'}))
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('take_list')))
+        self.assertEqual(list_profiles(), [])
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class MetricsTests(TestCase):
+    """/metrics sums every worker's counters and exports the take-list gauges"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(METRICS_DIR=self.directory, METRICS_GAUGE_SECONDS=0))
+        create_patients(2)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_counted_across_processes(self):
+        self.client.get(reverse('take_list'))
+        self.client.get(reverse('take_list'))
+        series = 'medlyst_http_requests_total{method="GET",status="200",view="take_list"}'
+        own = int(re.search(re.escape(series) + r' (\d+)', self.scrape()).group(1))
+
+        # Another worker's flushed totals are added in
+        with open(os.path.join(self.directory, '99999-feedbeef.json'), 'w') as f:
+            json.dump({'counters': [[
+                'medlyst_http_requests_total', [['method', 'GET'], ['status', 200], ['view', 'take_list']], 5,
+            ]], 'histograms': []}, f)
+        self.assertIn(f'{series} {own + 5}', self.scrape())
+
+    def test_concurrent_flushes_keep_the_file_readable(self):
+        key = ('medlyst_load_shed_total', (('endpoint_class', 'test'),))
+        before = registry.counters.get(key, 0)
+        registry.inc('medlyst_load_shed_total', {'endpoint_class': 'test'}, 3)
+        start = threading.Barrier(8)
+
+        def flush(force):
+            start.wait()
+            for _ in range(50):
+                registry.flush(force=force)
+
+        threads = [threading.Thread(target=flush, args=(i % 2 == 0,)) for i in range(8)]
+        # A clash shows up as a failed os.replace (the .tmp already moved)
+        with self.assertNoLogs('patients.metrics', 'WARNING'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(os.listdir(self.directory), [registry.file_name])
+        counters, _, _ = collect()
+        self.assertEqual(counters[key], before + 3)
+
+    def test_exports_timings_and_business_gauges(self):
+        Patient.objects.update(patient_category='ACUTE_INPROCESS', clerking_status='AWAITING')
+        self.client.get(reverse('take_list'))
+        text = self.scrape()
+        self.assertIn('medlyst_http_request_duration_seconds_bucket{view="take_list",le="+Inf"}', text)
+        self.assertIn('medlyst_template_render_seconds_count{template="patients/take_list.html"}', text)
+        self.assertIn('medlyst_db_queries_total{view="take_list"}', text)
+        self.assertIn('medlyst_take_list_patients 2', text)
+        self.assertIn('medlyst_awaiting_clerking_patients 2', text)
+        self.assertIn('medlyst_open_consults{specialty="RENAL"} 2', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class ImportPatientsTests(TestCase):
+    """import_patients upserts by NHI, refreshing only PAS fields and only when they change"""
+
+    HEADER = (
+        'nhi_number,name,datetime_of_arrival,presenting_complaint,current_parent_specialty,'
+        'current_responsible_team,referral_source,referral_time,location,bed_number\n'
+    )
+
+    def setUp(self):
+        create_patients(1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def run_import(self, name, content, **options):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        call_command('import_patients', path, workers=0, stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_csv_inserts_updates_and_rejects(self):
+        existing = Patient.objects.get()
+        existing.clerking_status = 'COMPLETED'
+        existing.save()
+        rejects = os.path.join(self.directory, 'rejects.csv')
+        received = []
+        patient_locations_changed.connect(
+            lambda changes, **kwargs: received.extend(changes), weak=False, dispatch_uid='test_import',
+        )
+        self.addCleanup(patient_locations_changed.disconnect, dispatch_uid='test_import')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run_import('extract.csv', self.HEADER + (
+                'ABC0000,Patient 0 Renamed,2026-10-18T08:00:00,Fall,SURGERY,MEDB,GP,2026-10-18T09:00,WARD2,4\n'
+                'xyz1234,New Patient,2026-10-18T08:00:00,"Fever\nand rigors",MEDICINE,MEDA,ED,2026-10-18T08:30,ED,\n'
+                'BAD0001,Wrong Specialty,2026-10-18T08:00:00,Fever,PLUMBING,MEDA,ED,2026-10-18T08:30,ED,\n'
+                'ZZZ12AB,New Format,2026-10-18T08:00:00,Fever,MEDICINE,MEDA,ED,2026-10-18T08:30,ED,\n'
+                'ABC12A3,Mixed Format,2026-10-18T08:00:00,Fever,MEDICINE,MEDA,ED,2026-10-18T08:30,ED,\n'
+            ), rejects=rejects)
+
+        updated = Patient.objects.get(nhi_number='ABC0000')
+        self.assertEqual((updated.name, updated.location, updated.bed_number), ('Patient 0 Renamed', 'WARD2', 4))
+        self.assertEqual(updated.version, existing.version + 1)
+        # Workflow fields belong to MedLyst, not the extract
+        self.assertEqual(updated.clerking_status, 'COMPLETED')
+        self.assertEqual(updated.current_parent_specialty, 'MEDICINE')
+
+        # The move is reported like a bed feed move; new patients aren't moves
+        self.assertEqual(
+            [(change.patient_id, change.old_location, change.location, change.bed_number) for change in received],
+            [(existing.pk, existing.location, 'WARD2', 4)],
+        )
+
+        created = Patient.objects.get(nhi_number='XYZ1234')
+        self.assertEqual((created.location, created.bed_number, created.version), ('ED', None, 1))
+        self.assertEqual(created.presenting_complaint, 'Fever\nand rigors')
+        self.assertTrue(Patient.objects.filter(nhi_number='ZZZ12AB').exists())
+        # Line numbers count the line the quoted complaint spills onto
+        with open(rejects, newline='') as f:
+            self.assertEqual(list(csv.reader(f))[1:], [
+                [
+                    '5', 'BAD0001', "current_parent_specialty 'PLUMBING' is not one of "
+                    + ', '.join(sorted(code for code, _ in Patient.SPECIALTY_CHOICES)),
+                ],
+                ['7', 'ABC12A3', "nhi_number 'ABC12A3' is not a valid NHI"],
+            ])
+
+    def test_batches_fit_the_parameter_limit(self):
+        columns = len([field for field in Patient._meta.concrete_fields if not field.primary_key])
+        lines = [
+            f'NEW{number:04d},Patient {number},2026-10-18T08:00:00,Fever,MEDICINE,MEDA,ED,2026-10-18T08:30,ED,\n'
+            for number in range(5)
+        ]
+        # Two rows' worth of parameters: five rows need three statements
+        with mock.patch.object(connection.features, 'max_query_params', 2 * columns + 1), \
+                CaptureQueriesContext(connection) as queries:
+            self.run_import('extract.csv', self.HEADER + ''.join(lines))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+        self.assertEqual(Patient.objects.filter(nhi_number__startswith='NEW').count(), 5)
+
+    def test_unchanged_rows_keep_their_version(self):
+        patient = Patient.objects.get()
+        line = json.dumps({
+            'nhi_number': patient.nhi_number, 'name': patient.name,
+            'datetime_of_arrival': patient.datetime_of_arrival.isoformat(),
+            'presenting_complaint': 'Something else', 'current_parent_specialty': 'MEDICINE',
+            'current_responsible_team': 'MEDA', 'referral_source': patient.referral_source,
+            'referral_time': patient.referral_time.isoformat(), 'location': patient.location,
+            'bed_number': patient.bed_number, 'admission_type': patient.admission_type,
+        })
+        self.run_import('extract.ndjson', line + '\n\n')
+        self.assertEqual(Patient.objects.get().version, patient.version)
+        self.assertEqual(Patient.objects.get().updated_at, patient.updated_at)
+
+
+class BedFeedTests(TestCase):
+    """consume_bed_feed coalesces moves per NHI and writes only real changes"""
+
+    def setUp(self):
+        create_patients(2)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_moves_are_coalesced_and_applied_once(self):
+        moved, unchanged = Patient.objects.order_by('nhi_number')
+        lines = [
+            {'nhi_number': moved.nhi_number, 'location': 'WARD3', 'bed_number': 2},
+            {'nhi_number': moved.nhi_number, 'location': 'WARD4', 'bed_number': '5'},
+            {'nhi_number': unchanged.nhi_number, 'location': unchanged.location, 'bed_number': unchanged.bed_number},
+            {'nhi_number': 'NOP0000', 'location': 'WARD1'},
+            {'nhi_number': moved.nhi_number, 'location': 'MOON'},
+        ]
+        with open(os.path.join(self.directory, '0001.ndjson'), 'w') as f:
+            f.write('\n'.join(json.dumps(line) for line in lines))
+        # Still being written by the feed; left for the next window
+        open(os.path.join(self.directory, '.0002.ndjson'), 'w').close()
+
+        received = []
+        patient_locations_changed.connect(
+            lambda changes, **kwargs: received.extend(changes), weak=False, dispatch_uid='test_bed_feed',
+        )
+        self.addCleanup(patient_locations_changed.disconnect, dispatch_uid='test_bed_feed')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('consume_bed_feed', self.directory, once=True, stdout=StringIO(), stderr=StringIO())
+
+        moved_after = Patient.objects.get(pk=moved.pk)
+        self.assertEqual((moved_after.location, moved_after.bed_number), ('WARD4', 5))
+        self.assertEqual(moved_after.version, moved.version + 1)
+        self.assertGreater(moved_after.updated_at, moved.updated_at)
+        self.assertEqual(Patient.objects.get(pk=unchanged.pk).version, unchanged.version)
+        self.assertEqual(
+            [(change.nhi_number, change.old_location, change.location) for change in received],
+            [(moved.nhi_number, moved.location, 'WARD4')],
+        )
+        self.assertEqual(os.listdir(self.directory), ['.0002.ndjson'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, METRICS_GAUGE_SECONDS=0)
+class QueryBudgetTests(TestCase):
+    """Every patients URL stays within a fixed SQL query budget.
+
+    The dataset has enough rows on each list that a per-row query (a
+    .count() in a template, a __str__ reaching through a foreign key) blows
+    the budget. Budgets are measured with cold caches. When a change
+    legitimately needs another query, raise the budget in the same commit.
+    """
+
+    # (url name, object the URL takes, method, params, budget[, headers]).
+    # Creating or closing a task or consult adds a savepoint and the
+    # patient's open-work counter UPDATE (three statements).
+    BUDGETS = [
+        ('patient_list', None, 'GET', {}, 1),
+        ('patient_list', None, 'GET', {'team': 'MEDA', 'clerking_status': 'AWAITING', 'admission_type': 'ACUTE'}, 1),
+        ('take_list', None, 'GET', {}, 7),
+        ('take_list', None, 'GET', {'sort': 'name', 'order': 'desc', 'priority': 'true'}, 7),
+        ('take_list', None, 'GET', {'specialty': 'MEDICINE', 'ptwr_status': 'AWAITING'}, 7),
+        ('kiosk_take_list', None, 'GET', {}, 2),
+        ('kiosk_take_list', None, 'GET', {'team': 'MEDA', 'specialty': 'MEDICINE'}, 2),
+        ('weekend_review_list', None, 'GET', {}, 1),
+        ('weekend_review_list', None, 'GET', {'location': 'WARD1', 'category': 'ACUTE_ADMITTED'}, 1),
+        ('consults_list', None, 'GET', {}, 11),
+        ('consults_list', None, 'GET', {'status': 'REQUESTED', 'specialty': 'RENAL'}, 11),
+        ('consult_queues', None, 'GET', {}, 2),
+        ('consult_queues', None, 'GET', {'specialty': 'RENAL'}, 2),
+        ('consult_queues_api', None, 'GET', {}, 2),
+        ('take_flow_report', None, 'GET', {}, 1),
+        ('take_flow_report', None, 'GET', {'days': '30', 'specialty': 'MEDICINE', 'team': 'MEDA'}, 1),
+        ('cohort_analytics', None, 'GET', {}, 2),
+        ('cohort_analytics', None, 'GET', {'by': 'team', 'format': 'csv'}, 2),
+        ('task_worklist', None, 'GET', {}, 2),
+        ('task_worklist', None, 'GET', {'status': 'PENDING', 'priority': 'HIGH', 'due': 'overdue'}, 2),
+        ('task_worklist_api', None, 'GET', {}, 1),
+        ('sync_api', None, 'GET', {}, 5),
+        ('sync_api', None, 'GET', {'limit': '5'}, 5),
+        ('metrics', None, 'GET', {}, 2),
+        ('patient_detail', 'acute', 'GET', {}, 5),
+        ('ward_round_timeline', 'acute', 'GET', {}, 2),
+        ('ward_round_timeline', 'acute', 'GET', {}, 2, {'HTTP_X_PARTIAL': 'html'}),
+        ('ward_round_notes', 'ward_round', 'GET', {}, 1),
+        ('ward_round_notes', 'ward_round', 'GET', {}, 1, {'HTTP_X_PARTIAL': 'html'}),
+        ('edit_patient_info', 'acute', 'GET', {}, 1),
+        ('edit_patient_info', 'acute', 'POST', {'presenting_complaint': 'Fall', 'summary': 'Better'}, 4),
+        ('referral_workflow', 'ed', 'GET', {}, 1),
+        ('referral_workflow', 'ed', 'POST', {'specialty': 'SURGERY', 'team': 'SURGA', 'referral_reason': 'RIF pain'}, 4),
+        ('change_specialty', 'acute', 'GET', {}, 1),
+        ('change_specialty', 'acute', 'POST', {'specialty': 'SURGERY'}, 4),
+        ('clerking_workflow', 'acute', 'GET', {}, 2),
+        ('clerking_workflow', 'acute', 'POST', {'status': 'COMPLETED', 'doctor': 'Dr. Test'}, 8),
+        ('ptwr_workflow', 'acute', 'GET', {}, 2),
+        ('ptwr_workflow', 'acute', 'POST', {'status': 'COMPLETED', 'doctor': 'Dr. Test', 'notes': 'Plan'}, 8),
+        ('general_ward_round', 'acute', 'GET', {}, 2),
+        ('general_ward_round', 'acute', 'POST', {'doctor': 'Dr. Test', 'notes': 'Improving'}, 3),
+        ('consult_request', 'acute', 'GET', {}, 2),
+        ('consult_request', 'acute', 'POST', {
+            'specialty': 'RENAL', 'reason': 'Rising creatinine', 'requested_by': 'Dr. Test',
+        }, 6),
+        ('add_task', 'acute', 'GET', {}, 2),
+        ('add_task', 'acute', 'POST', {
+            'description': 'ECG', 'priority': 'HIGH', 'assigned_to': 'Dr. Other', 'created_by': 'Dr. Test',
+            'due_date': '',
+        }, 7),
+        ('complete_admission', 'ready', 'GET', {}, 1),
+        ('complete_admission', 'ready', 'POST', {}, 6),
+        ('toggle_priority', 'acute', 'POST', {}, 4),
+        ('toggle_priority', 'acute', 'POST', {}, 4, {'HTTP_X_PARTIAL': 'html'}),
+        ('toggle_weekend_review', 'acute', 'POST', {}, 4, {'HTTP_X_PARTIAL': 'json'}),
+        ('update_team', 'acute', 'GET', {}, 1),
+        ('update_team', 'acute', 'POST', {'team': 'MEDB'}, 4),
+        ('edit_task', 'task', 'GET', {}, 4),
+        ('edit_task', 'task', 'POST', {'action': 'update', 'status': 'IN_PROGRESS'}, 2),
+        ('edit_task', 'task', 'POST', {'action': 'update', 'status': 'COMPLETED'}, 6, {'HTTP_X_PARTIAL': 'html'}),
+        ('update_consult_status', 'consult', 'GET', {}, 2),
+        ('update_consult_status', 'consult', 'POST', {'status': 'ACCEPTED', 'reviewed_by': 'Dr. Other'}, 3),
+        ('update_consult_status', 'consult', 'POST', {'status': 'IN_PROGRESS'}, 2, {'HTTP_X_PARTIAL': 'html'}),
+    ]
+
+    # Pages whose budget only means something when they list rows:
+    # url name -> check on the response context
+    LISTS_ROWS = {
+        'consults_list': lambda context: context['consults'].exists(),
+        'consult_queues': lambda context: any(
+            lane['consults'] for queue in context['queues'] for lane in queue['lanes']
+        ),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        create_patients(24)
+        Clinician.from_name('Dr. Other')
+        patients = list(Patient.objects.order_by('nhi_number'))
+        for patient in patients[:12]:
+            patient.patient_category = 'ACUTE_INPROCESS'
+            patient.clerking_status = 'AWAITING'
+            patient.post_take_ward_round_status = 'AWAITING'
+            patient.referral_to_specialty_datetime = timezone.now()
+            patient.priority_flag = patient.id % 2 == 0
+        for patient in patients[12:18]:
+            patient.patient_category = 'ACUTE_ADMITTED'
+            patient.location = 'WARD1'
+            patient.bed_number = patient.id % 16 + 1
+            patient.weekend_review = True
+        patients[1].clerking_status = patients[1].post_take_ward_round_status = 'COMPLETED'
+        for patient in patients:
+            patient.save()
+        Task.objects.filter(patient__in=patients[:6]).update(priority='HIGH', due_date=timezone.now() - timedelta(hours=1))
+        # Several related rows by different clinicians on the chart under test
+        other = Clinician.objects.get(name='Dr. Other')
+        for i in range(4):
+            ConsultRequest.objects.create(patient=patients[0], specialty='RENAL', reason='AKI', requested_by=other)
+            WardRound.objects.create(
+                patient=patients[0], ward_round_type='GENERAL', doctor=other, notes='Reviewed', timestamp=timezone.now(),
+            )
+            Task.objects.create(patient=patients[0], description=f'Task {i}', assigned_to=other, created_by=other)
+
+        cls.objects = {
+            'acute': patients[0].id,
+            'ready': patients[1].id,
+            'ed': patients[-1].id,
+            'task': Task.objects.filter(patient=patients[0], description='Bloods').get().id,
+            'consult': ConsultRequest.objects.filter(patient=patients[0], requested_by__name='Dr. Test').get().id,
+            'ward_round': WardRound.objects.filter(patient=patients[0]).latest('timestamp').id,
+        }
+
+    def assertWithinBudget(self, name, method, url, params, budget, headers):
+        invalidate_clinician_cache()
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'GET':
+                    response = self.client.get(url, params, **headers)
+                else:
+                    response = self.client.post(url, params, **headers)
+            # Each case starts from the same data
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, f'{method} {url} returned {response.status_code}')
+        if name in self.LISTS_ROWS:
+            self.assertTrue(self.LISTS_ROWS[name](response.context), f'{method} {url} {params} listed nothing')
+        if len(queries) > budget:
+            listing = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(queries, start=1))
+            self.fail(f'{method} {url} {params} ran {len(queries)} queries, budget is {budget}:\n{listing}')
+
+    def test_every_url_has_a_budget(self):
+        from . import urls
+
+        budgeted = {case[0] for case in self.BUDGETS}
+        missing = [pattern.name for pattern in urls.urlpatterns if pattern.name not in budgeted]
+        self.assertEqual(missing, [], 'Add a query budget for each new URL')
+
+    def test_query_budgets(self):
+        for name, obj, method, params, budget, *headers in self.BUDGETS:
+            headers = headers[0] if headers else {}
+            url = reverse(name, args=[self.objects[obj]] if obj else [])
+            with self.subTest(name=name, method=method, params=params, headers=headers):
+                self.assertWithinBudget(name, method, url, params, budget, headers)
+
+
+class SqliteConcurrentBackendTests(SimpleTestCase):
+    """The SQLITE_CONCURRENT backend sets its pragmas and takes the write lock at BEGIN"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings['sqlite_concurrent'] = dict(
+            connection.settings_dict, ENGINE='patients.sqlite_backend',
+            NAME=os.path.join(directory.name, 'concurrent.sqlite3'),
+        )
+        self.addCleanup(connections.settings.pop, 'sqlite_concurrent')
+        self.addCleanup(lambda: connections['sqlite_concurrent'].close())
+
+    def test_pragmas_and_immediate_transactions(self):
+        database = connections['sqlite_concurrent']
+        with database.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+        with CaptureQueriesContext(database) as queries, transaction.atomic(using='sqlite_concurrent'):
+            database.cursor().execute('SELECT 1')
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class WardRoundTimelineTests(TestCase):
+    """The ward round timeline pages by (timestamp, id) and truncates long notes"""
+
+    def setUp(self):
+        create_patients(1)
+        self.patient = Patient.objects.get()
+        doctor = Clinician.objects.get()
+        now = timezone.now()
+        # Pairs share a timestamp, so the id tie-break decides the order
+        for i in range(24):
+            WardRound.objects.create(
+                patient=self.patient, ward_round_type='GENERAL', doctor=doctor,
+                notes=f'Round {i} ' + 'x' * (1000 if i == 23 else 0), timestamp=now - timedelta(hours=i // 2 + 1),
+            )
+
+    def test_pages_cover_every_round_once_newest_first(self):
+        expected = list(
+            WardRound.objects.filter(patient=self.patient).order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        url = reverse('ward_round_timeline', args=[self.patient.id])
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {}, HTTP_X_PARTIAL='json')
+            data = response.json()
+            seen.extend(row['id'] for row in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}, HTTP_X_PARTIAL='json').status_code, 400)
+
+    def test_detail_shows_first_page_and_long_notes_expand(self):
+        response = self.client.get(reverse('patient_detail', args=[self.patient.id]))
+        self.assertEqual(len(response.context['ward_rounds']), 10)
+        self.assertContains(response, 'Load older ward rounds')
+
+        long_round = WardRound.objects.get(notes__startswith='Round 23 ')
+        url = reverse('ward_round_timeline', args=[self.patient.id])
+        last_page = self.client.get(url, {'cursor': response.context['next_cursor']}, HTTP_X_PARTIAL='json').json()
+        last_page = self.client.get(url, {'cursor': last_page['next_cursor']}, HTTP_X_PARTIAL='json').json()
+        row = next(row for row in last_page['results'] if row['id'] == long_round.id)
+        self.assertTrue(row['truncated'])
+        self.assertEqual(len(row['notes_preview']), 300)
+
+        fragment = self.client.get(reverse('ward_round_notes', args=[long_round.id]), HTTP_X_PARTIAL='html')
+        self.assertContains(fragment, long_round.notes)
+        self.assertNotContains(fragment, '<html')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class LoadSheddingTests(TestCase):
+    """Endpoint classes queue up to their limit with a bounded wait, then shed with a 503"""
+
+    def test_limiter_queues_then_sheds(self):
+        limiter = EndpointLimiter('test', limit=1, max_wait=0.05, max_queue=1, retry_after=1)
+        self.assertTrue(limiter.acquire())
+        # Times out waiting for the only slot
+        self.assertFalse(limiter.acquire())
+
+        limiter.max_wait = 5
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        while limiter.waiting == 0:
+            waiter.join(0.001)
+        self.assertEqual(registry.gauges[('medlyst_endpoint_queue_depth', (('endpoint_class', 'test'),))], 1)
+        # The queue is full, so this one is turned away without waiting
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+
+    def test_gauges_stay_visible_while_requests_are_stuck(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=directory.name))
+        registry.flush(force=True)
+        limiter = EndpointLimiter('stuck', limit=1, max_wait=5, max_queue=1, retry_after=1)
+        self.assertTrue(limiter.acquire())
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        self.addCleanup(waiter.join)
+        self.addCleanup(limiter.release)
+        while limiter.waiting == 0:
+            waiter.join(0.001)
+        # The waiter reports while holding the condition, until it waits
+        with limiter.condition:
+            pass
+
+        # Written when the request started waiting, not when one finishes
+        with open(os.path.join(directory.name, registry.file_name)) as f:
+            written = json.load(f)
+        depth = ['medlyst_endpoint_queue_depth', [['endpoint_class', 'stuck']], 1]
+        self.assertIn(depth, written['gauges'])
+
+        # Old files keep their gauges while their worker is alive
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        stale = time.time() - 60
+        for pid in [os.getppid(), exited.pid]:
+            path = os.path.join(directory.name, f'{pid}-0000beef.json')
+            with open(path, 'w') as f:
+                json.dump(written, f)
+            os.utime(path, (stale, stale))
+        _, gauges, _ = collect()
+        self.assertEqual(gauges[('medlyst_endpoint_queue_depth', (('endpoint_class', 'stuck'),))], 2)
+
+    @override_settings(ENDPOINT_LIMITS={
+        'heavy': {'views': ['patient_list'], 'limit': 0, 'max_wait': 0, 'max_queue': 0, 'retry_after': 7},
+        'poll': {'views': ['take_list'], 'limit': 1, 'max_wait': 0, 'max_queue': 0, 'retry_after': 1},
+    })
+    def test_over_limit_requests_get_503_with_retry_after(self):
+        create_patients(1)
+        key = ('medlyst_load_shed_total', (('endpoint_class', 'heavy'),))
+        shed = registry.counters.get(key, 0)
+        response = self.client.get(reverse('patient_list'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(registry.counters[key], shed + 1)
+
+        # Slots are released after each response, and unlisted views are not limited
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('take_list')).status_code, 200)
+        patient = Patient.objects.get()
+        self.assertEqual(self.client.get(reverse('patient_detail', args=[patient.id])).status_code, 200)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class OpenWorkCounterTests(TestCase):
+    """Task and consult changes keep the patient's open-work counters in step"""
+
+    def setUp(self):
+        create_patients(1)
+        self.patient = Patient.objects.get()
+        self.doctor = Clinician.objects.get()
+
+    def counts(self):
+        return tuple(Patient.objects.filter(pk=self.patient.pk).values_list(*Patient.COUNTER_FIELDS).get())
+
+    def test_creates_status_changes_and_deletes_are_counted(self):
+        # create_patients adds one open task and one open consult
+        self.assertEqual(self.counts(), (1, 0, 1))
+        urgent = Task.objects.create(
+            patient=self.patient, description='Cultures', priority='URGENT', created_by=self.doctor,
+        )
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+        urgent.priority = 'HIGH'
+        urgent.save()
+        self.assertEqual(self.counts(), (2, 0, 1))
+        task = Task.objects.get(pk=urgent.pk)
+        task.status = 'COMPLETED'
+        task.save()
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+        consult = ConsultRequest.objects.get()
+        consult.status = 'DECLINED'
+        consult.save()
+        self.assertEqual(self.counts(), (1, 0, 0))
+
+        task.delete()
+        Task.objects.filter(patient=self.patient).delete()
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_stale_instances_are_counted_from_the_stored_row(self):
+        task = Task.objects.create(
+            patient=self.patient, description='Cultures', priority='URGENT', created_by=self.doctor,
+        )
+        first, second = Task.objects.get(pk=task.pk), Task.objects.get(pk=task.pk)
+        first.status = 'COMPLETED'
+        first.save()
+        second.status = 'COMPLETED'
+        second.save()
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+        # A description edit from a form loaded before completion writes the
+        # open status back, so the task is counted again
+        task.status = 'PENDING'
+        task.save()
+        stale = Task.objects.get(pk=task.pk)
+        task.status = 'COMPLETED'
+        task.save()
+        self.assertEqual(self.counts(), (1, 0, 1))
+        stale.description = 'Cultures x2'
+        stale.save()
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+    def test_patient_saves_keep_counters_and_version(self):
+        stale = Patient.objects.get()
+        Task.objects.create(patient=self.patient, description='ECG', priority='URGENT', created_by=self.doctor)
+        # Counting doesn't bump the version, so open forms stay valid
+        self.assertEqual(Patient.objects.get().version, stale.version)
+        stale.summary = 'Settling'
+        stale.save()
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+    def test_reconcile_corrects_drift_and_lists_show_badges(self):
+        Patient.objects.update(open_task_count=5, open_consult_count=0)
+        out = StringIO()
+        call_command('reconcile_open_work_counts', pause=0, stdout=out)
+        self.assertIn('Checked 1 patients, corrected 1', out.getvalue())
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+        Patient.objects.update(patient_category='ACUTE_INPROCESS')
+        response = self.client.get(reverse('take_list'))
+        self.assertContains(response, '1 task</span>')
+        self.assertContains(response, '1 consult</span>')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, SINGLE_FLIGHT_WAIT=5)
+class SingleFlightTests(TestCase):
+    """Identical concurrent kiosk requests share one render, within and across workers"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(SINGLE_FLIGHT_DIR=self.directory))
+
+    def test_concurrent_callers_share_the_leaders_render(self):
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return b'board'
+
+        roles = []
+        threads = [
+            threading.Thread(target=lambda: roles.append(single_flight('test', compute, 'test')[1]))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        # Let every follower find the leader's flight before it finishes
+        threads[0].join(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(roles), ['follower'] * 4 + ['leader'])
+
+    def test_reuses_another_workers_render_only_if_it_finished_after_arrival(self):
+        path = os.path.join(self.directory, hashlib.sha1(b'test').hexdigest())
+        with open(path, 'wb') as f:
+            f.write(b'%f\nother worker' % (time.time() + 60))
+        self.assertEqual(single_flight('test', lambda: b'mine', 'test'), (b'other worker', 'shared'))
+
+        with open(path, 'wb') as f:
+            f.write(b'%f\nold render' % (time.time() - 60))
+        self.assertEqual(single_flight('test', lambda: b'mine', 'test'), (b'mine', 'leader'))
+
+    def test_kiosk_is_read_only_and_ignores_unknown_filters(self):
+        create_patients(2)
+        Patient.objects.update(patient_category='ACUTE_INPROCESS')
+        response = self.client.get(reverse('kiosk_take_list'), {'team': 'MEDA', 'sort': 'name', 'team2': 'x'})
+        self.assertEqual(response['X-Single-Flight'], 'leader')
+        self.assertContains(response, 'Patient 1')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertNotContains(response, reverse('clerking_workflow', args=[Patient.objects.first().id]))
+
+
+class DuplicateDetectionTests(TestCase):
+    """Probable duplicates are found within blocks, incrementally, keeping review decisions"""
+
+    def add_patient(self, name, nhi_number, arrival):
+        return Patient.objects.create(
+            name=name, nhi_number=nhi_number, datetime_of_arrival=arrival, presenting_complaint='Fall',
+            current_parent_specialty='MEDICINE', current_responsible_team='MEDA',
+            referral_source='ED', referral_time=arrival,
+        )
+
+    def detect(self):
+        out = StringIO()
+        call_command('detect_duplicate_patients', stdout=out)
+        return out.getvalue()
+
+    def test_soundex(self):
+        for name, code in [('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+                           ('Pfister', 'P236'), ('Lee', 'L000')]:
+            self.assertEqual(soundex(name), code, name)
+
+    def test_finds_reentered_patients_incrementally(self):
+        now = timezone.now()
+        original = self.add_patient('Mrs. Aroha Ngata', 'ABC1234', now - timedelta(hours=5))
+        # Same surname and day, but a different person
+        self.add_patient('Wiremu Ngata', 'XYZ9876', now - timedelta(hours=4))
+        # Far apart in time and name, with an unrelated NHI one character away
+        self.add_patient('Sam Brown', 'ABC1239', now - timedelta(days=40))
+        self.assertIn('Indexed 3 patients', self.detect())
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+        # Re-entered under another NHI, and again with the name reversed
+        retyped = self.add_patient('Aroha Ngatta', 'DEF5555', now - timedelta(hours=2))
+        reversed_name = self.add_patient('NGATA, Aroha', 'ABC1284', now - timedelta(days=1))
+        output = self.detect()
+        self.assertIn('Indexed 2 patients', output)
+        self.assertIn('3 new probable duplicates', output)
+        pairs = {
+            (candidate.patient_id, candidate.other_id): candidate
+            for candidate in DuplicateCandidate.objects.all()
+        }
+        self.assertEqual(
+            set(pairs), {(original.id, retyped.id), (original.id, reversed_name.id), (retyped.id, reversed_name.id)}
+        )
+        self.assertIn('one character apart', pairs[(original.id, reversed_name.id)].reasons)
+
+        # Reviewed pairs keep their status when everything is re-indexed
+        DuplicateCandidate.objects.filter(other=retyped).update(status='NOT_DUPLICATE')
+        out = StringIO()
+        call_command('detect_duplicate_patients', full=True, stdout=out)
+        self.assertIn('0 new probable duplicates', out.getvalue())
+        self.assertEqual(DuplicateCandidate.objects.filter(status='NOT_DUPLICATE').count(), 1)
+        self.assertEqual(DuplicateCandidate.objects.count(), 3)
+
+    def assertKeysCurrent(self, patient):
+        values = Patient.objects.values(*PATIENT_FIELDS).get(pk=patient.pk)
+        self.assertEqual(
+            sorted(DuplicateBlockKey.objects.filter(patient=patient).values_list('key', flat=True)),
+            sorted(block_keys(values)),
+        )
+
+    def test_edits_refresh_block_keys(self):
+        now = timezone.now()
+        original = self.add_patient('Aroha Ngata', 'ABC1234', now - timedelta(hours=5))
+        other = self.add_patient('Sam Brown', 'XYZ9876', now - timedelta(hours=4))
+        self.detect()
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+        # Corrected to the same person: re-indexed and matched on save
+        other = Patient.objects.get(pk=other.pk)
+        other.name = 'Aroha Ngatta'
+        other.nhi_number = 'ABC1284'
+        other.save()
+        self.assertKeysCurrent(other)
+        self.assertEqual(
+            list(DuplicateCandidate.objects.values_list('patient_id', 'other_id')), [(original.pk, other.pk)],
+        )
+
+        # Edits to other fields leave the keys alone
+        keys = list(DuplicateBlockKey.objects.filter(patient=other).values_list('pk', flat=True))
+        other.summary = 'Reviewed'
+        other.save()
+        self.assertEqual(list(DuplicateBlockKey.objects.filter(patient=other).values_list('pk', flat=True)), keys)
+
+        # Renamed by the PAS extract: the open candidate goes with the old name
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'extract.ndjson')
+        with open(path, 'w') as f:
+            f.write(json.dumps({
+                'nhi_number': other.nhi_number, 'name': 'Sam Brown',
+                'datetime_of_arrival': other.datetime_of_arrival.isoformat(), 'presenting_complaint': 'Fall',
+                'current_parent_specialty': 'MEDICINE', 'current_responsible_team': 'MEDA',
+                'referral_source': 'ED', 'referral_time': other.referral_time.isoformat(),
+                'location': other.location,
+            }) + '\n')
+        call_command('import_patients', path, workers=0, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Patient.objects.get(pk=other.pk).name, 'Sam Brown')
+        self.assertKeysCurrent(other)
+        self.assertFalse(DuplicateCandidate.objects.exists())
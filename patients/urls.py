@@ -4,10 +4,17 @@ from . import views
 urlpatterns = [
     path('', views.patient_list, name='patient_list'),
     path('take-list/', views.take_list, name='take_list'),
+    path('kiosk/take-list/', views.kiosk_take_list, name='kiosk_take_list'),
     path('weekend-review/', views.weekend_review_list, name='weekend_review_list'),
     path('consults/', views.consults_list, name='consults_list'),
+    path('consults/queues/', views.consult_queues, name='consult_queues'),
+    path('api/consults/queues/', views.consult_queues_api, name='consult_queues_api'),
+    path('reports/take-flow/', views.take_flow_report, name='take_flow_report'),
+    path('reports/cohorts/', views.cohort_analytics, name='cohort_analytics'),
     path('consult/<int:consult_id>/update/', views.update_consult_status, name='update_consult_status'),
     path('patient/<int:patient_id>/', views.patient_detail, name='patient_detail'),
+    path('patient/<int:patient_id>/ward-rounds/', views.ward_round_timeline, name='ward_round_timeline'),
+    path('ward-round/<int:round_id>/notes/', views.ward_round_notes, name='ward_round_notes'),
     path('patient/<int:patient_id>/edit/', views.edit_patient_info, name='edit_patient_info'),
     path('patient/<int:patient_id>/referral/', views.referral_workflow, name='referral_workflow'),
     path('patient/<int:patient_id>/change-specialty/', views.change_specialty, name='change_specialty'),
@@ -21,4 +28,8 @@ urlpatterns = [
     path('patient/<int:patient_id>/toggle-weekend-review/', views.toggle_weekend_review, name='toggle_weekend_review'),
     path('patient/<int:patient_id>/update-team/', views.update_team, name='update_team'),
     path('task/<int:task_id>/edit/', views.edit_task, name='edit_task'),
+    path('tasks/', views.task_worklist, name='task_worklist'),
+    path('api/tasks/', views.task_worklist_api, name='task_worklist_api'),
+    path('api/sync/', views.sync_api, name='sync_api'),
+    path('metrics', views.metrics, name='metrics'),
 ]
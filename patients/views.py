@@ -1,8 +1,171 @@
+from datetime import timedelta
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.utils import timezone
-from django.contrib import messages
-from django.db.models import Q
-from .models import Patient, ConsultRequest, WardRound, Task
+from django.contrib import admin, messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Substr
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from .models import Clinician, Patient, ConsultRequest, WardRound, Task, VersionConflict
+from .analytics import DIMENSIONS, AnalyticsUnavailable, cohort_report, write_report_csv
+from .clinicians import clinician_choices
+from .listing import OVERDUE_TASK_COUNT, patient_rows
+from .metrics import render_metrics
+from .pagination import InvalidCursor, decode_cursor, keyset_page
+from .profiling import list_profiles, load_profile, stats_path
+from .rollups import record_transitions, summarize_rollups
+from .singleflight import single_flight
+from .sync import CursorExpired, changes_since
+
+
+WORKLIST_PAGE_SIZE = 50
+
+# Ward rounds per timeline page, and the note characters shown before "Show full note"
+WARD_ROUND_PAGE_SIZE = 10
+WARD_ROUND_PREVIEW_CHARS = 300
+
+# Fields each form writes, compared when a save hits a version conflict
+PATIENT_INFO_FIELDS = ['presenting_complaint', 'summary', 'past_medical_history', 'issues']
+REFERRAL_FIELDS = ['current_parent_specialty', 'current_responsible_team', 'referral_reason']
+
+# Rows shown per specialty/status consult queue
+CONSULT_QUEUE_LIMIT = 25
+
+# Rows per stream in one delta sync response (default / maximum)
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
+# Reporting windows offered on the take-flow report, in days
+TAKE_FLOW_WINDOWS = [1, 7, 30, 90]
+
+# Filters the kiosk take list honours (parameter -> field, allowed values).
+# Anything else in the query string is ignored, so the single-flight keys
+# stay bounded however the wall boards' URLs are written.
+KIOSK_FILTERS = {
+    'team': ('current_responsible_team', dict(Patient.TEAM_CHOICES)),
+    'specialty': ('current_parent_specialty', dict(Patient.SPECIALTY_CHOICES)),
+}
+
+
+def _parse_due_date(value):
+    """Parse a datetime-local form value in the current timezone"""
+    due_date = parse_datetime(value or '')
+    if due_date is not None and timezone.is_naive(due_date):
+        due_date = timezone.make_aware(due_date)
+    return due_date
+
+
+def _use_form_version(request, patient):
+    """Make the next save conflict if the patient changed after the form was rendered"""
+    version = request.POST.get('version', '')
+    if version.isdigit():
+        patient.version = int(version)
+
+
+def _merge_conflict(patient, fields):
+    """Reload a patient after a VersionConflict, keeping the user's edits.
+    
+    Returns the current row with the user's values for ``fields`` applied on
+    top (so saving the re-shown form keeps them) and a list of the fields
+    where the stored value now differs from what the user entered.
+    """
+    current = Patient.objects.select_related('clerking_doctor', 'ptwr_doctor').get(pk=patient.pk)
+    
+    def display(obj, field):
+        if field.choices:
+            return getattr(obj, f'get_{field.name}_display')() or '-'
+        return getattr(obj, field.name) or '-'
+    
+    conflicts = []
+    for name in fields:
+        field = Patient._meta.get_field(name)
+        if field.value_from_object(current) != field.value_from_object(patient):
+            conflicts.append({
+                'label': field.verbose_name.capitalize(),
+                'mine': display(patient, field),
+                'theirs': display(current, field),
+            })
+        setattr(current, field.attname, field.value_from_object(patient))
+    return current, conflicts
+
+
+def _partial_mode(request):
+    """'html' or 'json' when the request asks for an in-place update (X-Partial header), else None"""
+    mode = request.headers.get('X-Partial', '').lower()
+    return mode if mode in ('html', 'json') else None
+
+
+def _partial_response(request, mode, template, context, data, message):
+    """Return just the changed fragment, or a JSON delta, for an in-place update.
+    
+    The flash message travels with the response (X-Message header or a JSON
+    key) instead of the session, so the next full page doesn't repeat it.
+    """
+    if mode == 'json':
+        return JsonResponse(dict(data, message=message))
+    response = render(request, template, context)
+    response['X-Message'] = quote(message)
+    return response
+
+
+def _partial_conflict(mode, message):
+    """409 for an in-place update that hit a version conflict; the page falls back to a full submit"""
+    if mode == 'json':
+        return JsonResponse({'error': message}, status=409)
+    return HttpResponse(message, status=409, content_type='text/plain')
+
+
+def _patient_tasks_context(patient):
+    """Context for the pending tasks card on the patient page"""
+    return {
+        'patient': patient,
+        'tasks': patient.tasks.open().select_related('assigned_to', 'created_by'),
+    }
+
+
+def _ward_round_page(patient_id, cursor=None):
+    """One page of a patient's ward round timeline, newest first: (rows, next cursor or None).
+    
+    Rows are dicts holding only the first WARD_ROUND_PREVIEW_CHARS of each
+    note, so a page costs the same however long the notes or the stay.
+    Pages follow a (timestamp, id) cursor along wardround_timeline_idx.
+    """
+    rounds = (
+        WardRound.objects.filter(patient_id=patient_id)
+        .order_by('-timestamp', '-id')
+        .values(
+            'id', 'ward_round_type', 'timestamp',
+            doctor_name=F('doctor__name'),
+            # One extra character shows whether the note was cut short
+            notes_preview=Substr('notes', 1, WARD_ROUND_PREVIEW_CHARS + 1),
+        )
+    )
+    if cursor:
+        timestamp, round_id = decode_cursor(cursor, length=2)
+        try:
+            timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+        except ValueError:
+            timestamp = None
+        if timestamp is None or not isinstance(round_id, int):
+            raise InvalidCursor('Malformed cursor')
+        rounds = rounds.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=round_id))
+    
+    page, next_cursor = keyset_page(
+        rounds, WARD_ROUND_PAGE_SIZE, lambda row: [row['timestamp'].isoformat(), row['id']]
+    )
+    type_labels = dict(WardRound.WARD_ROUND_TYPE_CHOICES)
+    for row in page:
+        row['type_display'] = type_labels.get(row['ward_round_type'], row['ward_round_type'])
+        row['truncated'] = len(row['notes_preview']) > WARD_ROUND_PREVIEW_CHARS
+        row['notes_preview'] = row['notes_preview'][:WARD_ROUND_PREVIEW_CHARS]
+    return page, next_cursor
 
 
 def patient_list(request):
@@ -28,7 +191,9 @@ def patient_list(request):
         patients = patients.filter(admission_type=admission_filter)
     
     context = {
-        'patients': patients,
+        'patients': patient_rows(
+            patients, ['presenting_complaint'], overdue_task_count=OVERDUE_TASK_COUNT
+        ),
         'team_filter': team_filter,
         'specialty_filter': specialty_filter,
         'clerking_filter': clerking_filter,
@@ -46,18 +211,65 @@ def patient_list(request):
 
 def patient_detail(request, patient_id):
     """Display detailed view of a single patient"""
-    patient = get_object_or_404(Patient, id=patient_id)
+    patient = get_object_or_404(
+        Patient.objects.select_related('clerking_doctor', 'ptwr_doctor'), id=patient_id
+    )
+    
+    # Only the newest timeline page; older ward rounds load on demand
+    ward_rounds, next_cursor = _ward_round_page(patient.id)
     
     context = {
         'patient': patient,
-        'consult_requests': patient.consult_requests.all(),
-        'ward_rounds': patient.ward_rounds.all()[:10],  # Latest 10
-        'tasks': patient.tasks.filter(status__in=['PENDING', 'IN_PROGRESS']),
+        'consult_requests': patient.consult_requests.select_related('requested_by'),
+        'ward_rounds': ward_rounds,
+        'next_cursor': next_cursor,
+        **_patient_tasks_context(patient),
     }
     
     return render(request, 'patients/patient_detail.html', context)
 
 
+def ward_round_timeline(request, patient_id):
+    """A patient's ward rounds, newest first, one page at a time.
+    
+    The patient page shows the first page; its "Load older" link fetches the
+    next page as a fragment (X-Partial: html) or JSON, or without JavaScript
+    opens it as a page of its own.
+    """
+    patient = get_object_or_404(Patient.objects.only('id', 'name', 'nhi_number'), id=patient_id)
+    partial = _partial_mode(request)
+    try:
+        ward_rounds, next_cursor = _ward_round_page(patient.id, request.GET.get('cursor'))
+    except InvalidCursor:
+        if partial:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        messages.error(request, 'That page link has expired - showing the newest ward rounds')
+        return redirect('ward_round_timeline', patient_id=patient.id)
+    
+    if partial == 'json':
+        return JsonResponse({
+            'results': [dict(row, timestamp=row['timestamp'].isoformat()) for row in ward_rounds],
+            'next_cursor': next_cursor,
+        })
+    context = {
+        'patient': patient,
+        'ward_rounds': ward_rounds,
+        'next_cursor': next_cursor,
+    }
+    if partial:
+        return render(request, 'patients/includes/ward_round_page.html', context)
+    return render(request, 'patients/ward_round_timeline.html', context)
+
+
+def ward_round_notes(request, round_id):
+    """A ward round's full note; for X-Partial requests, the fragment that replaces its preview"""
+    if _partial_mode(request):
+        ward_round = get_object_or_404(WardRound.objects.only('id', 'notes'), id=round_id)
+        return render(request, 'patients/includes/ward_round_notes.html', {'ward_round': ward_round})
+    ward_round = get_object_or_404(WardRound.objects.select_related('patient', 'doctor'), id=round_id)
+    return render(request, 'patients/ward_round_notes.html', {'ward_round': ward_round})
+
+
 def referral_workflow(request, patient_id):
     """Handle patient referral from ED to specialty team"""
     patient = get_object_or_404(Patient, id=patient_id)
@@ -67,6 +279,7 @@ def referral_workflow(request, patient_id):
         messages.error(request, 'Only ED patients can be referred to specialty teams')
         return redirect('patient_detail', patient_id=patient.id)
     
+    conflicts = None
     if request.method == 'POST':
         specialty = request.POST.get('specialty')
         team = request.POST.get('team', '')  # Team is optional, can be blank
@@ -84,10 +297,15 @@ def referral_workflow(request, patient_id):
             patient.clerking_status = 'AWAITING'
             patient.post_take_ward_round_status = 'AWAITING'
             
-            patient.save()
-            team_display = patient.get_current_responsible_team_display() if team else 'No team assigned yet'
-            messages.success(request, f'Patient referred to {patient.get_current_parent_specialty_display()} ({team_display})')
-            return redirect('patient_detail', patient_id=patient.id)
+            _use_form_version(request, patient)
+            try:
+                patient.save()
+            except VersionConflict:
+                patient, conflicts = _merge_conflict(patient, REFERRAL_FIELDS)
+            else:
+                team_display = patient.get_current_responsible_team_display() if team else 'No team assigned yet'
+                messages.success(request, f'Patient referred to {patient.get_current_parent_specialty_display()} ({team_display})')
+                return redirect('patient_detail', patient_id=patient.id)
     
     # Get specialty choices (exclude ED from options)
     specialty_choices = [(code, name) for code, name in Patient.SPECIALTY_CHOICES if code != 'ED']
@@ -97,6 +315,7 @@ def referral_workflow(request, patient_id):
         'patient': patient,
         'specialty_choices': specialty_choices,
         'team_choices': team_choices,
+        'conflicts': conflicts,
     })
 
 
@@ -109,23 +328,38 @@ def clerking_workflow(request, patient_id):
         messages.error(request, 'Clerking workflow not applicable for ED patients')
         return redirect('patient_detail', patient_id=patient.id)
     
+    conflicts = None
     if request.method == 'POST':
         status = request.POST.get('status')
-        doctor = request.POST.get('doctor', '')
+        doctor = Clinician.from_name(request.POST.get('doctor', ''))
+        # Only the first completion is timed, so a reopened and re-completed
+        # clerking is recorded (and counted in the rollups) once
+        newly_completed = status == 'COMPLETED' and patient.clerking_completed_at is None
         
         patient.clerking_status = status
         patient.clerking_doctor = doctor
         
-        if status == 'COMPLETED':
+        if newly_completed:
             patient.clerking_completed_at = timezone.now()
         
-        patient.save()
-        messages.success(request, f'Clerking status updated to {status}')
-        return redirect('patient_detail', patient_id=patient.id)
+        _use_form_version(request, patient)
+        try:
+            # The recorded transitions must not outlive a rejected patient update
+            with transaction.atomic():
+                patient.save()
+                if newly_completed:
+                    record_transitions(patient, 'clerking_completed_at')
+        except VersionConflict:
+            patient, conflicts = _merge_conflict(patient, ['clerking_status', 'clerking_doctor'])
+        else:
+            messages.success(request, f'Clerking status updated to {status}')
+            return redirect('patient_detail', patient_id=patient.id)
     
     context = {
         'patient': patient,
         'status_choices': Patient.CLERKING_STATUS_CHOICES,
+        'clinicians': clinician_choices(),
+        'conflicts': conflicts,
     }
     
     return render(request, 'patients/clerking_workflow.html', context)
@@ -140,32 +374,52 @@ def ptwr_workflow(request, patient_id):
         messages.error(request, 'Post-take ward round workflow not applicable for ED patients')
         return redirect('patient_detail', patient_id=patient.id)
     
+    conflicts = None
     if request.method == 'POST':
         status = request.POST.get('status')
-        doctor = request.POST.get('doctor', '')
+        doctor = Clinician.from_name(request.POST.get('doctor', ''))
         notes = request.POST.get('notes', '')
         
+        if status == 'COMPLETED' and doctor is None:
+            messages.error(request, 'Enter the doctor who completed the post-take ward round')
+            return redirect('ptwr_workflow', patient_id=patient.id)
+        
+        # As with clerking, only the first completion is timed
+        newly_completed = status == 'COMPLETED' and patient.ptwr_completed_at is None
         patient.post_take_ward_round_status = status
         patient.ptwr_doctor = doctor
         
-        if status == 'COMPLETED':
+        if newly_completed:
             patient.ptwr_completed_at = timezone.now()
-            # Create ward round record
-            WardRound.objects.create(
-                patient=patient,
-                ward_round_type='POST_TAKE',
-                doctor=doctor,
-                notes=notes,
-                timestamp=timezone.now()
-            )
         
-        patient.save()
-        messages.success(request, f'Post-take ward round status updated to {status}')
-        return redirect('patient_detail', patient_id=patient.id)
+        _use_form_version(request, patient)
+        try:
+            # The ward round and recorded transitions must not outlive a
+            # rejected patient update
+            with transaction.atomic():
+                patient.save()
+                if newly_completed:
+                    record_transitions(patient, 'ptwr_completed_at')
+                if status == 'COMPLETED':
+                    WardRound.objects.create(
+                        patient=patient,
+                        ward_round_type='POST_TAKE',
+                        doctor=doctor,
+                        notes=notes,
+                        timestamp=timezone.now()
+                    )
+        except VersionConflict:
+            patient, conflicts = _merge_conflict(patient, ['post_take_ward_round_status', 'ptwr_doctor'])
+        else:
+            messages.success(request, f'Post-take ward round status updated to {status}')
+            return redirect('patient_detail', patient_id=patient.id)
     
     context = {
         'patient': patient,
         'status_choices': Patient.PTWR_STATUS_CHOICES,
+        'clinicians': clinician_choices(),
+        'conflicts': conflicts,
+        'notes': request.POST.get('notes', '') if conflicts is not None else '',
     }
     
     return render(request, 'patients/ptwr_workflow.html', context)
@@ -176,9 +430,13 @@ def general_ward_round(request, patient_id):
     patient = get_object_or_404(Patient, id=patient_id)
     
     if request.method == 'POST':
-        doctor = request.POST.get('doctor')
+        doctor = Clinician.from_name(request.POST.get('doctor'))
         notes = request.POST.get('notes')
         
+        if doctor is None:
+            messages.error(request, 'Enter the doctor for this ward round')
+            return redirect('general_ward_round', patient_id=patient.id)
+        
         WardRound.objects.create(
             patient=patient,
             ward_round_type='GENERAL',
@@ -192,6 +450,7 @@ def general_ward_round(request, patient_id):
     
     context = {
         'patient': patient,
+        'clinicians': clinician_choices(),
     }
     
     return render(request, 'patients/general_ward_round.html', context)
@@ -204,7 +463,11 @@ def consult_request(request, patient_id):
     if request.method == 'POST':
         specialty = request.POST.get('specialty')
         reason = request.POST.get('reason')
-        requested_by = request.POST.get('requested_by')
+        requested_by = Clinician.from_name(request.POST.get('requested_by'))
+        
+        if requested_by is None:
+            messages.error(request, 'Enter who is requesting the consult')
+            return redirect('consult_request', patient_id=patient.id)
         
         ConsultRequest.objects.create(
             patient=patient,
@@ -220,6 +483,7 @@ def consult_request(request, patient_id):
     context = {
         'patient': patient,
         'specialty_choices': ConsultRequest.SPECIALTY_CHOICES,
+        'clinicians': clinician_choices(),
     }
     
     return render(request, 'patients/consult_request.html', context)
@@ -232,8 +496,13 @@ def add_task(request, patient_id):
     if request.method == 'POST':
         description = request.POST.get('description')
         priority = request.POST.get('priority')
-        assigned_to = request.POST.get('assigned_to', '')
-        created_by = request.POST.get('created_by')
+        assigned_to = Clinician.from_name(request.POST.get('assigned_to', ''))
+        created_by = Clinician.from_name(request.POST.get('created_by'))
+        due_date = _parse_due_date(request.POST.get('due_date'))
+        
+        if created_by is None:
+            messages.error(request, 'Enter who is creating the task')
+            return redirect('add_task', patient_id=patient.id)
         
         Task.objects.create(
             patient=patient,
@@ -241,7 +510,8 @@ def add_task(request, patient_id):
             priority=priority,
             assigned_to=assigned_to,
             created_by=created_by,
-            created_at=timezone.now()
+            created_at=timezone.now(),
+            due_date=due_date,
         )
         
         messages.success(request, 'Task added')
@@ -250,6 +520,7 @@ def add_task(request, patient_id):
     context = {
         'patient': patient,
         'priority_choices': Task.PRIORITY_CHOICES,
+        'clinicians': clinician_choices(),
     }
     
     return render(request, 'patients/add_task.html', context)
@@ -269,8 +540,19 @@ def complete_admission(request, patient_id):
         return redirect('patient_detail', patient_id=patient.id)
     
     if request.method == 'POST':
+        newly_completed = patient.admission_completed_at is None
         patient.patient_category = 'ACUTE_ADMITTED'
-        patient.save()
+        if newly_completed:
+            patient.admission_completed_at = timezone.now()
+        _use_form_version(request, patient)
+        try:
+            with transaction.atomic():
+                patient.save()
+                if newly_completed:
+                    record_transitions(patient, 'admission_completed_at')
+        except VersionConflict:
+            messages.error(request, 'This patient was updated by someone else - review the changes before completing the admission')
+            return redirect('complete_admission', patient_id=patient.id)
         messages.success(request, 'Admission marked as complete - patient moved to Acute Admitted category')
         return redirect('patient_detail', patient_id=patient.id)
     
@@ -350,7 +632,13 @@ def take_list(request):
     ).count()
     
     context = {
-        'patients': patients,
+        'patients': patient_rows(
+            patients,
+            ['referral_reason', 'referral_to_specialty_datetime'],
+            overdue_task_count=OVERDUE_TASK_COUNT,
+            clerking_doctor_name=F('clerking_doctor__name'),
+            ptwr_doctor_name=F('ptwr_doctor__name'),
+        ),
         'team_filter': team_filter,
         'specialty_filter': specialty_filter,
         'clerking_filter': clerking_filter,
@@ -375,6 +663,56 @@ def take_list(request):
     return render(request, 'patients/take_list.html', context)
 
 
+def kiosk_take_list(request):
+    """Read-only take list for ward wall boards and shared screens.
+    
+    Rendered without the request (no session, CSRF token or messages), so
+    everyone asking for the same filters gets the same bytes, and identical
+    concurrent requests share a single query and render (see
+    patients.singleflight). The X-Single-Flight header says which role this
+    response played.
+    """
+    filters = {
+        name: request.GET[name]
+        for name, (_, labels) in KIOSK_FILTERS.items()
+        if request.GET.get(name) in labels
+    }
+    
+    def render_board():
+        patients = Patient.objects.filter(
+            patient_category='ACUTE_INPROCESS',
+            **{KIOSK_FILTERS[name][0]: value for name, value in filters.items()},
+        ).order_by('referral_to_specialty_datetime', 'datetime_of_arrival')
+        context = {
+            'patients': patient_rows(
+                patients, ['referral_to_specialty_datetime'], overdue_task_count=OVERDUE_TASK_COUNT,
+            ),
+            'workflow_stats': patients.aggregate(
+                awaiting_clerking=Count('id', filter=Q(clerking_status='AWAITING')),
+                clerking_in_progress=Count('id', filter=Q(clerking_status='IN_PROGRESS')),
+                awaiting_ptwr=Count('id', filter=Q(clerking_status='COMPLETED', post_take_ward_round_status='AWAITING')),
+                ptwr_in_progress=Count('id', filter=Q(post_take_ward_round_status='IN_PROGRESS')),
+                ready_to_complete=Count(
+                    'id', filter=Q(clerking_status='COMPLETED', post_take_ward_round_status='COMPLETED')
+                ),
+            ),
+            'team_display': KIOSK_FILTERS['team'][1].get(filters.get('team')),
+            'specialty_display': KIOSK_FILTERS['specialty'][1].get(filters.get('specialty')),
+            'generated_at': timezone.localtime(),
+            'refresh_seconds': settings.KIOSK_REFRESH_SECONDS,
+        }
+        return render_to_string('patients/kiosk_take_list.html', context).encode()
+    
+    if settings.SINGLE_FLIGHT:
+        key = 'kiosk_take_list?' + urlencode(sorted(filters.items()))
+        content, role = single_flight(key, render_board, 'kiosk_take_list')
+    else:
+        content, role = render_board(), 'leader'
+    response = HttpResponse(content)
+    response['X-Single-Flight'] = role
+    return response
+
+
 def change_specialty(request, patient_id):
     """Change patient specialty/team (for admitted patients)"""
     patient = get_object_or_404(Patient, id=patient_id)
@@ -384,6 +722,7 @@ def change_specialty(request, patient_id):
         messages.error(request, 'ED patients must use the referral workflow')
         return redirect('patient_detail', patient_id=patient.id)
     
+    conflicts = None
     if request.method == 'POST':
         new_specialty = request.POST.get('specialty')
         
@@ -399,46 +738,71 @@ def change_specialty(request, patient_id):
             
             patient.current_parent_specialty = new_specialty
             patient.current_responsible_team = new_team
-            patient.save()
             
-            messages.success(request, f'Specialty changed to {patient.get_current_parent_specialty_display()} ({patient.get_current_responsible_team_display()})')
-            return redirect('patient_detail', patient_id=patient.id)
+            _use_form_version(request, patient)
+            try:
+                patient.save()
+            except VersionConflict:
+                patient, conflicts = _merge_conflict(patient, ['current_parent_specialty'])
+            else:
+                messages.success(request, f'Specialty changed to {patient.get_current_parent_specialty_display()} ({patient.get_current_responsible_team_display()})')
+                return redirect('patient_detail', patient_id=patient.id)
     
     specialty_choices = [(code, name) for code, name in Patient.SPECIALTY_CHOICES if code != 'ED']
     
     context = {
         'patient': patient,
         'specialty_choices': specialty_choices,
+        'conflicts': conflicts,
     }
     
     return render(request, 'patients/change_specialty.html', context)
 
 
-def toggle_priority(request, patient_id):
-    """Toggle priority flag for patient"""
+def _toggle_flag(request, patient_id, field, label):
+    """Flip a boolean patient flag; answers partial requests with the flag fragments"""
     patient = get_object_or_404(Patient, id=patient_id)
-    patient.priority_flag = not patient.priority_flag
-    patient.save()
+    setattr(patient, field, not getattr(patient, field))
+    _use_form_version(request, patient)
+    partial = _partial_mode(request)
+    conflict = 'This patient was updated by someone else - check the current flags and try again'
+    try:
+        patient.save()
+    except VersionConflict:
+        if partial:
+            return _partial_conflict(partial, conflict)
+        messages.error(request, conflict)
+        return redirect('patient_detail', patient_id=patient.id)
     
-    status = "enabled" if patient.priority_flag else "disabled"
-    messages.success(request, f'Priority flag {status}')
+    status = "enabled" if getattr(patient, field) else "disabled"
+    message = f'{label} {status}'
+    if partial:
+        data = {'patient': {
+            'id': patient.id,
+            'priority_flag': patient.priority_flag,
+            'weekend_review': patient.weekend_review,
+            'version': patient.version,
+        }}
+        return _partial_response(
+            request, partial, 'patients/includes/patient_flags.html', {'patient': patient}, data, message,
+        )
+    messages.success(request, message)
     return redirect('patient_detail', patient_id=patient.id)
 
 
+def toggle_priority(request, patient_id):
+    """Toggle priority flag for patient"""
+    return _toggle_flag(request, patient_id, 'priority_flag', 'Priority flag')
+
+
 def toggle_weekend_review(request, patient_id):
     """Toggle weekend review flag for patient"""
-    patient = get_object_or_404(Patient, id=patient_id)
-    patient.weekend_review = not patient.weekend_review
-    patient.save()
-    
-    status = "enabled" if patient.weekend_review else "disabled"
-    messages.success(request, f'Weekend review flag {status}')
-    return redirect('patient_detail', patient_id=patient.id)
+    return _toggle_flag(request, patient_id, 'weekend_review', 'Weekend review flag')
 
 
 def consults_list(request):
     """Display all consultation requests with specialty breakdown"""
-    consults = ConsultRequest.objects.all().select_related('patient')
+    consults = ConsultRequest.objects.all().select_related('patient', 'requested_by', 'reviewed_by')
     
     # Apply filters
     status_filter = request.GET.get('status')
@@ -480,29 +844,156 @@ def consults_list(request):
     return render(request, 'patients/consults_list.html', context)
 
 
+def _consult_queues(specialty_filter=None):
+    """Per-specialty REQUESTED/ACCEPTED/IN_PROGRESS queues, longest waiting first"""
+    specialties = [
+        (code, name) for code, name in ConsultRequest.SPECIALTY_CHOICES
+        if not specialty_filter or code == specialty_filter
+    ]
+    
+    counts = {}
+    open_consults = ConsultRequest.objects.filter(status__in=ConsultRequest.QUEUE_STATUSES)
+    if specialty_filter:
+        open_consults = open_consults.filter(specialty=specialty_filter)
+    for row in open_consults.order_by().values('specialty', 'status').annotate(n=Count('id')):
+        counts[(row['specialty'], row['status'])] = row['n']
+    
+    status_names = dict(ConsultRequest.STATUS_CHOICES)
+    queues = []
+    for code, name in specialties:
+        lanes = []
+        for status in ConsultRequest.QUEUE_STATUSES:
+            total = counts.get((code, status), 0)
+            # Skip the query entirely for empty lanes
+            rows = []
+            if total:
+                rows = list(
+                    ConsultRequest.objects.filter(specialty=code, status=status)
+                    .select_related('patient', 'requested_by')
+                    .with_timers()
+                    .order_by('requested_at')[:CONSULT_QUEUE_LIMIT]
+                )
+            lanes.append({
+                'status': status,
+                'status_display': status_names[status],
+                'total': total,
+                'consults': rows,
+            })
+        queues.append({
+            'specialty': code,
+            'specialty_display': name,
+            'total': sum(lane['total'] for lane in lanes),
+            'lanes': lanes,
+        })
+    return queues
+
+
+def consult_queues(request):
+    """Display per-specialty consult work queues with SLA timers"""
+    specialty_filter = request.GET.get('specialty')
+    
+    context = {
+        'queues': _consult_queues(specialty_filter),
+        'specialty_filter': specialty_filter,
+        'specialty_choices': ConsultRequest.SPECIALTY_CHOICES,
+        'accept_sla_hours': settings.CONSULT_ACCEPT_SLA_HOURS,
+        'complete_sla_hours': settings.CONSULT_COMPLETE_SLA_HOURS,
+    }
+    
+    return render(request, 'patients/consult_queues.html', context)
+
+
+def consult_queues_api(request):
+    """JSON consult queues for ward wall boards"""
+    def seconds(duration):
+        return int(duration.total_seconds())
+    
+    queues = _consult_queues(request.GET.get('specialty'))
+    
+    return JsonResponse({
+        'generated_at': timezone.now().isoformat(),
+        'sla_hours': {
+            'accept': settings.CONSULT_ACCEPT_SLA_HOURS,
+            'complete': settings.CONSULT_COMPLETE_SLA_HOURS,
+        },
+        'queues': [
+            {
+                'specialty': queue['specialty'],
+                'total': queue['total'],
+                'lanes': [
+                    {
+                        'status': lane['status'],
+                        'total': lane['total'],
+                        'consults': [
+                            {
+                                'id': consult.id,
+                                'patient': consult.patient.name,
+                                'nhi_number': consult.patient.nhi_number,
+                                'location': consult.patient.get_location_display_full(),
+                                'requested_by': consult.requested_by.name,
+                                'requested_at': consult.requested_at.isoformat(),
+                                'waiting_seconds': seconds(consult.waiting),
+                                'time_to_accept_seconds': seconds(consult.time_to_accept),
+                                'time_to_complete_seconds': seconds(consult.time_to_complete),
+                                'accept_breached': consult.accept_breached,
+                                'complete_breached': consult.complete_breached,
+                            }
+                            for consult in lane['consults']
+                        ],
+                    }
+                    for lane in queue['lanes']
+                ],
+            }
+            for queue in queues
+        ],
+    })
+
+
 def update_consult_status(request, consult_id):
     """Update consult request status with reviewer details"""
-    consult = get_object_or_404(ConsultRequest, id=consult_id)
+    consult = get_object_or_404(ConsultRequest.objects.select_related('patient', 'requested_by'), id=consult_id)
     
     if request.method == 'POST':
         new_status = request.POST.get('status')
-        reviewed_by = request.POST.get('reviewed_by', '')
-        comments = request.POST.get('comments', '')
-        
+        previous_status = consult.status
         consult.status = new_status
-        consult.reviewed_by = reviewed_by
-        consult.comments = comments
+        # The consult list's quick status change posts only the status
+        if 'reviewed_by' in request.POST:
+            consult.reviewed_by = Clinician.from_name(request.POST['reviewed_by'])
+        if 'comments' in request.POST:
+            consult.comments = request.POST['comments']
         
+        now = timezone.now()
         if new_status in ['ACCEPTED', 'IN_PROGRESS', 'COMPLETED', 'DECLINED']:
-            consult.reviewed_at = timezone.now()
+            consult.reviewed_at = now
+        # The SLA timers stop at the first acceptance and at completion
+        if new_status in ConsultRequest.ACCEPTED_STATUSES and consult.accepted_at is None:
+            consult.accepted_at = now
+        if new_status == 'COMPLETED' and previous_status != 'COMPLETED':
+            consult.completed_at = now
         
         consult.save()
-        messages.success(request, f'Consult status updated to {consult.get_status_display()}')
+        message = f'Consult status updated to {consult.get_status_display()}'
+        partial = _partial_mode(request)
+        if partial:
+            data = {'consult': {
+                'id': consult.id,
+                'status': consult.status,
+                'status_display': consult.get_status_display(),
+                'reviewed_by': str(consult.reviewed_by or ''),
+                'reviewed_at': consult.reviewed_at,
+            }}
+            context = {'consult': consult, 'status_choices': ConsultRequest.STATUS_CHOICES}
+            return _partial_response(
+                request, partial, 'patients/includes/consult_row.html', context, data, message,
+            )
+        messages.success(request, message)
         return redirect('consults_list')
     
     context = {
         'consult': consult,
         'status_choices': ConsultRequest.STATUS_CHOICES,
+        'clinicians': clinician_choices(),
     }
     
     return render(request, 'patients/update_consult.html', context)
@@ -512,54 +1003,80 @@ def edit_patient_info(request, patient_id):
     """Edit patient clinical information"""
     patient = get_object_or_404(Patient, id=patient_id)
     
+    conflicts = None
     if request.method == 'POST':
-        patient.presenting_complaint = request.POST.get('presenting_complaint', '')
-        patient.summary = request.POST.get('summary', '')
-        patient.past_medical_history = request.POST.get('past_medical_history', '')
-        patient.issues = request.POST.get('issues', '')
-        patient.save()
+        for field in PATIENT_INFO_FIELDS:
+            setattr(patient, field, request.POST.get(field, ''))
         
-        messages.success(request, 'Patient information updated successfully')
-        return redirect('patient_detail', patient_id=patient.id)
+        _use_form_version(request, patient)
+        try:
+            patient.save()
+        except VersionConflict:
+            patient, conflicts = _merge_conflict(patient, PATIENT_INFO_FIELDS)
+        else:
+            messages.success(request, 'Patient information updated successfully')
+            return redirect('patient_detail', patient_id=patient.id)
     
-    return render(request, 'patients/edit_patient_info.html', {'patient': patient})
+    return render(request, 'patients/edit_patient_info.html', {'patient': patient, 'conflicts': conflicts})
 
 
 def edit_task(request, task_id):
     """Edit or update task status"""
-    task = get_object_or_404(Task, id=task_id)
+    task = get_object_or_404(Task.objects.select_related('patient'), id=task_id)
     
     if request.method == 'POST':
         action = request.POST.get('action')
+        message = None
         
         if action == 'update':
             task.description = request.POST.get('description', task.description)
             task.priority = request.POST.get('priority', task.priority)
             task.status = request.POST.get('status', task.status)
-            task.assigned_to = request.POST.get('assigned_to', task.assigned_to)
+            if 'assigned_to' in request.POST:
+                task.assigned_to = Clinician.from_name(request.POST['assigned_to'])
+            if 'due_date' in request.POST:
+                task.due_date = _parse_due_date(request.POST['due_date'])
             
             if task.status == 'COMPLETED' and not task.completed_at:
                 task.completed_at = timezone.now()
             
             task.save()
-            messages.success(request, 'Task updated successfully')
+            message = 'Task updated successfully'
         elif action == 'complete':
             task.status = 'COMPLETED'
             task.completed_at = timezone.now()
             task.save()
-            messages.success(request, 'Task marked as completed')
+            message = 'Task marked as completed'
         elif action == 'delete':
-            patient_id = task.patient.id
+            task_pk = task.pk
             task.delete()
-            messages.success(request, 'Task deleted')
-            return redirect('patient_detail', patient_id=patient_id)
+            message = 'Task deleted'
         
+        partial = _partial_mode(request)
+        if partial and message:
+            # The pending tasks card is re-rendered whole so its count stays right
+            if action == 'delete':
+                data = {'deleted': {'task': task_pk}}
+            else:
+                data = {'task': {
+                    'id': task.id,
+                    'status': task.status,
+                    'priority': task.priority,
+                    'completed_at': task.completed_at,
+                }}
+            return _partial_response(
+                request, partial, 'patients/includes/patient_tasks.html',
+                _patient_tasks_context(task.patient), data, message,
+            )
+        if message:
+            messages.success(request, message)
         return redirect('patient_detail', patient_id=task.patient.id)
     
     return render(request, 'patients/edit_task.html', {
         'task': task,
         'priority_choices': Task.PRIORITY_CHOICES,
         'status_choices': Task.STATUS_CHOICES,
+        'clinicians': clinician_choices(),
     })
 
 
@@ -572,14 +1089,20 @@ def update_team(request, patient_id):
         messages.error(request, 'ED patients must be referred to a specialty first')
         return redirect('patient_detail', patient_id=patient.id)
     
+    conflicts = None
     if request.method == 'POST':
         team = request.POST.get('team', '')
         patient.current_responsible_team = team
-        patient.save()
         
-        team_display = patient.get_current_responsible_team_display() if team else 'No team assigned'
-        messages.success(request, f'Team updated to {team_display}')
-        return redirect('patient_detail', patient_id=patient.id)
+        _use_form_version(request, patient)
+        try:
+            patient.save()
+        except VersionConflict:
+            patient, conflicts = _merge_conflict(patient, ['current_responsible_team'])
+        else:
+            team_display = patient.get_current_responsible_team_display() if team else 'No team assigned'
+            messages.success(request, f'Team updated to {team_display}')
+            return redirect('patient_detail', patient_id=patient.id)
     
     # Get team choices (exclude ED)
     team_choices = [(code, name) for code, name in Patient.TEAM_CHOICES if code != 'ED']
@@ -587,6 +1110,7 @@ def update_team(request, patient_id):
     return render(request, 'patients/update_team.html', {
         'patient': patient,
         'team_choices': team_choices,
+        'conflicts': conflicts,
     })
 
 
@@ -610,14 +1134,16 @@ def weekend_review_list(request):
     if location_filter:
         patients = patients.filter(location=location_filter)
     
+    rows = patient_rows(patients)
+    
     # Organize by specialty
     specialty_counts = {}
-    for patient in patients:
-        specialty = patient.get_current_parent_specialty_display() if patient.current_parent_specialty else 'Unassigned'
+    for row in rows:
+        specialty = row.specialty_display or 'Unassigned'
         specialty_counts[specialty] = specialty_counts.get(specialty, 0) + 1
     
     context = {
-        'patients': patients,
+        'patients': rows,
         'team_filter': team_filter,
         'specialty_filter': specialty_filter,
         'category_filter': category_filter,
@@ -627,7 +1153,236 @@ def weekend_review_list(request):
         'category_choices': [(code, name) for code, name in Patient.PATIENT_CATEGORY_CHOICES if code != 'ED'],
         'location_choices': Patient.LOCATION_CHOICES,
         'specialty_counts': specialty_counts,
-        'total_count': patients.count(),
+        'total_count': len(rows),
     }
     
     return render(request, 'patients/weekend_review_list.html', context)
+
+
+def _filtered_worklist(request):
+    """Build the cross-patient task worklist queryset from GET filters"""
+    filters = {
+        'assignee': request.GET.get('assignee', ''),
+        'status': request.GET.get('status', ''),
+        'priority': request.GET.get('priority', ''),
+        'due': request.GET.get('due', ''),
+    }
+    
+    tasks = Task.objects.select_related('patient', 'assigned_to', 'created_by')
+    
+    if filters['assignee'].isdigit():
+        tasks = tasks.filter(assigned_to_id=filters['assignee'])
+    
+    # Default to open work; 'ALL' includes completed and cancelled tasks
+    if filters['status'] == 'ALL':
+        pass
+    elif filters['status']:
+        tasks = tasks.filter(status=filters['status'])
+    else:
+        tasks = tasks.open()
+    
+    if filters['priority']:
+        tasks = tasks.filter(priority=filters['priority'])
+    
+    now = timezone.now()
+    if filters['due'] == 'overdue':
+        tasks = tasks.filter(due_date__lt=now)
+    elif filters['due'] == 'today':
+        tasks = tasks.filter(due_date__lt=now + timedelta(hours=24))
+    elif filters['due'] == 'week':
+        tasks = tasks.filter(due_date__lt=now + timedelta(days=7))
+    elif filters['due'] == 'none':
+        tasks = tasks.filter(due_date__isnull=True)
+    
+    tasks = tasks.in_worklist_order()
+    
+    cursor = request.GET.get('cursor')
+    if cursor:
+        tasks = tasks.after(decode_cursor(cursor, length=3))
+    
+    return tasks, filters
+
+
+def task_worklist(request):
+    """Display tasks across all patients, most urgent first"""
+    try:
+        tasks, filters = _filtered_worklist(request)
+    except InvalidCursor:
+        messages.error(request, 'That page link has expired - showing the first page')
+        return redirect('task_worklist')
+    
+    page, next_cursor = keyset_page(tasks, WORKLIST_PAGE_SIZE, Task.worklist_cursor)
+    
+    # Preserve filters on the "next page" link
+    next_query = request.GET.copy()
+    if next_cursor:
+        next_query['cursor'] = next_cursor
+    
+    clinicians = clinician_choices()
+    
+    context = {
+        'tasks': page,
+        'next_cursor': next_cursor,
+        'next_query': next_query.urlencode(),
+        'is_first_page': not request.GET.get('cursor'),
+        'assignee_filter': filters['assignee'],
+        'status_filter': filters['status'],
+        'priority_filter': filters['priority'],
+        'due_filter': filters['due'],
+        'assignee_name': dict(clinicians).get(int(filters['assignee'])) if filters['assignee'].isdigit() else None,
+        'clinicians': clinicians,
+        'status_choices': Task.STATUS_CHOICES,
+        'priority_choices': Task.PRIORITY_CHOICES,
+    }
+    
+    return render(request, 'patients/task_worklist.html', context)
+
+
+def task_worklist_api(request):
+    """JSON task worklist with keyset pagination"""
+    try:
+        tasks, filters = _filtered_worklist(request)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    page, next_cursor = keyset_page(tasks, WORKLIST_PAGE_SIZE, Task.worklist_cursor)
+    
+    return JsonResponse({
+        'results': [
+            {
+                'id': task.id,
+                'patient': {
+                    'id': task.patient.id,
+                    'name': task.patient.name,
+                    'nhi_number': task.patient.nhi_number,
+                    'location': task.patient.get_location_display_full(),
+                },
+                'description': task.description,
+                'priority': task.priority,
+                'status': task.status,
+                'assigned_to': task.assigned_to.name if task.assigned_to else None,
+                'created_by': task.created_by.name,
+                'created_at': task.created_at.isoformat(),
+                'due_date': task.due_date.isoformat() if task.due_date else None,
+            }
+            for task in page
+        ],
+        'next_cursor': next_cursor,
+    })
+
+
+def sync_api(request):
+    """Delta sync: rows created, updated or deleted since the client's cursor.
+    
+    Call without a cursor for a full snapshot, then keep passing back the
+    returned cursor; repeat immediately while has_more is true.
+    """
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), SYNC_MAX_PAGE_SIZE) if limit.isdigit() and int(limit) > 0 else SYNC_PAGE_SIZE
+    
+    try:
+        changes, cursor, has_more = changes_since(request.GET.get('cursor') or None, limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except CursorExpired:
+        return JsonResponse({'error': 'Cursor expired - resync without a cursor'}, status=410)
+    
+    return JsonResponse(dict(changes, cursor=cursor, has_more=has_more))
+
+
+def take_flow_report(request):
+    """Take-flow timing percentiles, read only from the hourly rollups"""
+    days = request.GET.get('days', '7')
+    days = int(days) if days.isdigit() and int(days) in TAKE_FLOW_WINDOWS else 7
+    specialty_filter = request.GET.get('specialty', '')
+    team_filter = request.GET.get('team', '')
+    
+    since = timezone.now() - timedelta(days=days)
+    
+    context = {
+        'metrics': summarize_rollups(since, specialty=specialty_filter, team=team_filter),
+        'days': days,
+        'windows': TAKE_FLOW_WINDOWS,
+        'specialty_filter': specialty_filter,
+        'team_filter': team_filter,
+        'specialty_choices': [(code, name) for code, name in Patient.SPECIALTY_CHOICES if code != 'ED'],
+        'team_choices': [(code, name) for code, name in Patient.TEAM_CHOICES if code],
+    }
+    
+    return render(request, 'patients/take_flow_report.html', context)
+
+
+def cohort_analytics(request):
+    """Length-of-stay and workflow-timing percentiles by cohort (HTML, JSON or CSV)"""
+    days = request.GET.get('days', '90')
+    days = int(days) if days.isdigit() and int(days) in TAKE_FLOW_WINDOWS else 90
+    group_by = request.GET.get('by', 'specialty')
+    if group_by not in DIMENSIONS:
+        group_by = 'specialty'
+    export = request.GET.get('format')
+    
+    patients = Patient.objects.filter(datetime_of_arrival__gte=timezone.now() - timedelta(days=days))
+    try:
+        report = cohort_report(patients)
+    except AnalyticsUnavailable:
+        report = None
+    
+    if export == 'json' and report is not None:
+        return JsonResponse(report)
+    if export == 'csv' and report is not None:
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="cohort-{days}d.csv"'
+        write_report_csv(report, response)
+        return response
+    
+    metrics = []
+    if report is not None:
+        for metric, data in report['metrics'].items():
+            metrics.append({
+                'name': metric.replace('_', ' ').capitalize(),
+                'overall': data['overall'],
+                'histogram': data['histogram'],
+                'groups': data['by'][group_by],
+            })
+    
+    context = {
+        'report': report,
+        'metrics': metrics,
+        'days': days,
+        'windows': TAKE_FLOW_WINDOWS,
+        'group_by': group_by,
+        'dimensions': [(name, name.replace('_', ' ').capitalize()) for name in DIMENSIONS],
+    }
+    
+    return render(request, 'patients/cohort_analytics.html', context)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint (bearer token required when METRICS_TOKEN is set)"""
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def profile_list(request):
+    """Request profiles captured with ?profile=1, newest first"""
+    context = dict(admin.site.each_context(request), title='Request profiles', profiles=list_profiles())
+    return render(request, 'admin/patients/profile_list.html', context)
+
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    """Top functions and slowest queries of one captured profile; ?download=1 for the raw stats"""
+    if request.GET.get('download'):
+        path = stats_path(profile_id)
+        if path is None:
+            raise Http404('Profile not found')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
+    
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+    context = dict(admin.site.each_context(request), title=f"Profile of {profile['path']}", profile=profile)
+    return render(request, 'admin/patients/profile_detail.html', context)
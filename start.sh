@@ -26,6 +26,12 @@ python manage.py reset_admin
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
-# Start the server
+# Metric files left by the previous run's workers would be summed into the
+# new totals; start from zero so Prometheus sees an ordinary counter reset
+echo "Clearing metrics directory..."
+rm -rf "${METRICS_DIR:-metrics}"
+
+# Start the server. Threaded workers let polls keep running while a heavy
+# list renders; ENDPOINT_LIMITS in settings caps each class per worker.
 echo "Starting Gunicorn server..."
-exec gunicorn medlyst_project.wsgi:application --bind 0.0.0.0:$PORT
\ No newline at end of file
+exec gunicorn medlyst_project.wsgi:application --bind 0.0.0.0:$PORT --threads "${GUNICORN_THREADS:-8}"
\ No newline at end of file